@@ -0,0 +1,197 @@
+import os
+import sys
+import random
+import socket
+import argparse
+import subprocess
+from pathlib import Path
+
+# Headless runs don't need a window nor a sound card.
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("MEMORY_TRACKING", "1")
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+import pygame
+import pygame.freetype
+
+import memory
+import settings
+from clock import GameClock, set_game_clock
+from coop import CoopGame
+from latency import LatencyTracker, set_latency_tracker
+from netplay import Puppet
+from render import BACKEND_TEXTURE
+from scenes import Game
+from stage import Stage
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run The Alchemist without a display.")
+    parser.add_argument("--seconds", type=float, default=10, help="Game seconds.")
+    parser.add_argument(
+        "--restarts",
+        type=int,
+        default=None,
+        help="Restarts spread over the run, 3 by default, none with --horde.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--speed", type=float, default=1, help="Speed multiplier with --realtime."
+    )
+    parser.add_argument(
+        "--realtime",
+        action="store_true",
+        help="Pace frames like the game does, instead of running at full speed.",
+    )
+    parser.add_argument(
+        "--horde", action="store_true", help="Play the endless horde mode."
+    )
+    parser.add_argument(
+        "--invulnerable",
+        action="store_true",
+        help="Mobs don't kill the player, so the horde keeps growing.",
+    )
+    parser.add_argument(
+        "--coop",
+        action="store_true",
+        help="Play the co-op horde over netplay, both alchemists on autopilot.",
+    )
+    parser.add_argument(
+        "--pair",
+        action="store_true",
+        help="With --coop, the other alchemist runs the whole game too, in a "
+        "second headless process over UDP on localhost, and both compare "
+        "digests of their games to tell when they go apart.",
+    )
+    parser.add_argument(
+        "--latency",
+        action="store_true",
+        help="Tap movement keys at random and report input latency, best with "
+        "--realtime.",
+    )
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    args = parser.parse_args()
+    if args.restarts is None:
+        # A restart starts the waves over, a horde has to keep growing.
+        args.restarts = 0 if args.horde else 3
+    return args
+
+
+def schedule(clock: GameClock, event: pygame.event.Event, seconds, until=None):
+    # Posted on game frames rather than wall time, so every run sees the same
+    # events on the same frames.
+    step = max(round(seconds * clock.framerate), 1)
+    last = round((until or seconds) * clock.framerate)
+    for frame in range(step, last + 1, step):
+        clock.post_at(clock.frames + frame, event)
+
+
+def schedule_taps(clock: GameClock, seconds, until, seed):
+    # A random arrow key every so often, each press lasting a single frame.
+    picker = random.Random(seed)
+    keys = (pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT)
+    frame = 0
+    while True:
+        frame += picker.randint(1, 2 * max(round(seconds * clock.framerate), 1))
+        if frame > until * clock.framerate:
+            return
+        event = pygame.event.Event(pygame.KEYDOWN, key=picker.choice(keys))
+        clock.post_at(clock.frames + frame, event)
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def run_guest(args, host_port: int, guest_port: int) -> subprocess.Popen:
+    # Player 1, with the same run but not the same port.
+    command = [sys.executable, __file__, "--coop", "--seconds", str(args.seconds)]
+    command += ["--seed", str(args.seed), "--width", str(args.width)]
+    command += ["--height", str(args.height)]
+    if args.invulnerable:
+        command.append("--invulnerable")
+    environment = dict(
+        os.environ,
+        NETPLAY_PLAYER="1",
+        NETPLAY_PEER=f"127.0.0.1:{host_port}",
+        NETPLAY_PORT=str(guest_port),
+    )
+    return subprocess.Popen(command, env=environment, stdout=subprocess.PIPE, text=True)
+
+
+def run(args) -> Game:
+    pygame.init()
+    pygame.mixer.init()
+    pygame.freetype.init()
+    display_size = (args.width, args.height)
+    # The texture backend shares the renderer pygame creates for SCALED modes.
+    flags = pygame.SCALED if settings.RENDER_BACKEND == BACKEND_TEXTURE else 0
+    screen = memory.track(
+        pygame.display.set_mode(display_size, flags), memory.ORIGIN_DISPLAY
+    )
+    random.seed(args.seed)
+    clock = set_game_clock(GameClock(scale=args.speed, throttled=args.realtime))
+    if args.latency:
+        set_latency_tracker(LatencyTracker())
+    if args.coop:
+        # Stops on its own after the frames, waiting for the other player and
+        # catching up don't count.
+        game = CoopGame(screen, display_size)
+        game.invulnerable = args.invulnerable
+        game.autopilot = Puppet(seed=settings.NETPLAY_PLAYER)
+        game.frames_to_play = round(args.seconds * clock.framerate)
+        guest = None
+        if args.pair:
+            game.port, guest_port = free_port(), free_port()
+            game.peer = f"127.0.0.1:{guest_port}"
+            guest = run_guest(args, game.port, guest_port)
+        Stage().run(game)
+        if guest:
+            for line in guest.communicate()[0].splitlines():
+                if line.startswith("Netplay"):
+                    print(f"Guest: {line}")
+        return game
+    game = Game(screen, display_size)
+    game.invulnerable = args.invulnerable
+
+    schedule(
+        clock, pygame.event.Event(pygame.KEYDOWN, key=pygame.K_SPACE), 0.4, args.seconds
+    )
+    if args.restarts:
+        schedule(
+            clock,
+            pygame.event.Event(pygame.KEYDOWN, key=pygame.K_r),
+            args.seconds / (args.restarts + 1),
+            args.seconds - 0.1,
+        )
+    if args.latency:
+        schedule_taps(clock, 0.25, args.seconds - 0.1, args.seed)
+    schedule(
+        clock, pygame.event.Event(pygame.KEYDOWN, key=pygame.K_ESCAPE), args.seconds
+    )
+    Stage().run(game, endless=args.horde)
+    return game
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    game = run(args)
+    print(memory.report(memory.snapshot()))
+    print(f"Streamed music saves {game.music.memory_saved() / 1024:.1f} KiB")
+    if game.memory_monitor.growth:
+        print("Surface growth between restarts:")
+        for label, origin, count, size in game.memory_monitor.growth:
+            print(f"  {label}: {origin} +{count} surfaces, +{size} bytes")
+    if game.capacity:
+        print("Horde capacity:")
+        print(game.capacity.report())
+    if args.coop:
+        print(game.session.report())
+    print(game.garbage.report())
+    if game.latency:
+        print(game.latency.report())
+    pygame.quit()
@@ -1,12 +1,44 @@
-import cProfile
-import pstats
-from pstats import SortKey
+import os
+import sys
+import argparse
+from pathlib import Path
 
-from src.TheAlchemist import main as real_main
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Profile The Alchemist. Arguments not listed here go to "
+        "run_headless.py when --headless is given."
+    )
+    parser.add_argument("--mode", choices=("cprofile", "sampling"), default="cprofile")
+    parser.add_argument(
+        "--target",
+        choices=("play", "level", "hotkey"),
+        default="play",
+        help="Profile the whole game, only --level, or between presses of F3.",
+    )
+    parser.add_argument("--level", type=int, default=1)
+    parser.add_argument("--output", default="./profiles")
+    parser.add_argument(
+        "--headless", action="store_true", help="Play through run_headless.py."
+    )
+    return parser.parse_known_args()
 
 
 if __name__ == "__main__":
-    cProfile.run("real_main()", "profile.txt")
+    args, rest = parse_args()
+    from profiling import Profiler, set_profiler
+
+    set_profiler(Profiler(args.mode, args.target, args.level, args.output))
+    if args.headless:
+        import run_headless
+
+        sys.argv = [sys.argv[0], *rest]
+        run_headless.run(run_headless.parse_args())
+    else:
+        from TheAlchemist import main
 
-    p = pstats.Stats("profile.txt")
-    p.strip_dirs().sort_stats(SortKey.TIME).print_stats(10)
+        if hasattr(sys, "_MEIPASS"):
+            os.chdir(sys._MEIPASS)
+        main()
@@ -8,10 +8,15 @@ import pygame
 import pygame.freetype
 
 import settings
-from constants import MAIN_MENU_SOUND
-from scenes import Game, CreditsScene, ControlsScene
-from sprites.ui import MainMenu
+from music import get_music_manager
+from arena import Arena
+from scenes import Game, CreditsScene, ControlsScene, MenuScene
+from coop import CoopGame
+from sprites.images import load_sprites
+from stage import Stage
 from transformations import greyscale
+from memory import track, ORIGIN_BACKGROUND, ORIGIN_DISPLAY
+from garbage import get_garbage_policy
 
 Size = namedtuple("Size", ["width", "height"])
 logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.DEBUG)
@@ -21,7 +26,6 @@ def main():
     pygame.init()
     pygame.mixer.init()
     pygame.freetype.init()
-    main_clock = pygame.time.Clock()
     monitor_info = pygame.display.Info()
     display_size = Size(width=monitor_info.current_w, height=monitor_info.current_h)
 
@@ -41,65 +45,29 @@ def main():
         )
 
     # Scenes (Main Menu, Credits, Game itself...)
-    game = Game(screen, display_size, main_clock)
+    track(screen, ORIGIN_DISPLAY)
+    game = Game(screen, display_size)
+    coop_game = CoopGame(screen, display_size)
 
-    menu_background = greyscale(game.background)
-    main_menu_sound = pygame.mixer.Sound(MAIN_MENU_SOUND)
-    main_menu_sound.set_volume(settings.VOLUME)
-    main_menu_sound.play(loops=-1)
-
-    main_menu = MainMenu(screen)
-    main_menu_sprites = pygame.sprite.RenderUpdates(main_menu)
-
-    credits_scene = CreditsScene(screen, display_size, main_clock, menu_background)
-    controls_scene = ControlsScene(screen, display_size, main_clock, menu_background)
-
-    screen.blit(menu_background, (0, 0, *screen.get_size()))
-    pygame.display.flip()
-
-    run = True
-    force_quit = False
-    selected_option = main_menu.selected_option
-    while run:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT or force_quit:
-                run = False
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_q:
-                    run = False
-                elif event.key == pygame.K_RETURN:
-                    if selected_option == MainMenu.options.START:
-                        pygame.key.set_repeat(1, 32)
-                        main_menu_sound.stop()
-                        force_quit = game.play()
-                        ### Restore main menu ###
-                        screen.blit(menu_background, (0, 0, *screen.get_size()))
-                        pygame.display.flip()
-                        main_menu_sound.set_volume(settings.VOLUME)
-                        main_menu_sound.play(loops=-1)
-                        pygame.key.set_repeat()
-                    elif selected_option == MainMenu.options.CREDITS:
-                        force_quit = credits_scene.play()
-                        screen.blit(menu_background, (0, 0, *screen.get_size()))
-                        pygame.display.flip()
-                    elif selected_option == MainMenu.options.CONTROLS:
-                        force_quit = controls_scene.play()
-                        screen.blit(menu_background, (0, 0, *screen.get_size()))
-                        pygame.display.flip()
-                    elif selected_option == MainMenu.options.QUIT:
-                        run = False
-                elif event.key == pygame.K_UP:
-                    selected_option = main_menu.prev_option()
-                elif event.key == pygame.K_DOWN:
-                    selected_option = main_menu.next_option()
-
-        main_menu_sprites.clear(screen, menu_background)
-        main_menu_sprites.update()
-        sprites_dirty = main_menu_sprites.draw(screen)
+    menu_background = track(
+        greyscale(Arena(load_sprites(), screen.get_size()).view(screen.get_rect())),
+        ORIGIN_BACKGROUND,
+    )
+    music = get_music_manager()
+    logging.info(
+        f"Streaming music instead of decoding it saves "
+        f"{music.memory_saved() / 1024 / 1024:.1f} MiB"
+    )
 
-        pygame.display.update(sprites_dirty)
-        main_clock.tick(15)
+    credits_scene = CreditsScene(screen, display_size, menu_background)
+    controls_scene = ControlsScene(screen, display_size, menu_background)
+    main_menu = MenuScene(
+        screen, menu_background, game, coop_game, credits_scene, controls_scene
+    )
 
+    # Images, sounds and fonts stay for good.
+    get_garbage_policy().keep()
+    Stage().run(main_menu)
     pygame.quit()
 
 
@@ -0,0 +1,171 @@
+from collections import OrderedDict
+from typing import List, Tuple
+
+import pygame
+
+import constants
+import settings
+from memory import track, ORIGIN_BACKGROUND
+from scheduler import get_scheduler, PRIORITY_BACKGROUND
+
+Chunk = Tuple[int, int]
+
+
+class Arena:
+    """
+    Floor, walls and columns of a level that is a number of screens wide and
+    high. The background is made of chunks as big as the screen, rendered
+    when the camera gets near them and dropped when there are more than
+    cached_chunks, so its cost follows the view instead of the arena.
+
+    Walls go along the top and the bottom of the arena, columns stand against
+    the top wall every half a screen. An arena of one screen looks like the
+    background always did.
+    """
+
+    def __init__(
+        self,
+        sprites_image: pygame.Surface,
+        chunk_size: Tuple[int, int],
+        screens: Tuple[int, int] = (1, 1),
+        cached_chunks=settings.ARENA_CACHED_CHUNKS,
+    ):
+        self.chunk_size = chunk_size
+        self.screens = screens
+        self.size = (chunk_size[0] * screens[0], chunk_size[1] * screens[1])
+        self.rect = pygame.Rect((0, 0), self.size)
+        self.cached_chunks = cached_chunks
+        self.chunks = OrderedDict()
+        # Views are drawn on one surface while the other may still be on its
+        # way to the display.
+        self.views = []
+        self.prefetched_around = None
+        self._load_tiles(sprites_image)
+
+    def _load_tiles(self, sprites_image: pygame.Surface):
+        width, height = self.chunk_size
+        self.floor = pygame.transform.scale(
+            sprites_image.subsurface(pygame.rect.Rect(constants.FLOOR_BACKGROUND)),
+            self.chunk_size,
+        )
+        steps = constants.SCALE_FACTOR
+        original_wall_up_height = (
+            sprites_image.subsurface(constants.WALL_BACKGROUND).get_rect().height
+        )
+        new_wall_up_height = height // constants.SCALE_FACTOR
+        original_wall_down_height = (
+            sprites_image.subsurface(constants.WALL_FRONT_BACKGROUND).get_rect().height
+        )
+        new_wall_down_height = (
+            original_wall_down_height * new_wall_up_height
+        ) // original_wall_up_height
+        wall_up = pygame.transform.scale(
+            sprites_image.subsurface(constants.WALL_BACKGROUND),
+            (width // steps, new_wall_up_height),
+        )
+        wall_down = pygame.transform.scale(
+            sprites_image.subsurface(constants.WALL_FRONT_BACKGROUND),
+            (width // steps, new_wall_down_height),
+        )
+        self.walls_up = [(wall_up, (i * wall_up.get_width(), 0)) for i in range(steps)]
+        self.walls_down = [
+            (wall_down, (i * wall_up.get_width(), height - new_wall_down_height))
+            for i in range(steps)
+        ]
+
+        column_surface = sprites_image.subsurface(constants.BACKGROUND_COLUMN)
+        self.column = pygame.transform.scale(
+            column_surface,
+            [x * constants.SCALE_FACTOR for x in column_surface.get_size()],
+        )
+        column_width = self.column.get_width()
+        positions = {0, self.rect.right - column_width}
+        for i in range(self.screens[0]):
+            positions.add(i * width + width // 2 - self.column.get_rect().centerx)
+            if i:
+                positions.add(i * width - column_width // 2)
+        # Columns are in the way of walkers too.
+        self.obstacles = [
+            self.column.get_rect(topleft=(x, 0)) for x in sorted(positions)
+        ]
+
+    def chunk_rect(self, chunk: Chunk) -> pygame.Rect:
+        width, height = self.chunk_size
+        return pygame.Rect(chunk[0] * width, chunk[1] * height, width, height)
+
+    def chunks_in(self, rect: pygame.Rect) -> List[Chunk]:
+        rect = rect.clip(self.rect)
+        width, height = self.chunk_size
+        return [
+            (column, row)
+            for column in range(rect.left // width, -(-rect.right // width))
+            for row in range(rect.top // height, -(-rect.bottom // height))
+        ]
+
+    def chunk(self, chunk: Chunk) -> pygame.Surface:
+        surface = self.chunks.get(chunk)
+        if surface is None:
+            surface = self.chunks[chunk] = self._render_chunk(chunk)
+            while len(self.chunks) > self.cached_chunks:
+                self.chunks.popitem(last=False)
+        else:
+            self.chunks.move_to_end(chunk)
+        return surface
+
+    def _render_chunk(self, chunk: Chunk) -> pygame.Surface:
+        surface = self.floor.copy()
+        column, row = chunk
+        if row == 0:
+            surface.blits(self.walls_up, doreturn=False)
+        if row == self.screens[1] - 1:
+            surface.blits(self.walls_down, doreturn=False)
+        if row == 0:
+            offset = self.chunk_rect(chunk).x
+            surface.blits(
+                [
+                    (self.column, obstacle.move(-offset, 0))
+                    for obstacle in self.obstacles
+                    if obstacle.right > offset
+                    and obstacle.left < offset + surface.get_width()
+                ],
+                doreturn=False,
+            )
+        return track(surface, ORIGIN_BACKGROUND)
+
+    def view(self, rect: pygame.Rect) -> pygame.Surface:
+        """
+        Background behind rect, a view of the screen's size.
+        """
+        chunks = self.chunks_in(rect)
+        if len(chunks) == 1 and self.chunk_rect(chunks[0]) == rect:
+            view = self.chunk(chunks[0])
+            self._prefetch(rect)
+            return view
+
+        if len(self.views) < 2:
+            self.views.append(track(pygame.Surface(rect.size), ORIGIN_BACKGROUND))
+        else:
+            self.views.reverse()
+        view = self.views[-1]
+        view.blits(
+            [
+                (self.chunk(chunk), self.chunk_rect(chunk).move(-rect.x, -rect.y))
+                for chunk in chunks
+            ],
+            doreturn=False,
+        )
+        self._prefetch(rect)
+        return view
+
+    def _prefetch(self, rect: pygame.Rect):
+        # Chunks the camera could reach next are rendered in spare time.
+        center = self.chunks_in(pygame.Rect(rect.center, (1, 1)))[0]
+        if center == self.prefetched_around:
+            return
+        self.prefetched_around = center
+        around = self.chunk_rect(center).inflate(self.chunk_size)
+        for chunk in self.chunks_in(around):
+            if chunk not in self.chunks:
+                get_scheduler().add(
+                    lambda chunk=chunk: self.chunk(chunk), PRIORITY_BACKGROUND
+                )
@@ -0,0 +1,75 @@
+from typing import Iterable, List, Tuple
+
+import pygame
+from pygame.sprite import Sprite
+
+
+class Camera:
+    """
+    Part of the world that is on screen. Sprites keep world coordinates in
+    their rects, the camera moves them to the screen when drawing and leaves
+    out those that wouldn't be seen. Sprites with screen_space set (scores,
+    banners) are drawn where they are.
+    """
+
+    def __init__(self, view_size: Tuple[int, int], world_size: Tuple[int, int] = None):
+        self.view = pygame.Rect((0, 0), view_size)
+        self.world = pygame.Rect((0, 0), world_size or view_size)
+        # Whether the view changed since the last frame, the whole background
+        # has to be drawn again then.
+        self.moved = True
+        self.invalidated = True
+
+    def resize_world(self, world_size: Tuple[int, int]):
+        self.world.size = world_size
+        self.view.clamp_ip(self.world)
+        self.invalidated = True
+
+    def follow(self, position) -> bool:
+        previous = self.view.topleft
+        self.view.center = position
+        self.view.clamp_ip(self.world)
+        self.moved = self.invalidated or self.view.topleft != previous
+        self.invalidated = False
+        return self.moved
+
+    def visible(self, rect: pygame.Rect) -> bool:
+        return self.view.colliderect(rect)
+
+    def cull(self, sprites: Iterable[Sprite]) -> List[Sprite]:
+        view = self.view
+        return [sprite for sprite in sprites if view.colliderect(sprite.rect)]
+
+    def to_screen(self, rect: pygame.Rect) -> pygame.Rect:
+        return rect.move(-self.view.x, -self.view.y)
+
+    def to_world(self, position) -> Tuple[int, int]:
+        return position[0] + self.view.x, position[1] + self.view.y
+
+    def project(self, sprites: Iterable[Sprite]) -> List[Tuple[Sprite, pygame.Rect]]:
+        """
+        Sprites in drawing order with their rects on screen, leaving out those
+        that are out of the view.
+        """
+        view = self.view
+        x, y = -view.x, -view.y
+        projected = []
+        for sprite in sprites:
+            if getattr(sprite, "screen_space", False):
+                projected.append((sprite, sprite.rect.copy()))
+            elif view.colliderect(sprite.rect):
+                projected.append((sprite, sprite.rect.move(x, y)))
+        return projected
+
+
+_current = None
+
+
+def get_camera() -> Camera:
+    return _current
+
+
+def set_camera(camera: Camera) -> Camera:
+    global _current
+    _current = camera
+    return camera
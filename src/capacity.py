@@ -0,0 +1,62 @@
+import logging
+from collections import deque, namedtuple
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+Crossing = namedtuple("Crossing", ["fps", "entities", "particles", "game_time"])
+
+
+class CapacityTracker:
+    """
+    Remembers how many entities were alive the first time the frame rate fell
+    under each threshold. Frame rate is computed from the work done per frame,
+    so the cap of the game loop doesn't hide it.
+    """
+
+    def __init__(self, thresholds=settings.CAPACITY_FPS_THRESHOLDS, window=30):
+        self.thresholds = sorted(thresholds, reverse=True)
+        self.frame_times = deque(maxlen=window)
+        self.crossings = {}
+        self.peak_entities = 0
+        self.peak_particles = 0
+
+    def fps(self) -> float:
+        if not self.frame_times:
+            return 0.0
+        return len(self.frame_times) / max(sum(self.frame_times), 1e-6)
+
+    def record(
+        self, frame_time: float, entities: int, particles: int, game_time: float
+    ):
+        self.frame_times.append(frame_time)
+        self.peak_entities = max(self.peak_entities, entities)
+        self.peak_particles = max(self.peak_particles, particles)
+        if len(self.frame_times) < self.frame_times.maxlen:
+            return
+        fps = self.fps()
+        for threshold in self.thresholds:
+            if threshold not in self.crossings and fps < threshold:
+                self.crossings[threshold] = Crossing(
+                    fps, entities, particles, game_time
+                )
+                logger.info(
+                    f"Frame rate fell under {threshold} FPS with {entities} entities "
+                    f"({particles} particles)."
+                )
+
+    def report(self) -> str:
+        lines = [
+            f"Peak: {self.peak_entities} entities, {self.peak_particles} particles."
+        ]
+        for threshold in self.thresholds:
+            crossing = self.crossings.get(threshold)
+            if crossing is None:
+                lines.append(f"< {threshold} FPS: never")
+            else:
+                lines.append(
+                    f"< {threshold} FPS: {crossing.entities} entities "
+                    f"({crossing.particles} particles) at {crossing.game_time:.1f}s"
+                )
+        return "\n".join(lines)
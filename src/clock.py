@@ -0,0 +1,116 @@
+import time
+import heapq
+import asyncio
+from itertools import count
+
+import pygame
+
+import settings
+
+
+class GameClock:
+    """
+    Game time advances a fixed step per simulated frame, whatever the wall
+    clock says. Pausing stops it, and scale only changes how many frames run
+    per wall second: 0.5 is slow motion, 4 is fast-forward. An unthrottled
+    clock doesn't wait at all, so headless runs go as fast as the CPU allows
+    and still see the same timers fire on the same frames.
+
+    A stepped clock leaves game time to the simulation, which moves it with
+    step(): netplay simulates some frames several times and, waiting for the
+    other player, none in others. While replaying frames after a rollback
+    sounds and particles are left out, they already played.
+    """
+
+    def __init__(
+        self, framerate=settings.FRAMERATE, scale=settings.GAME_SPEED, throttled=True
+    ):
+        self.framerate = framerate
+        self.scale = scale
+        self.throttled = throttled
+        self.paused = False
+        self.stepped = False
+        self.replaying = False
+        self.frames = 0
+        self.elapsed = 0.0
+        # Seconds spent on the last frame, not counting the wait in tick().
+        self.work_time = 0.0
+        self._last_tick = time.perf_counter()
+        self.wall_clock = pygame.time.Clock()
+        self.scheduled = []
+        self._order = count()
+
+    def time(self) -> float:
+        return self.elapsed
+
+    def real_time(self) -> float:
+        """
+        Time that keeps running while paused, for things like key debouncing.
+        """
+        if self.throttled:
+            return time.perf_counter()
+        return self.frames / self.framerate
+
+    def slack(self) -> float:
+        """
+        Seconds left until the next frame is due. An unthrottled clock has
+        nothing due.
+        """
+        if not self.throttled:
+            return float("inf")
+        due = self._last_tick + 1 / (self.framerate * self.scale)
+        return due - time.perf_counter()
+
+    def step(self):
+        self.elapsed += 1 / self.framerate
+
+    def post_at(self, frame: int, event: pygame.event.Event):
+        heapq.heappush(self.scheduled, (frame, next(self._order), event))
+
+    def post_in(self, seconds: float, event: pygame.event.Event):
+        self.post_at(self.frames + round(seconds * self.framerate), event)
+
+    def _advance(self):
+        self.work_time = time.perf_counter() - self._last_tick
+        self.frames += 1
+        if not self.paused and not self.stepped:
+            self.elapsed += 1 / self.framerate
+        while self.scheduled and self.scheduled[0][0] <= self.frames:
+            pygame.event.post(heapq.heappop(self.scheduled)[2])
+
+    def tick(self) -> int:
+        self._advance()
+        if self.throttled:
+            milliseconds = self.wall_clock.tick(self.framerate * self.scale)
+        else:
+            milliseconds = self.wall_clock.tick()
+        self._last_tick = time.perf_counter()
+        return milliseconds
+
+    async def next_frame(self) -> int:
+        """
+        tick() for scenes on a Stage: the wait for the next frame is left to
+        the other coroutines instead of sleeping through it.
+        """
+        self._advance()
+        delay = 0.0
+        if self.throttled:
+            due = self._last_tick + 1 / (self.framerate * self.scale)
+            delay = due - time.perf_counter()
+        await asyncio.sleep(max(delay, 0.0))
+        milliseconds = self.wall_clock.tick()
+        self._last_tick = time.perf_counter()
+        return milliseconds
+
+
+_current = GameClock()
+
+
+def get_game_clock() -> GameClock:
+    return _current
+
+
+def set_game_clock(clock: GameClock) -> GameClock:
+    global _current
+    _current = clock
+    return clock
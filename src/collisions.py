@@ -0,0 +1,122 @@
+import math
+from collections import namedtuple
+from typing import List
+
+import pygame
+from pygame.sprite import Sprite
+
+from render import TextureView
+
+# Area a blade swept between two steps: it turns around pivot from angle start
+# to angle end (degrees, screen coordinates, as Vector2.as_polar gives them).
+Sweep = namedtuple("Sweep", ["pivot", "start", "end", "length", "half_width"])
+
+# Masks for every (atlas region, size, flip, angle) a sprite has been drawn with.
+_masks = {}
+
+
+def baked_mask(view: TextureView) -> pygame.mask.Mask:
+    source = view.image
+    angle = round(view.angle)
+    key = (
+        id(source.get_abs_parent()),
+        source.get_abs_offset(),
+        source.get_size(),
+        tuple(view.size),
+        view.flip_x,
+        angle,
+    )
+    mask = _masks.get(key)
+    if mask is None:
+        surface = pygame.transform.scale(source, view.size)
+        if view.flip_x:
+            surface = pygame.transform.flip(surface, True, False)
+        if angle:
+            surface = pygame.transform.rotate(surface, -angle)
+        mask = _masks[key] = pygame.mask.from_surface(surface)
+    return mask
+
+
+def collide_mask(left: Sprite, right: Sprite) -> bool:
+    # Masks are centered on the rects, rects of rotated sprites may be a pixel
+    # off the size of the rotated surface.
+    left_mask, right_mask = left.mask, right.mask
+    left_width, left_height = left_mask.get_size()
+    right_width, right_height = right_mask.get_size()
+    offset = (
+        (right.rect.centerx - right_width // 2) - (left.rect.centerx - left_width // 2),
+        (right.rect.centery - right_height // 2)
+        - (left.rect.centery - left_height // 2),
+    )
+    return left_mask.overlap(right_mask, offset) is not None
+
+
+def spritecollide(sprite: Sprite, group, collided=collide_mask) -> List[Sprite]:
+    """
+    Like pygame.sprite.spritecollide, but collided only runs for the sprites
+    whose rects overlap.
+    """
+    colliderect = sprite.rect.colliderect
+    return [
+        other for other in group if colliderect(other.rect) and collided(sprite, other)
+    ]
+
+
+def segment_distance(point, start, end) -> float:
+    px, py = point
+    sx, sy = start
+    dx, dy = end[0] - sx, end[1] - sy
+    squared = dx * dx + dy * dy
+    t = (
+        0
+        if not squared
+        else max(0, min(1, ((px - sx) * dx + (py - sy) * dy) / squared))
+    )
+    return math.hypot(px - sx - t * dx, py - sy - t * dy)
+
+
+def sweep_hits_circle(sweep: Sweep, center, radius: float) -> bool:
+    """
+    Whether a circle touches the sector the blade swept, widened by its half
+    width. It covers every angle between the two steps, so nothing is missed
+    however far the blade turns in one of them.
+    """
+    px, py = sweep.pivot
+    dx, dy = center[0] - px, center[1] - py
+    reach = radius + sweep.half_width
+    if math.hypot(dx, dy) > sweep.length + reach:
+        return False
+
+    span = sweep.end - sweep.start
+    offset = (math.degrees(math.atan2(dy, dx)) - sweep.start) % 360
+    if span < 0:
+        offset = (360 - offset) % 360
+    if span and offset <= abs(span):
+        return True
+
+    # Out of the swept angle, the closest point is on the blade at either end.
+    for angle in (sweep.start, sweep.end):
+        radians = math.radians(angle)
+        tip = (
+            px + sweep.length * math.cos(radians),
+            py + sweep.length * math.sin(radians),
+        )
+        if segment_distance(center, sweep.pivot, tip) <= reach:
+            return True
+    return False
+
+
+def sweep_collide(sweep: Sweep, group) -> List[Sprite]:
+    """
+    Sprites of group, taken as circles inside their rects, hit by the sweep.
+    """
+    reach = sweep.length + sweep.half_width
+    bounds = pygame.Rect(0, 0, 2 * reach, 2 * reach)
+    bounds.center = sweep.pivot
+    colliderect = bounds.colliderect
+    return [
+        other
+        for other in group
+        if colliderect(other.rect)
+        and sweep_hits_circle(sweep, other.rect.center, min(other.rect.size) / 2)
+    ]
@@ -12,6 +12,11 @@ LAYER_ENEMY = 2
 LAYER_PLAYER = 3
 LAYER_WEAPON = 4
 LAYER_PARTICLE = 5
+# Drawn over the darkness of dark levels: the score and the banners.
+UNLIT_LAYERS = (LAYER_SCORE,)
+
+# Color modulation used by the texture renderer instead of redscale.
+HURT_TINT = (255, 90, 90)
 
 FACING_EAST = 0
 FACING_WEST = 1
@@ -59,6 +64,19 @@ MOBS_DICT = {
 
 MOBS = ["BLOOD_CRYING_MOB"]
 
+# Crowd behaviour per mob: (separation, cohesion) weights.
+MOB_CROWD_WEIGHTS_DEFAULT = (0.15, 0.02)
+MOB_CROWD_WEIGHTS = {
+    MOB_SMALL_BLOOD_CRYING: (0.1, 0.04),
+    MOB_BLOOD_CRYING: (0.15, 0.03),
+    MOB_ROTTEN_BLOOD_CRYING: (0.15, 0.03),
+    MOB_SMALL_TROLL: (0.15, 0.02),
+    MOB_BIG_TROLL: (0.3, 0.0),
+    MOB_MASKED_TROLL: (0.2, 0.01),
+    MOB_SMALL_DEVIL: (0.08, 0.05),
+    MOB_TALL_DEVIL: (0.1, 0.04),
+}
+
 GREEN_LIQUID_ITEM = (133, 212, 7, 11)
 WIDE_GREEN_LIQUID_ITEM = (196, 196, 9, 11)
 WIDE_RED_LIQUID_ITEM = (196, 180, 9, 11)
@@ -121,6 +139,7 @@ BACKGROUND_SOUND = (
 )
 ENDING_SOUND = SOUNDS_BASE_PATH / f"ending{settings.AUDIO_EXTENSION}"
 MAIN_MENU_SOUND = SOUNDS_BASE_PATH / f"main_menu{settings.AUDIO_EXTENSION}"
+MUSIC_TRACKS = (BACKGROUND_SOUND, ENDING_SOUND, MAIN_MENU_SOUND)
 
 # SFX
 SFX_BASE_PATH = SOUNDS_BASE_PATH / "sfx"
@@ -0,0 +1,105 @@
+import time
+
+import pygame
+from pygame.math import Vector2
+
+from latency import get_latency_tracker
+import settings
+
+ACTION_ATTACK = "attack"
+ACTION_PAUSE = "pause"
+ACTION_RESTART = "restart"
+ACTION_BACK = "back"
+ACTION_MEMORY_REPORT = "memory_report"
+ACTION_QUICK_SAVE = "quick_save"
+ACTION_QUICK_LOAD = "quick_load"
+ACTION_PROFILE = "profile"
+# Not bound like the rest, movement is read into FrameInput.move.
+ACTION_MOVE = "move"
+
+BINDINGS = {
+    ACTION_ATTACK: settings.KEY_ATTACK,
+    ACTION_PAUSE: settings.KEY_PAUSE,
+    ACTION_RESTART: settings.KEY_RESTART,
+    ACTION_BACK: settings.KEY_BACK,
+    ACTION_MEMORY_REPORT: settings.KEY_MEMORY_REPORT,
+    ACTION_QUICK_SAVE: settings.KEY_QUICK_SAVE,
+    ACTION_QUICK_LOAD: settings.KEY_QUICK_LOAD,
+    ACTION_PROFILE: settings.KEY_PROFILE,
+}
+# Actions that stay active while their key is held, the rest only fire on the
+# frame the key goes down.
+HELD_ACTIONS = (ACTION_ATTACK,)
+DIRECTIONS_BY_KEY = {
+    **{key: (1, 0) for key in settings.KEY_RIGHT},
+    **{key: (-1, 0) for key in settings.KEY_LEFT},
+    **{key: (0, 1) for key in settings.KEY_DOWN},
+    **{key: (0, -1) for key in settings.KEY_UP},
+}
+
+
+def allow_events(*event_types: int):
+    """
+    Only queue the events the current scene reads, everything else is dropped
+    by SDL before it reaches pygame.event.get().
+    """
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed(list(event_types))
+
+
+class FrameInput:
+    """
+    Keyboard state sampled once per frame into actions. Keys are read from
+    pygame.key.get_pressed(), so holding one down costs nothing in the event
+    queue, and KEYDOWN events only catch presses shorter than a frame, for
+    movement too. With a LatencyTracker every press of the attack and
+    movement keys is timestamped as it comes out of the queue.
+    """
+
+    def __init__(self, bindings=BINDINGS):
+        self.bindings = bindings
+        self.actions_by_key = {
+            key: action for action, keys in bindings.items() for key in keys
+        }
+        self.move = Vector2(0, 0)
+        self.triggered = set()
+        self.quit = False
+
+    def sample(self):
+        self.triggered.clear()
+        self.quit = False
+        tapped_x = tapped_y = 0
+        events = pygame.event.get()
+        received = time.perf_counter()
+        tracker = get_latency_tracker()
+        for event in events:
+            if event.type == pygame.QUIT:
+                self.quit = True
+            elif event.type == pygame.KEYDOWN:
+                action = self.actions_by_key.get(event.key)
+                if action is not None:
+                    self.triggered.add(action)
+                direction = DIRECTIONS_BY_KEY.get(event.key)
+                if direction is not None:
+                    tapped_x = tapped_x or direction[0]
+                    tapped_y = tapped_y or direction[1]
+                    action = ACTION_MOVE
+                if tracker and action in (ACTION_MOVE, ACTION_ATTACK):
+                    tracker.press(action, received)
+
+        keys = pygame.key.get_pressed()
+        self.move.update(
+            any(keys[key] for key in settings.KEY_RIGHT)
+            - any(keys[key] for key in settings.KEY_LEFT)
+            or tapped_x,
+            any(keys[key] for key in settings.KEY_DOWN)
+            - any(keys[key] for key in settings.KEY_UP)
+            or tapped_y,
+        )
+        for action in HELD_ACTIONS:
+            if any(keys[key] for key in self.bindings[action]):
+                self.triggered.add(action)
+        return self
+
+    def active(self, action: str) -> bool:
+        return action in self.triggered
@@ -0,0 +1,339 @@
+import random
+from typing import List, Optional
+from logging import getLogger
+
+import pygame
+from pygame.math import Vector2
+
+from sprites.models import Player, Weapon
+from sprites.ui import Banner
+from levels import load_horde
+from netplay import (
+    RollbackSession,
+    Loopback,
+    UdpTransport,
+    Puppet,
+    pack_input,
+    unpack_input,
+)
+from controls import (
+    FrameInput,
+    allow_events,
+    ACTION_ATTACK,
+    ACTION_BACK,
+    ACTION_MOVE,
+)
+from scenes import Game
+from sounds import play, stop
+import constants
+import settings
+
+logger = getLogger(__name__)
+
+
+class CoopGame(Game):
+    """
+    Endless horde for two alchemists, each on their own computer. Both run
+    the whole game and only send each other their inputs, a RollbackSession
+    (see netplay.py) keeps them in step, with the game as its simulation:
+    step() plays a frame with the inputs of both alchemists, checkpoint() and
+    rewind() take it back. Whatever step() changes has to be in checkpoints,
+    and nothing that is only drawn (particles, banners, the camera) can
+    change it, every player sees their own.
+    """
+
+    def __init__(self, screen, display_size):
+        super().__init__(screen, display_size)
+        self.alchemists: List[Player] = []
+        self.weapons: List[Weapon] = []
+        self.session: Optional[RollbackSession] = None
+        # Where the other alchemist is, "host:port", and the port to listen
+        # on. Without a peer the computer plays them.
+        self.peer = settings.NETPLAY_PEER
+        self.port = settings.NETPLAY_PORT
+        # Plays the other alchemist when there's no one to play with.
+        self.partner: Optional[RollbackSession] = None
+        # Plays the local alchemist in headless runs, for frames_to_play.
+        self.autopilot: Optional[Puppet] = None
+        self.frames_to_play = None
+        self.waiting_banner = Banner(
+            screen,
+            main_text="Waiting for the other alchemist",
+            secondary_text="Press ESC to go back",
+        )
+        self.game_over_banner = Banner(
+            screen,
+            main_text="The horde was too much for you both",
+            secondary_text="Press ESC to exit",
+        )
+
+    def _open_session(self) -> RollbackSession:
+        size = self.screen.get_size()
+        seed = random.getrandbits(32)
+        # Delays added on purpose go by game time, headless runs are faster.
+        if self.peer:
+            host, port = self.peer.rsplit(":", 1)
+            transport = UdpTransport(
+                self.port, (host, int(port)), now=self.clock.real_time
+            )
+            self.partner = None
+        else:
+            transport, other = Loopback.pair(seed=seed, now=self.clock.real_time)
+            player = 1 - settings.NETPLAY_PLAYER
+            self.partner = RollbackSession(
+                Puppet(seed=player),
+                other,
+                player=player,
+                seed=seed,
+                size=size,
+                digest_frames=0,
+            )
+        return RollbackSession(self, transport, seed=seed, size=size)
+
+    async def _connect(self, controls: FrameInput) -> Optional[bool]:
+        # Game time doesn't go by until both are there.
+        self.waiting_banner.update()
+        waiting = pygame.Surface(self.screen.get_size())
+        waiting.blit(self.waiting_banner.image, self.waiting_banner.rect)
+        while True:
+            connected = self.session.connect()
+            if self.partner:
+                self.partner.connect()
+            if connected:
+                return None
+            controls.sample()
+            if controls.quit:
+                return True
+            if controls.active(ACTION_BACK):
+                return False
+            self.backend.present_surface(waiting)
+            await self.clock.next_frame()
+
+    async def _play(self, endless):
+        self.current_level = self.first_level = load_horde(self.screen)
+        controls = FrameInput()
+        allow_events(pygame.QUIT, pygame.KEYDOWN)
+        self.session = self._open_session()
+        try:
+            quit = await self._connect(controls)
+            if quit is not None:
+                return quit
+            # Same seed, same arena, same game on both sides.
+            random.seed(self.session.seed)
+            self.arena_chunk = self.session.size
+            self.clock.elapsed = 0
+            self.clock.stepped = True
+            self._start()
+
+            while self.run:
+                controls.sample()
+                if controls.quit:
+                    self._stop()
+                    return True
+                if controls.active(ACTION_BACK):
+                    self._stop()
+                    break
+                if self.autopilot:
+                    local_input = self.autopilot.input_at(self.session.frame)
+                else:
+                    local_input = pack_input(
+                        controls.move, controls.active(ACTION_ATTACK)
+                    )
+                self.session.advance(local_input)
+                if self.partner:
+                    self.partner.advance(
+                        self.partner.simulation.input_at(self.partner.frame)
+                    )
+                if self.session.closed or self.session.frame == self.frames_to_play:
+                    self._stop()
+                    break
+                self._draw()
+                self.scheduler.run()
+                self.music.update()
+                self.garbage.use_slack(self.clock.slack())
+                await self.clock.next_frame()
+            return False
+        finally:
+            self.session.close()
+            if self.partner:
+                self.partner.close()
+            logger.info(self.session.report())
+            self.clock.stepped = False
+
+    async def _autosave(self):
+        # A saved game couldn't bring the other player back.
+        pass
+
+    def _start(self):
+        self._clear_sprites()
+        self._enter_arena()
+        left, bottom = self._start_position()
+        self.alchemists = [
+            Player(self.screen, initial_position=(left + 60 * index, bottom))
+            for index in range(2)
+        ]
+        self.weapons = [
+            self._spawn_weapon(owner=alchemist) for alchemist in self.alchemists
+        ]
+        self.player_sprites.add(self.alchemists)
+        self.all_sprites.add(self.alchemists)
+        self.player = self.alchemists[self.session.player]
+        self.weapon = self.weapons[self.session.player]
+        self._spawn_potion()
+        self._spawn_enemy()
+        self._spawn_score()
+        self._resume()
+
+    def _warm_up(self):
+        yield from super()._warm_up()
+        if not self.game_over_banner.rendered:
+            yield from self.game_over_banner.render_steps()
+
+    def step(self, inputs):
+        """
+        Plays a frame with the input of every alchemist.
+        """
+        # Replays show nothing new, the local alchemist did it the first time.
+        latency = None if self.clock.replaying else self.latency
+        for alchemist, weapon, value in zip(self.alchemists, self.weapons, inputs):
+            if alchemist.alive():
+                move, attack = unpack_input(value)
+                steered = alchemist.steer(Vector2(move))
+                attacked = attack and weapon.attack()
+                if latency and alchemist is self.player:
+                    if steered:
+                        latency.applied(ACTION_MOVE)
+                    if attacked:
+                        latency.applied(ACTION_ATTACK)
+
+        # Every mob, the camera only shows what one of the alchemists sees.
+        mobs = self.mobs_sprites.sprites()
+        for alchemist, weapon in zip(self.alchemists, self.weapons):
+            if alchemist.alive():
+                self._collide(alchemist, weapon, mobs)
+        for _ in range(self.current_level.due_wave()):
+            self._spawn_enemy(initial_position=self._random_edge())
+        self._move()
+        self.clock.step()
+
+    def _move(self):
+        alive = [alchemist for alchemist in self.alchemists if alchemist.alive()]
+        # Once they're gone mobs wander around where they fell.
+        positions = [
+            alchemist.center_position for alchemist in alive or self.alchemists
+        ]
+        self.flow_field.update(*positions)
+        self.crowd.update(self.mobs_sprites)
+        for enemy in self.mobs_sprites.sprites():
+            nearest = min(positions, key=enemy.center_position.distance_squared_to)
+            enemy.update(player_position=nearest, flow_field=self.flow_field)
+        for alchemist in alive:
+            alchemist.update(flow_field=self.flow_field)
+        for weapon in self.weapons:
+            if weapon.alive():
+                weapon.update()
+
+    def _kill_player(self, player: Player):
+        player.kill()
+        stop(player.footsteps)
+        play(self.player_killed_sound)
+        if any(alchemist.alive() for alchemist in self.alchemists):
+            return
+        for enemy in self.mobs_sprites:
+            enemy.velocity.update(0, 0)
+            enemy.acceleration.update(0.01, 0.01)
+
+    def checkpoint(self) -> tuple:
+        level = self.current_level
+        return (
+            self.clock.elapsed,
+            random.getstate(),
+            level.wave,
+            level.next_wave,
+            level.score.value,
+            tuple(
+                (alchemist.alive(), alchemist.checkpoint())
+                for alchemist in self.alchemists
+            ),
+            tuple((weapon.alive(), weapon.checkpoint()) for weapon in self.weapons),
+            tuple((enemy, enemy.checkpoint()) for enemy in self.mobs_sprites),
+            tuple(
+                (potion, tuple(potion.rect.center)) for potion in self.potions_sprites
+            ),
+        )
+
+    def rewind(self, checkpoint: tuple):
+        level = self.current_level
+        (
+            self.clock.elapsed,
+            random_state,
+            level.wave,
+            level.next_wave,
+            level.score.value,
+            alchemists,
+            weapons,
+            enemies,
+            potions,
+        ) = checkpoint
+        random.setstate(random_state)
+        for alchemist, (alive, alchemist_checkpoint) in zip(
+            self.alchemists, alchemists
+        ):
+            alchemist.rewind(alchemist_checkpoint)
+            if alive:
+                self.player_sprites.add(alchemist)
+                self.all_sprites.add(alchemist)
+            else:
+                alchemist.kill()
+        for weapon, (alive, weapon_checkpoint) in zip(self.weapons, weapons):
+            weapon.rewind(weapon_checkpoint)
+            if alive:
+                self.all_sprites.add(weapon)
+            else:
+                weapon.kill()
+
+        # Groups are filled again in the same order, the crowd adds up forces
+        # in that order too.
+        spawned = [enemy for enemy in self.mobs_sprites]
+        self.mobs_sprites.empty()
+        for enemy, enemy_checkpoint in enemies:
+            enemy.rewind(enemy_checkpoint)
+            self.mobs_sprites.add(enemy)
+            self.all_sprites.add(enemy)
+        for enemy in spawned:
+            if not self.mobs_sprites.has(enemy):
+                enemy.kill()
+        spawned = [potion for potion in self.potions_sprites]
+        self.potions_sprites.empty()
+        for potion, center in potions:
+            potion.rect.center = center
+            self.potions_sprites.add(potion)
+            self.all_sprites.add(potion)
+        for potion in spawned:
+            if not self.potions_sprites.has(potion):
+                potion.kill()
+
+    def _draw(self):
+        # The simulation moved everything else.
+        for layer in (constants.LAYER_SCORE, constants.LAYER_PARTICLE):
+            for sprite in self.all_sprites.get_sprites_from_layer(layer):
+                sprite.update()
+        score = self.current_level.score
+        if self.camera.to_screen(self.player.rect).colliderect(score.rect):
+            score.hide()
+        else:
+            score.show()
+        # Rollbacks can bring alchemists back, so the game is over when it's
+        # drawn as over, not when one was killed.
+        over = not any(alchemist.alive() for alchemist in self.alchemists)
+        if over and not self.game_over_banner.alive():
+            self.all_sprites.add(self.game_over_banner)
+            self.music.play(constants.ENDING_SOUND, crossfade_ms=0)
+        elif not over and self.game_over_banner.alive():
+            self.game_over_banner.kill()
+            self.music.play(constants.BACKGROUND_SOUND)
+        self._follow_player()
+        draw_list = self.backend.draw(
+            self.all_sprites, self.background, self.camera, light=self._light()
+        )
+        self.backend.present(draw_list)
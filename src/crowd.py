@@ -0,0 +1,110 @@
+from typing import Tuple
+
+import numpy as np
+
+import settings
+
+# Packs a cell (x, y) into a single sortable key.
+_KEY_STRIDE = 1 << 20
+_KEY_OFFSET = 1 << 19
+
+
+def neighbour_pairs(
+    positions: np.ndarray, radius: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Indexes (i, j) of every pair of positions closer than radius. Positions
+    are bucketed in a uniform grid of radius sized cells, so only the 3x3
+    cells around each one are looked at and the cost grows with the number of
+    neighbours, not with the square of the crowd.
+    """
+    count = len(positions)
+    cells = np.floor(positions / radius).astype(np.int64) + _KEY_OFFSET
+    keys = cells[:, 0] * _KEY_STRIDE + cells[:, 1]
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    left, right = [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            neighbour_keys = (cells[:, 0] + dx) * _KEY_STRIDE + cells[:, 1] + dy
+            start = np.searchsorted(sorted_keys, neighbour_keys, side="left")
+            end = np.searchsorted(sorted_keys, neighbour_keys, side="right")
+            sizes = end - start
+            total = sizes.sum()
+            if not total:
+                continue
+            firsts = np.repeat(np.cumsum(sizes) - sizes, sizes)
+            left.append(np.repeat(np.arange(count), sizes))
+            right.append(order[np.repeat(start, sizes) + np.arange(total) - firsts])
+
+    if not left:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    left, right = np.concatenate(left), np.concatenate(right)
+    delta = positions[left] - positions[right]
+    close = (left != right) & ((delta**2).sum(axis=1) < radius**2)
+    return left[close], right[close]
+
+
+class Crowd:
+    """
+    Boids style separation and cohesion between enemies, computed for the
+    whole group at once and left on each enemy as crowd_force.
+    """
+
+    def __init__(
+        self, radius=settings.CROWD_RADIUS, max_force=settings.CROWD_MAX_FORCE
+    ):
+        self.radius = radius
+        self.max_force = max_force
+
+    def forces(
+        self, positions: np.ndarray, separation: np.ndarray, cohesion: np.ndarray
+    ) -> np.ndarray:
+        count = len(positions)
+        left, right = neighbour_pairs(positions, self.radius)
+        forces = np.zeros((count, 2))
+        if not len(left):
+            return forces
+
+        delta = positions[left] - positions[right]
+        distance = np.sqrt((delta**2).sum(axis=1))
+        distance[distance == 0] = 1e-3
+        # Push away, harder the closer they are.
+        push = (
+            delta
+            / distance[:, np.newaxis]
+            * (1 - distance / self.radius)[:, np.newaxis]
+        )
+        neighbours = np.bincount(left, minlength=count)
+        for axis in (0, 1):
+            forces[:, axis] += separation * np.bincount(
+                left, weights=push[:, axis], minlength=count
+            )
+            # Pull towards the center of the neighbours.
+            centers = np.bincount(
+                left, weights=positions[right, axis], minlength=count
+            ) / np.maximum(neighbours, 1)
+            forces[:, axis] += np.where(
+                neighbours > 0,
+                cohesion * (centers - positions[:, axis]) / self.radius,
+                0,
+            )
+
+        magnitude = np.sqrt((forces**2).sum(axis=1))
+        too_strong = magnitude > self.max_force
+        forces[too_strong] *= (self.max_force / magnitude[too_strong])[:, np.newaxis]
+        return forces
+
+    def update(self, enemies):
+        enemies = list(enemies)
+        if not enemies:
+            return
+        positions = np.array([enemy.center_position for enemy in enemies], dtype=float)
+        separation = np.array([enemy.separation_weight for enemy in enemies])
+        cohesion = np.array([enemy.cohesion_weight for enemy in enemies])
+        for enemy, (x, y) in zip(
+            enemies, self.forces(positions, separation, cohesion).tolist()
+        ):
+            enemy.crowd_force.update(x, y)
@@ -0,0 +1,190 @@
+import time
+from collections import Counter
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pygame
+
+import settings
+
+STRATEGY_RECTS = "rects"
+STRATEGY_FULL = "full"
+
+
+class DirtyRegions:
+    """
+    Turns the dirty rects of a frame into a few larger ones before updating
+    the display. Rects are rasterized on a grid of tiles and covered tiles
+    merged back into rects, so overlapping and adjacent rects become one.
+
+    Updating many rects costs more per pixel than a flip, so past a share of
+    the screen the whole display is flipped instead. That share starts at
+    full_threshold and then follows what updates and flips actually took.
+    """
+
+    def __init__(
+        self,
+        size: Tuple[int, int],
+        tile=settings.DIRTY_TILE_SIZE,
+        max_rects=settings.DIRTY_MAX_RECTS,
+        full_threshold=settings.DIRTY_FULL_THRESHOLD,
+    ):
+        self.width, self.height = size
+        self.bounds = pygame.Rect((0, 0), size)
+        self.tile = tile
+        self.max_rects = max_rects
+        self.default_threshold = full_threshold
+        self.shape = (-(-self.height // tile), -(-self.width // tile))
+        self.grid = np.zeros(self.shape, dtype=bool)
+        # Exponential averages of what drawing and presenting took.
+        self.flip_seconds = None
+        self.pixel_seconds = None
+        self.strategies = Counter()
+        self.strategy = STRATEGY_FULL
+        self.rect_count = 0
+        self.rect_total = 0
+        self.covered = 0.0
+        self.covered_total = 0.0
+        # Gets the regions that were updated, see recorder.py.
+        self.recorder = None
+
+    def threshold(self) -> float:
+        if self.flip_seconds is None or self.pixel_seconds is None:
+            return self.default_threshold
+        full = self.pixel_seconds * self.width * self.height
+        return min(max(self.flip_seconds / full, 0.05), 1.0)
+
+    def coalesce(self, rects: List[pygame.Rect]) -> Optional[List[pygame.Rect]]:
+        """
+        Merged rects covering rects, or None when a full update is cheaper.
+        """
+        grid = self._mark(rects)
+        self.covered = grid.sum() / grid.size
+        if self.covered > self.threshold():
+            return None
+
+        merged = self._merge(grid)
+        if len(merged) > self.max_rects:
+            # One run per row: from the first to the last covered tile.
+            columns = np.arange(grid.shape[1])
+            banded = np.zeros_like(grid)
+            for row in np.flatnonzero(grid.any(axis=1)):
+                covered = columns[grid[row]]
+                banded[row, covered[0] : covered[-1] + 1] = True
+            merged = self._merge(banded)
+        if len(merged) > self.max_rects:
+            merged = [merged[0].unionall(merged[1:])]
+        return merged
+
+    def _mark(self, rects: List[pygame.Rect]) -> np.ndarray:
+        grid = self.grid
+        grid[:] = False
+        tile = self.tile
+        for rect in rects:
+            # Off the screen, or the negative sides would slice from the end.
+            rect = self.bounds.clip(rect)
+            if not rect:
+                continue
+            left, top = rect.left // tile, rect.top // tile
+            right, bottom = -(-rect.right // tile), -(-rect.bottom // tile)
+            grid[top:bottom, left:right] = True
+        return grid
+
+    def _merge(self, grid: np.ndarray) -> List[pygame.Rect]:
+        # Runs of covered tiles on each row, runs that repeat on the next row
+        # grow downwards.
+        tile = self.tile
+        padded = np.zeros((grid.shape[0], grid.shape[1] + 2), dtype=np.int8)
+        padded[:, 1:-1] = grid
+        edges = np.diff(padded, axis=1)
+        closed = []
+        open_runs = {}
+        for row in range(grid.shape[0]):
+            starts = np.flatnonzero(edges[row] == 1)
+            ends = np.flatnonzero(edges[row] == -1)
+            runs = {}
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                rect = open_runs.pop((start, end), None)
+                if rect is None:
+                    rect = pygame.Rect(
+                        start * tile, row * tile, (end - start) * tile, 0
+                    )
+                rect.height += tile
+                runs[(start, end)] = rect
+            closed.extend(open_runs.values())
+            open_runs = runs
+        closed.extend(open_runs.values())
+        # Tiles on the last row and column may go past the screen.
+        return [rect.clip(self.bounds) for rect in closed]
+
+    def present(self, rects: Optional[List[pygame.Rect]] = None):
+        """
+        Updates the rects of the display, all of it when rects is None.
+        """
+        merged = None if rects is None else self.coalesce(rects)
+        self.update(merged, partial=rects is not None)
+
+    def update(
+        self,
+        merged: Optional[List[pygame.Rect]],
+        partial=False,
+        drawn=0.0,
+        scroll=None,
+    ):
+        """
+        Updates rects given by coalesce(), or flips when there are none. partial
+        tells whether only the tiles of the last coalesce() changed, drawn the
+        seconds it took to draw what's updated: drawing only the rects saves
+        more than updating only them does. scroll is the offset the last frame
+        moved by and the rects that aren't it moved, for the recorder.
+        """
+        started = time.perf_counter() - drawn
+        if merged is None:
+            pygame.display.flip()
+            self._record(STRATEGY_FULL, 0, time.perf_counter() - started)
+        else:
+            pygame.display.update(merged)
+            self._record(STRATEGY_RECTS, len(merged), time.perf_counter() - started)
+        if self.recorder is not None:
+            offset = None
+            # Flipped or not, only the dirty tiles changed.
+            if merged is None and partial:
+                merged = self._merge(self.grid)
+            # Or the last frame moved, but for some tiles.
+            elif merged is None and scroll is not None:
+                offset, rects = scroll
+                merged = self._merge(self._mark(rects))
+            self.recorder.capture(merged, offset)
+
+    def _record(self, strategy: str, rect_count: int, seconds: float):
+        self.strategy = strategy
+        self.strategies[strategy] += 1
+        self.rect_count = rect_count
+        self.rect_total += rect_count
+        if strategy == STRATEGY_FULL:
+            self.flip_seconds = self._average(self.flip_seconds, seconds)
+            return
+        self.covered_total += self.covered
+        if self.covered:
+            pixel_seconds = seconds / (self.covered * self.width * self.height)
+            self.pixel_seconds = self._average(self.pixel_seconds, pixel_seconds)
+
+    @staticmethod
+    def _average(average, value, weight=0.1):
+        return value if average is None else average + weight * (value - average)
+
+    def describe(self) -> str:
+        if self.strategy == STRATEGY_FULL:
+            return "full"
+        return f"{self.rect_count} rects"
+
+    def report(self) -> str:
+        frames = sum(self.strategies.values()) or 1
+        partial = self.strategies[STRATEGY_RECTS] or 1
+        return (
+            f"Display updates: {self.strategies[STRATEGY_RECTS] / frames:.0%} rects "
+            f"({self.rect_total / partial:.1f} rects, "
+            f"{self.covered_total / partial:.0%} of the screen on average), "
+            f"{self.strategies[STRATEGY_FULL] / frames:.0%} full. "
+            f"Full updates above {self.threshold():.0%} of the screen."
+        )
@@ -0,0 +1,175 @@
+import gc
+import time
+import logging
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+GENERATIONS = 3
+
+
+class PauseStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.worst = max(self.worst, seconds)
+
+    def describe(self) -> str:
+        if not self.count:
+            return "none"
+        return (
+            f"{self.count}, {self.total * 1000:.1f} ms in total, "
+            f"{self.total / self.count * 1000:.2f} ms on average, "
+            f"{self.worst * 1000:.2f} ms at worst"
+        )
+
+
+class GarbagePolicy:
+    """
+    Keeps CPython's cyclic garbage collector out of the middle of frames.
+    Vectors, particles and surfaces come and go by the thousands while
+    playing, and every few hundred of them an automatic collection would go
+    through everything that's alive, the images and levels too.
+
+    So what's loaded when a level starts is frozen, collections leave it
+    alone, and while playing automatic collections wait for many more new
+    objects (play_threshold, 0 turns them off). Garbage is collected when
+    nobody notices instead: the young generations when a frame finishes with
+    time to spare, all of it on pauses, level banners and transitions. Every
+    collection is timed, through gc.callbacks, the automatic ones apart.
+    """
+
+    def __init__(
+        self,
+        managed=settings.GC_MANAGED,
+        play_threshold=settings.GC_PLAY_THRESHOLD,
+        young_limit=settings.GC_YOUNG_LIMIT,
+    ):
+        self.managed = managed
+        self.play_threshold = play_threshold
+        self.young_limit = young_limit
+        self.playing = False
+        self.saved_thresholds = None
+        self.last_moment = None
+        # Whether what was loaded before playing stays frozen, see keep().
+        self.kept = False
+        self._explicit = False
+        self._started = None
+        self.automatic = [PauseStats() for _ in range(GENERATIONS)]
+        self.explicit = [PauseStats() for _ in range(GENERATIONS)]
+        # Seconds each generation takes, refined as collections are timed.
+        self.cost = [0.0005, 0.002, 0.02]
+        gc.callbacks.append(self._timed)
+
+    def _timed(self, phase: str, info: dict):
+        if phase == "start":
+            self._started = time.perf_counter()
+            return
+        if self._started is None:
+            return
+        seconds = time.perf_counter() - self._started
+        self._started = None
+        generation = info["generation"]
+        self.cost[generation] = self.cost[generation] * 0.8 + seconds * 0.2
+        if self._explicit:
+            self.explicit[generation].add(seconds)
+        elif self.playing:
+            # Loading and menus don't count, there's no frame to miss.
+            self.automatic[generation].add(seconds)
+            logger.debug(f"Generation {generation} collected on its own while playing.")
+
+    def freeze(self):
+        """
+        Collects, and leaves what's still alive out of the collections to
+        come, for after images and levels are loaded.
+        """
+        self.last_moment = None
+        if not self.managed:
+            return
+        self.collect()
+        gc.freeze()
+        logger.debug(f"{gc.get_freeze_count()} objects frozen.")
+
+    def keep(self):
+        """
+        Freezes what's loaded for good, like images, sounds and fonts.
+        Unfreezing after a game thaws it too, so once what the game left
+        behind is collected the rest is frozen again.
+        """
+        self.kept = True
+        self.freeze()
+
+    def enter_play(self):
+        self.playing = True
+        self.last_moment = None
+        if not self.managed:
+            return
+        self.saved_thresholds = gc.get_threshold()
+        if self.play_threshold:
+            gc.set_threshold(self.play_threshold, *self.saved_thresholds[1:])
+        else:
+            gc.disable()
+
+    def exit_play(self):
+        self.playing = False
+        if not self.managed or self.saved_thresholds is None:
+            return
+        gc.set_threshold(*self.saved_thresholds)
+        gc.enable()
+        # What the levels left behind can go now, back in the menu.
+        gc.unfreeze()
+        self.collect()
+        if self.kept:
+            gc.freeze()
+
+    def collect(self, generation=2):
+        self._explicit = True
+        try:
+            gc.collect(generation)
+        finally:
+            self._explicit = False
+
+    def collect_once(self, moment: str):
+        """
+        Collects everything on the first frame of a moment that goes on for
+        several, like a transition.
+        """
+        if self.managed and moment != self.last_moment:
+            self.last_moment = moment
+            self.collect()
+
+    def use_slack(self, seconds: float):
+        """
+        Collects young generations if they're due and the frame has the
+        seconds to spare.
+        """
+        if not self.managed or not self.playing:
+            return
+        young, middle, _ = gc.get_count()
+        if middle >= gc.get_threshold()[1] and self.cost[1] < seconds:
+            self.collect(1)
+        elif young >= self.young_limit and self.cost[0] < seconds:
+            self.collect(0)
+
+    def report(self) -> str:
+        lines = ["Garbage collection pauses:"]
+        for generation in range(GENERATIONS):
+            lines.append(
+                f"  Generation {generation}: explicit "
+                f"{self.explicit[generation].describe()}; automatic while "
+                f"playing {self.automatic[generation].describe()}"
+            )
+        return "\n".join(lines)
+
+
+_current = GarbagePolicy()
+
+
+def get_garbage_policy() -> GarbagePolicy:
+    return _current
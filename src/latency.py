@@ -0,0 +1,111 @@
+import time
+import logging
+from collections import defaultdict, namedtuple
+from typing import Dict, List
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+Press = namedtuple("Press", ["action", "pressed", "frame"])
+# A press once the game acted on it, waiting for the frame that shows it.
+Applied = namedtuple("Applied", ["action", "pressed", "applied"])
+
+
+def percentile(values: List[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(share * len(ordered)), len(ordered) - 1)]
+
+
+class LatencyTracker:
+    """
+    Time from a key press to the display showing what it did. A press is
+    timestamped when it comes out of the event queue (see controls.py), the
+    game marks it applied when the player or the sword changes because of
+    it, and the first frame drawn after that takes it along to the display:
+    the latency ends when updating the display returns, on the presenting
+    thread if there is one.
+
+    Presses that change nothing, like attacking without a sword, are counted
+    apart after ignore_frames.
+    """
+
+    def __init__(self, ignore_frames=settings.LATENCY_IGNORE_FRAMES):
+        self.ignore_frames = ignore_frames
+        self.frames = 0
+        self.pending: List[Press] = []
+        self.applied_presses: List[Applied] = []
+        # Seconds from the press to the display, and from the game acting on
+        # it to the display, by action.
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.presenting: Dict[str, List[float]] = defaultdict(list)
+        self.ignored: Dict[str, int] = defaultdict(int)
+
+    def press(self, action: str, when: float = None):
+        self.pending.append(
+            Press(action, time.perf_counter() if when is None else when, self.frames)
+        )
+
+    def applied(self, action: str):
+        now = time.perf_counter()
+        still_pending = []
+        for press in self.pending:
+            if press.action == action:
+                self.applied_presses.append(Applied(action, press.pressed, now))
+            else:
+                still_pending.append(press)
+        self.pending = still_pending
+
+    def drawn(self) -> List[Applied]:
+        """
+        Presses the frame being drawn shows, to give back to presented().
+        """
+        self.frames += 1
+        if self.pending and self.frames - self.pending[0].frame > self.ignore_frames:
+            still_pending = []
+            for press in self.pending:
+                if self.frames - press.frame > self.ignore_frames:
+                    self.ignored[press.action] += 1
+                else:
+                    still_pending.append(press)
+            self.pending = still_pending
+        shown, self.applied_presses = self.applied_presses, []
+        return shown
+
+    def presented(self, shown: List[Applied]):
+        now = time.perf_counter()
+        for action, pressed, applied in shown:
+            self.latencies[action].append(now - pressed)
+            self.presenting[action].append(now - applied)
+
+    def report(self) -> str:
+        lines = ["Input to display latency (ms):"]
+        for action in sorted(set(self.latencies) | set(self.ignored)):
+            latencies = self.latencies.get(action)
+            if not latencies:
+                lines.append(f"  {action}: {self.ignored[action]} changed nothing")
+                continue
+            ms = [seconds * 1000 for seconds in latencies]
+            lines.append(
+                f"  {action}: {len(ms)} presses, p50 {percentile(ms, 0.5):.1f}, "
+                f"p90 {percentile(ms, 0.9):.1f}, p99 {percentile(ms, 0.99):.1f}, "
+                f"max {max(ms):.1f}; drawing and presenting p50 "
+                f"{percentile(self.presenting[action], 0.5) * 1000:.1f}; "
+                f"{self.ignored[action]} changed nothing"
+            )
+        if len(lines) == 1:
+            lines.append("  no presses")
+        return "\n".join(lines)
+
+
+_current = LatencyTracker() if settings.LATENCY_TRACKING else None
+
+
+def get_latency_tracker() -> LatencyTracker:
+    return _current
+
+
+def set_latency_tracker(tracker: LatencyTracker) -> LatencyTracker:
+    global _current
+    _current = tracker
+    return tracker
@@ -1,8 +1,12 @@
-from random import choice
+from random import choice, choices
 
 import pygame
 
 import constants
+import settings
+from clock import get_game_clock
+from lighting import Lighting
+from scheduler import get_scheduler, PRIORITY_URGENT
 from sprites.ui import Score, EphemeralBanner
 
 
@@ -15,6 +19,8 @@ class Level:
         title=None,
         allowed_enemies=None,
         allowed_potions=None,
+        arena_screens=(1, 1),
+        lighting: Lighting = None,
     ):
         self.number = 0
         self.title = title or "No title"
@@ -30,6 +36,20 @@ class Level:
         ]
         self._announce_win_flag = True
         self.next_level = None
+        self.endless = False
+        # Size of the play area, in screens.
+        self.arena_screens = arena_screens
+        # Dark levels are lit by the player and what glows, see lighting.py.
+        self.lighting = lighting
+
+    def start(self):
+        self._announce_win_flag = True
+
+    def due_wave(self) -> int:
+        return 0
+
+    def red_potion_spawns(self) -> int:
+        return 1
 
     def random_enemy(self):
         return choice(self.allowed_enemies)
@@ -43,13 +63,80 @@ class Level:
         return flag
 
     def put_banner(self, group: pygame.sprite.Group):
-        group.add(
+        self.show_banner(
+            group,
             EphemeralBanner(
                 2,
                 self.screen,
                 main_text=self.title,
                 secondary_text=f"Level {self.number}",
-            )
+            ),
+        )
+
+    @staticmethod
+    def show_banner(group: pygame.sprite.Group, banner, within=0.1):
+        # Rasterizing the fonts is spread over the next frames.
+        def task():
+            yield from banner.render_steps()
+            group.add(banner)
+
+        get_scheduler().add(task(), PRIORITY_URGENT, within=within)
+
+
+class HordeLevel(Level):
+    def __init__(
+        self,
+        screen,
+        display_size,
+        wave_seconds=settings.HORDE_WAVE_SECONDS,
+        wave_growth=settings.HORDE_WAVE_GROWTH,
+        arena_screens=settings.HORDE_ARENA_SCREENS,
+    ):
+        super().__init__(
+            screen,
+            display_size,
+            max_score=None,
+            title="Endless Horde",
+            allowed_enemies=list(constants.MOBS_DICT),
+            arena_screens=arena_screens,
+        )
+        self.endless = True
+        self.wave_seconds = wave_seconds
+        self.wave_growth = wave_growth
+        self.wave = 0
+        self.next_wave = 0
+
+    def start(self):
+        super().start()
+        self.wave = 0
+        self.next_wave = get_game_clock().time() + self.wave_seconds
+
+    def due_wave(self) -> int:
+        if get_game_clock().time() < self.next_wave:
+            return 0
+        self.wave += 1
+        self.next_wave += self.wave_seconds
+        return self.wave * self.wave_growth
+
+    def red_potion_spawns(self) -> int:
+        return 1 + self.wave // 2
+
+    def random_potion(self):
+        # Red potions get more likely as the waves go by.
+        return choices(
+            [constants.POTION_GREEN, constants.POTION_RED, constants.POTION_BLUE],
+            weights=[3, 1 + self.wave, 1],
+        )[0]
+
+    def put_banner(self, group: pygame.sprite.Group):
+        self.show_banner(
+            group,
+            EphemeralBanner(
+                2,
+                self.screen,
+                main_text=self.title,
+                secondary_text="Survive as long as you can",
+            ),
         )
 
 
@@ -152,6 +239,12 @@ def load_levels(screen):
                 constants.POTION_RED,
                 constants.POTION_BLUE,
             ],
+            lighting=Lighting(
+                ambient=(14, 14, 28),
+                player_radius=320,
+                potion_radius=90,
+                enemy_eyes=True,
+            ),
         ),
         Level(
             screen,
@@ -161,6 +254,12 @@ def load_levels(screen):
             allowed_potions=[
                 constants.POTION_RED,
             ],
+            lighting=Lighting(
+                ambient=(70, 16, 10),
+                player_radius=380,
+                potion_radius=110,
+                enemy_eyes=True,
+            ),
         ),
     ]
     for i in range(len(levels) - 1):
@@ -171,3 +270,9 @@ def load_levels(screen):
         levels[i].number = i + 1
 
     return levels[0]
+
+
+def load_horde(screen):
+    level = HordeLevel(screen, screen.get_size())
+    level.number = 1
+    return level
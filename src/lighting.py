@@ -0,0 +1,220 @@
+import math
+import logging
+from collections import namedtuple
+from typing import Dict, Iterable, List
+
+import numpy as np
+import pygame
+from pygame.sprite import Sprite
+
+import constants
+import settings
+from camera import Camera
+from memory import track, ORIGIN_LIGHTING
+
+logger = logging.getLogger(__name__)
+
+# How a dark level is lit: the color of the darkness, how far the light around
+# the player reaches, in pixels, how far potions glow, 0 for not at all, and
+# whether enemies show their eyes.
+Lighting = namedtuple(
+    "Lighting", ["ambient", "player_radius", "potion_radius", "enemy_eyes"]
+)
+# A frame's light for the render backends: the image that multiplies the
+# world, the rects of it that changed since the backend last had this image,
+# the rects where the light isn't the last frame's, and glows added over the
+# darkness, as (image, rect) blits.
+LitFrame = namedtuple("LitFrame", ["image", "updated", "changed", "glows"])
+
+PLAYER_LIGHT = (255, 220, 170)
+POTION_LIGHTS = {
+    constants.POTION_RED: (230, 60, 50),
+    constants.POTION_GREEN: (60, 220, 80),
+    constants.POTION_BLUE: (70, 110, 240),
+}
+EYES_LIGHT = (255, 40, 20)
+EYES_RADIUS = 12
+
+
+def light_image(radius: int, color, cell: int) -> pygame.Surface:
+    """
+    A light fading from color at the center to black at radius pixels,
+    computed on cells and scaled up. Cells are centered cell pixels apart
+    from the first pixel, as smoothscale leaves them.
+    """
+    cells = math.ceil(2 * radius / cell) + 1
+    side = (np.arange(cells, dtype=np.float32) - (cells - 1) / 2) * cell / radius
+    light = np.clip(1 - side[:, None] ** 2 - side[None, :] ** 2, 0, None) ** 2
+    pixels = (light[..., None] * np.asarray(color, np.float32)).astype(np.uint8)
+    size = (cells - 1) * cell
+    return pygame.transform.smoothscale(
+        pygame.surfarray.make_surface(pixels), (size, size)
+    )
+
+
+def uncovered(rect: pygame.Rect, cover: pygame.Rect) -> List[pygame.Rect]:
+    """
+    The parts of rect outside cover, as up to four rects.
+    """
+    if not rect.colliderect(cover):
+        return [rect]
+    inside = rect.clip(cover)
+    parts = [
+        pygame.Rect(rect.left, rect.top, rect.width, inside.top - rect.top),
+        pygame.Rect(rect.left, inside.bottom, rect.width, rect.bottom - inside.bottom),
+        pygame.Rect(rect.left, inside.top, inside.left - rect.left, inside.height),
+        pygame.Rect(inside.right, inside.top, rect.right - inside.right, inside.height),
+    ]
+    return [part for part in parts if part.width > 0 and part.height > 0]
+
+
+class LightBuffer:
+    def __init__(self, size):
+        self.image = track(pygame.Surface(size), ORIGIN_LIGHTING)
+        # Darkness the image was filled with, None until it's first drawn.
+        self.ambient = None
+        # Lights added the last time the image was drawn, and where.
+        self.lights = []
+        self.lit: List[pygame.Rect] = []
+
+
+class LightMap:
+    """
+    Darkness over the world, with light around the player and potions
+    glowing. Every light is computed once, with NumPy on a grid of cells a few
+    pixels wide, and scaled up with smoothscale: scaling a whole screen up
+    every frame would take longer than drawing it. Each frame only where the
+    lights were is darkened again and the lights are added where they are
+    now, then the map multiplies the world in a single BLEND_MULT blit.
+    Enemy eyes glow over the darkness instead.
+
+    The first light, the player's, is copied over the darkness already added
+    to it, so where it is now isn't darkened first. Mostly it moves a few
+    pixels, and only the thin strips it left are.
+
+    Backends that present a frame while the next one is drawn need the map
+    to stay the same meanwhile, buffers keep that many of them.
+    """
+
+    def __init__(self, size, cell=settings.LIGHT_MAP_CELL, buffers=1):
+        self.size = tuple(size)
+        self.cell = cell
+        self.buffers = [LightBuffer(self.size) for _ in range(buffers)]
+        self.frame = 0
+        self.images: Dict[tuple, pygame.Surface] = {}
+        # The light of the last frame, whichever buffer it was in.
+        self.last_ambient = None
+        self.last_lights = []
+        self.last_lit: List[pygame.Rect] = []
+
+    def light(self, radius: int, color) -> pygame.Surface:
+        image = self.images.get((radius, color))
+        if image is None:
+            image = light_image(radius, color, self.cell)
+            self.images[radius, color] = track(image, ORIGIN_LIGHTING)
+        return image
+
+    def lit(self, radius: int, color, ambient) -> pygame.Surface:
+        # A light added to the darkness.
+        image = self.images.get((radius, color, ambient))
+        if image is None:
+            image = self.light(radius, color).copy()
+            image.fill(ambient, special_flags=pygame.BLEND_RGB_ADD)
+            self.images[radius, color, ambient] = track(image, ORIGIN_LIGHTING)
+        return image
+
+    def prepare(self, lighting: Lighting):
+        """
+        Renders the lights of a level ahead of its first frame.
+        """
+        self.lit(lighting.player_radius, PLAYER_LIGHT, lighting.ambient)
+        if lighting.potion_radius:
+            for color in POTION_LIGHTS.values():
+                self.light(lighting.potion_radius, color)
+        if lighting.enemy_eyes:
+            self.light(EYES_RADIUS, EYES_LIGHT)
+
+    def render(
+        self,
+        lighting: Lighting,
+        camera: Camera,
+        player: Sprite,
+        potions: Iterable[Sprite],
+        enemies: Iterable[Sprite],
+    ) -> LitFrame:
+        lights = []
+        # The player's light is copied, not added, see above.
+        copied = player.alive()
+        if copied:
+            lights.append(
+                (
+                    self.lit(lighting.player_radius, PLAYER_LIGHT, lighting.ambient),
+                    camera.to_screen(player.rect).center,
+                )
+            )
+        if lighting.potion_radius:
+            for potion in camera.cull(potions):
+                lights.append(
+                    (
+                        self.light(lighting.potion_radius, POTION_LIGHTS[potion.color]),
+                        camera.to_screen(potion.rect).center,
+                    )
+                )
+
+        buffer = self.buffers[self.frame % len(self.buffers)]
+        self.frame += 1
+        image = buffer.image
+        if buffer.ambient != lighting.ambient:
+            image.fill(lighting.ambient)
+            buffer.ambient = lighting.ambient
+            buffer.lights = []
+            updated = [image.get_rect()]
+        elif buffer.lights != lights:
+            darkened = buffer.lit
+            if copied:
+                light, center = lights[0]
+                cover = light.get_rect(center=center)
+                darkened = [
+                    part for rect in darkened for part in uncovered(rect, cover)
+                ]
+            updated = [image.fill(lighting.ambient, rect) for rect in darkened]
+        else:
+            # Nothing moved.
+            updated = []
+        if buffer.lights != lights:
+            buffer.lit = [
+                image.blit(
+                    light,
+                    light.get_rect(center=center),
+                    None,
+                    0 if copied and index == 0 else pygame.BLEND_ADD,
+                )
+                for index, (light, center) in enumerate(lights)
+            ]
+            buffer.lights = lights
+            updated.extend(buffer.lit)
+
+        if self.last_ambient != lighting.ambient:
+            changed = [image.get_rect()]
+        elif self.last_lights != lights:
+            changed = self.last_lit + buffer.lit
+        else:
+            changed = []
+        self.last_ambient = lighting.ambient
+        self.last_lights = lights
+        self.last_lit = buffer.lit
+
+        glows = []
+        if lighting.enemy_eyes:
+            eyes = self.light(EYES_RADIUS, EYES_LIGHT)
+            for enemy in camera.cull(enemies):
+                rect = camera.to_screen(enemy.rect)
+                glows.append(
+                    (
+                        eyes,
+                        eyes.get_rect(
+                            center=(rect.centerx, rect.top + rect.height // 4)
+                        ),
+                    )
+                )
+        return LitFrame(image, updated, changed, glows)
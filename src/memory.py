@@ -0,0 +1,148 @@
+import gc
+import time
+import weakref
+import logging
+from collections import namedtuple, defaultdict
+from pathlib import Path
+from typing import Dict
+
+import pygame
+from pygame.sprite import Sprite
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+# Origins for surfaces that are not owned by a sprite. Surfaces reachable from
+# a sprite are reported under the sprite's class name instead.
+ORIGIN_CACHE = "cache"
+ORIGIN_BACKGROUND = "background"
+ORIGIN_TRANSITION = "transition"
+ORIGIN_DISPLAY = "display"
+ORIGIN_LIGHTING = "lighting"
+
+SurfaceStats = namedtuple("SurfaceStats", ["count", "bytes"])
+
+_origins = weakref.WeakKeyDictionary()
+
+
+def track(surface: pygame.Surface, origin: str) -> pygame.Surface:
+    _origins[surface] = origin
+    return surface
+
+
+def surface_bytes(surface: pygame.Surface) -> int:
+    # Subsurfaces are views on their parent's pixels, they don't own memory.
+    if surface.get_parent() is not None:
+        return 0
+    return surface.get_pitch() * surface.get_height()
+
+
+def live_surfaces() -> Dict[int, tuple]:
+    """
+    Map id(surface) -> (surface, origin) for every surface we can reach:
+    every tracked one, whatever holds it, and those sprites hold themselves,
+    in attributes or in lists and dicts of them.
+    """
+    found = {}
+
+    def add(surface, origin):
+        while surface is not None and id(surface) not in found:
+            found[id(surface)] = (surface, _origins.get(surface, origin))
+            # Keep the parent of a subsurface alive in the report, that's where
+            # the pixels are.
+            surface = surface.get_parent()
+
+    for surface, origin in list(_origins.items()):
+        add(surface, origin)
+
+    for obj in gc.get_objects():
+        if not isinstance(obj, Sprite):
+            continue
+        for value in vars(obj).values():
+            if isinstance(value, dict):
+                values = value.values()
+            elif isinstance(value, (list, tuple)):
+                values = value
+            else:
+                values = (value,)
+            for value in values:
+                if isinstance(value, pygame.Surface):
+                    add(value, type(obj).__name__)
+    return found
+
+
+def snapshot() -> Dict[str, SurfaceStats]:
+    gc.collect()
+    counts = defaultdict(int)
+    sizes = defaultdict(int)
+    for surface, origin in live_surfaces().values():
+        counts[origin] += 1
+        sizes[origin] += surface_bytes(surface)
+    return {origin: SurfaceStats(counts[origin], sizes[origin]) for origin in counts}
+
+
+def cache_sizes() -> Dict[str, int]:
+    from sprites import images
+
+    return {
+        name: function.cache_info().currsize
+        for name, function in vars(images).items()
+        if hasattr(function, "cache_info")
+    }
+
+
+def diff(before: Dict[str, SurfaceStats], after: Dict[str, SurfaceStats]):
+    empty = SurfaceStats(0, 0)
+    return {
+        origin: SurfaceStats(
+            after.get(origin, empty).count - before.get(origin, empty).count,
+            after.get(origin, empty).bytes - before.get(origin, empty).bytes,
+        )
+        for origin in set(before) | set(after)
+    }
+
+
+def report(stats: Dict[str, SurfaceStats]) -> str:
+    lines = [f"{'origin':<24}{'count':>8}{'KiB':>12}"]
+    for origin, (count, size) in sorted(
+        stats.items(), key=lambda item: item[1].bytes, reverse=True
+    ):
+        lines.append(f"{origin:<24}{count:>8}{size / 1024:>12.1f}")
+    total = sum(s.bytes for s in stats.values())
+    lines.append(
+        f"{'total':<24}{sum(s.count for s in stats.values()):>8}{total / 1024:>12.1f}"
+    )
+    lines.append(
+        "lru caches: " + ", ".join(f"{k}={v}" for k, v in cache_sizes().items())
+    )
+    return "\n".join(lines)
+
+
+class MemoryMonitor:
+    def __init__(self, tolerance=settings.MEMORY_GROWTH_TOLERANCE):
+        self.tolerance = tolerance
+        self.checkpoints = {}
+        self.growth = []
+
+    def checkpoint(self, label: str) -> Dict[str, SurfaceStats]:
+        current = snapshot()
+        previous = self.checkpoints.get(label)
+        self.checkpoints[label] = current
+        if previous is not None:
+            for origin, (count, size) in diff(previous, current).items():
+                if size > self.tolerance:
+                    logger.warning(
+                        f"Surfaces from {origin} grew by {count} ({size} bytes) "
+                        f"since last {label}."
+                    )
+                    self.growth.append((label, origin, count, size))
+        return current
+
+    def dump(self, path=Path("./memory_report.txt")) -> str:
+        text = report(self.checkpoint("report"))
+        with path.open(mode="a") as report_file:
+            report_file.write(f"--- {time.strftime('%m/%d/%Y %I:%M:%S %p')}\n")
+            report_file.write(text + "\n")
+        logger.info(f"Memory report:\n{text}")
+        return text
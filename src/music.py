@@ -0,0 +1,143 @@
+import logging
+from collections import deque, namedtuple
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+import pygame
+
+import settings
+import constants
+
+logger = logging.getLogger(__name__)
+
+Track = namedtuple("Track", ["path", "loops", "fade_ms"])
+
+
+def decoded_size(path: Path) -> Optional[int]:
+    """
+    Bytes a pygame.mixer.Sound would take for this file at the mixer's format,
+    read from the file headers so nothing has to be decoded.
+    """
+    mixer = pygame.mixer.get_init()
+    if not mixer:
+        return None
+    frequency, size, channels = mixer
+    bytes_per_second = frequency * channels * abs(size) // 8
+
+    path = Path(path)
+    with path.open(mode="rb") as audio_file:
+        head = audio_file.read(4096)
+        if path.suffix == ".ogg":
+            # Vorbis identification header: version (4), channels (1), rate (4).
+            start = head.find(b"\x01vorbis")
+            if start < 0:
+                return None
+            rate = int.from_bytes(head[start + 12 : start + 16], "little")
+            # The granule position of the last page is the total of samples.
+            audio_file.seek(max(path.stat().st_size - 65536, 0))
+            tail = audio_file.read()
+            last_page = tail.rfind(b"OggS")
+            if last_page < 0 or not rate:
+                return None
+            samples = int.from_bytes(tail[last_page + 6 : last_page + 14], "little")
+            return int(samples / rate * bytes_per_second)
+        elif path.suffix == ".wav":
+            start = head.find(b"fmt ")
+            data = head.find(b"data")
+            if start < 0 or data < 0:
+                return None
+            file_bytes_per_second = int.from_bytes(
+                head[start + 16 : start + 20], "little"
+            )
+            data_size = int.from_bytes(head[data + 4 : data + 8], "little")
+            return int(data_size / file_bytes_per_second * bytes_per_second)
+    return None
+
+
+class MusicManager:
+    """
+    Streams background tracks through pygame.mixer.music instead of keeping
+    them decoded in memory. There's a single music stream, so switching tracks
+    fades the current one out and the next one in.
+    """
+
+    def __init__(
+        self, volume=settings.VOLUME, crossfade_ms=settings.MUSIC_CROSSFADE_MS
+    ):
+        self.volume = volume
+        self.crossfade_ms = crossfade_ms
+        self.tracks = deque()
+        self.current = None
+        self.paused = False
+        self.fading = False
+
+    def play(self, path: Path, loops: int = -1, crossfade_ms: Optional[int] = None):
+        """
+        Replace whatever is playing or queued with path.
+        """
+        crossfade_ms = self.crossfade_ms if crossfade_ms is None else crossfade_ms
+        self.tracks.clear()
+        self.queue(path, loops, fade_ms=crossfade_ms // 2)
+        if self.current and pygame.mixer.music.get_busy() and crossfade_ms:
+            self.fadeout(crossfade_ms // 2)
+        else:
+            self._halt()
+            self.update()
+
+    def queue(self, path: Path, loops: int = 0, fade_ms: int = 0):
+        self.tracks.append(Track(Path(path), loops, fade_ms))
+
+    def fadeout(self, milliseconds: int):
+        if milliseconds <= 0:
+            self.stop()
+            return
+        self.fading = True
+        pygame.mixer.music.fadeout(int(milliseconds))
+
+    def stop(self):
+        self.tracks.clear()
+        self.fading = False
+        self._halt()
+
+    def _halt(self):
+        # A stopped track isn't paused anymore, or the next one wouldn't start
+        # until the game is unpaused.
+        self.current = None
+        self.paused = False
+        pygame.mixer.music.unpause()
+        pygame.mixer.music.stop()
+
+    def pause(self):
+        self.paused = True
+        pygame.mixer.music.pause()
+
+    def unpause(self):
+        self.paused = False
+        pygame.mixer.music.unpause()
+
+    def update(self):
+        """
+        Start the next queued track once the current one is over. Call it once
+        per frame from the running scene.
+        """
+        if self.paused or pygame.mixer.music.get_busy():
+            return
+        self.fading = False
+        self.current = None
+        if self.tracks:
+            self.current = self.tracks.popleft()
+            pygame.mixer.music.load(str(self.current.path))
+            pygame.mixer.music.set_volume(self.volume)
+            pygame.mixer.music.play(
+                loops=self.current.loops, fade_ms=self.current.fade_ms
+            )
+
+    def memory_saved(self, paths=constants.MUSIC_TRACKS) -> int:
+        sizes = [decoded_size(path) for path in paths]
+        return sum(size for size in sizes if size)
+
+
+@lru_cache(maxsize=1)
+def get_music_manager() -> MusicManager:
+    return MusicManager()
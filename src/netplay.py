@@ -0,0 +1,523 @@
+import time
+import zlib
+import heapq
+import random
+import socket
+import struct
+import logging
+from abc import ABC, abstractmethod
+from itertools import count
+from typing import Callable, List, Tuple
+
+import settings
+from clock import get_game_clock
+
+logger = logging.getLogger(__name__)
+
+PLAYERS = 2
+
+# The input of a player for a frame fits in a byte: horizontal and vertical
+# direction, each -1, 0 or 1, and whether the sword is swung.
+ATTACK_BIT = 1 << 4
+
+
+def pack_input(move, attack: bool) -> int:
+    return (int(move[0]) + 1) | (int(move[1]) + 1) << 2 | (ATTACK_BIT if attack else 0)
+
+
+def unpack_input(value: int) -> Tuple[Tuple[int, int], bool]:
+    return ((value & 3) - 1, (value >> 2 & 3) - 1), bool(value & ATTACK_BIT)
+
+
+NEUTRAL_INPUT = pack_input((0, 0), False)
+
+KIND_HELLO = 0
+KIND_INPUTS = 1
+KIND_DIGEST = 2
+KIND_BYE = 3
+
+# Who says hello, the seed and the size of the arena's chunks the host picked.
+HELLO = struct.Struct("!BBIHH")
+# Inputs of the sender from frame first on, followed by count bytes. ack is the
+# last frame of the receiver's inputs the sender has all of, frame the one the
+# sender is simulating and advantage how many frames it thinks it's ahead.
+INPUTS = struct.Struct("!BIIIbB")
+DIGEST = struct.Struct("!BII")
+BYE = struct.Struct("!B")
+# Inputs a packet carries at most.
+MAX_INPUTS = 255
+
+
+def digest(checkpoint) -> int:
+    """
+    Checksum of the numbers and strings in a checkpoint, anything else
+    (sprites, surfaces) is left out, so both sides can compare theirs.
+    """
+
+    def plain(value):
+        if isinstance(value, (int, float, str, type(None))):
+            return value
+        if isinstance(value, (tuple, list)):
+            return tuple(plain(item) for item in value)
+        return None
+
+    return zlib.crc32(repr(plain(checkpoint)).encode())
+
+
+class Transport(ABC):
+    """
+    Carries packets to the other side, late and unreliably like the network
+    does: packets can be delayed latency seconds plus up to jitter seconds,
+    which may reorder them, and a share of loss of them is dropped. Both are
+    zero on real connections and are there to test with.
+    """
+
+    def __init__(
+        self,
+        latency=settings.NETPLAY_LATENCY_MS / 1000,
+        jitter=settings.NETPLAY_JITTER_MS / 1000,
+        loss=settings.NETPLAY_LOSS,
+        seed=None,
+        now: Callable[[], float] = time.perf_counter,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.now = now
+        self.queue = []
+        self._order = count()
+        self.sent = 0
+        self.lost = 0
+
+    def send(self, data: bytes):
+        self.sent += 1
+        if self.loss and self.random.random() < self.loss:
+            self.lost += 1
+            return
+        if not self.latency and not self.jitter:
+            self._send(data)
+            return
+        due = self.now() + self.latency + self.random.uniform(0, self.jitter)
+        heapq.heappush(self.queue, (due, next(self._order), data))
+
+    def receive(self) -> List[bytes]:
+        now = self.now()
+        while self.queue and self.queue[0][0] <= now:
+            self._send(heapq.heappop(self.queue)[2])
+        return self._receive()
+
+    def close(self):
+        pass
+
+    @abstractmethod
+    def _send(self, data: bytes):
+        pass
+
+    @abstractmethod
+    def _receive(self) -> List[bytes]:
+        pass
+
+
+class Loopback(Transport):
+    """
+    Stand-in for the network between two sessions in the same process.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.other = None
+        self.inbox = []
+
+    @classmethod
+    def pair(cls, *args, **kwargs) -> Tuple["Loopback", "Loopback"]:
+        left, right = cls(*args, **kwargs), cls(*args, **kwargs)
+        left.other, right.other = right, left
+        # Both ends lose different packets.
+        right.random.seed(left.random.random())
+        return left, right
+
+    def _send(self, data: bytes):
+        self.other.inbox.append(data)
+
+    def _receive(self) -> List[bytes]:
+        packets, self.inbox = self.inbox, []
+        return packets
+
+
+class UdpTransport(Transport):
+    def __init__(self, port: int, peer: Tuple[str, int], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.peer = (socket.gethostbyname(peer[0]), peer[1])
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("", port))
+        self.socket.setblocking(False)
+
+    def _send(self, data: bytes):
+        try:
+            self.socket.sendto(data, self.peer)
+        except OSError as error:
+            logger.debug(f"Couldn't send to {self.peer}: {error}")
+
+    def _receive(self) -> List[bytes]:
+        packets = []
+        while True:
+            try:
+                data, address = self.socket.recvfrom(2048)
+            except BlockingIOError:
+                return packets
+            except ConnectionError:
+                # The other side isn't listening yet.
+                continue
+            if address == self.peer:
+                packets.append(data)
+
+    def close(self):
+        self.socket.close()
+
+
+class Puppet:
+    """
+    Simulation of a player that only makes up inputs: it walks somewhere for
+    half a second, then somewhere else, and swings the sword now and then.
+    It stands in for the other player over a Loopback, and for the local one
+    in headless runs.
+    """
+
+    def __init__(self, seed=0):
+        self.seed = seed
+
+    def input_at(self, frame: int) -> int:
+        walk = random.Random(f"{self.seed} walks {frame // 30}")
+        move = (walk.randint(-1, 1), walk.randint(-1, 1))
+        attack = random.Random(f"{self.seed} swings {frame}").random() < 0.1
+        return pack_input(move, attack)
+
+    def checkpoint(self):
+        return None
+
+    def rewind(self, checkpoint):
+        pass
+
+    def step(self, inputs):
+        pass
+
+
+class RollbackSession:
+    """
+    Keeps a simulation in step with the other player's copy of it. Only
+    inputs go over the network: every frame the local one is sent for
+    input_delay frames later, so with low latency the other side has it in
+    time. When the other player's input is late they're assumed to keep doing
+    what they last did, and when it arrives and says otherwise the simulation
+    goes back to the checkpoint before that frame and simulates the frames
+    since again. That's max_rollback frames at most, further ahead than that
+    it waits for the other player. Simulating frames again stops once it
+    took replay_budget seconds, and goes on the next frames instead of
+    simulating new ones, as when waiting: a horde takes a few milliseconds
+    a frame, max_rollback of them wouldn't fit in one.
+
+    The simulation needs checkpoint(), rewind(checkpoint) and step(inputs),
+    with the inputs of every player for a frame, and has to be deterministic:
+    the same inputs from the same checkpoint always end in the same state.
+    Both sides compare digests of their checkpoints every digest_frames to
+    tell when it isn't, 0 leaves them out (a Puppet has nothing to compare).
+    """
+
+    def __init__(
+        self,
+        simulation,
+        transport: Transport,
+        player=settings.NETPLAY_PLAYER,
+        seed: int = None,
+        size: Tuple[int, int] = (0, 0),
+        input_delay=settings.NETPLAY_INPUT_DELAY,
+        max_rollback=settings.NETPLAY_MAX_ROLLBACK,
+        timeout=settings.NETPLAY_TIMEOUT_SECONDS,
+        digest_frames=settings.NETPLAY_DIGEST_FRAMES,
+        replay_budget=settings.NETPLAY_REPLAY_MS / 1000,
+        now: Callable[[], float] = time.perf_counter,
+    ):
+        self.simulation = simulation
+        self.transport = transport
+        self.player = player
+        # Player 0 hosts: picks the seed and the size of the arena.
+        self.seed = seed if player == 0 else None
+        self.size = size if player == 0 else None
+        self.input_delay = input_delay
+        self.max_rollback = max_rollback
+        self.timeout = timeout
+        self.digest_frames = digest_frames
+        self.replay_budget = replay_budget
+        self.now = now
+        self.connected = False
+        self.closed = False
+        self.last_heard = now()
+
+        # Next frame to simulate.
+        self.frame = 0
+        # The first frames go by before anyone could have pressed anything.
+        self.local_inputs = {frame: NEUTRAL_INPUT for frame in range(input_delay)}
+        self.remote_inputs = {}
+        # Every input of the other player up to this frame is here.
+        self.confirmed = -1
+        # Every local input up to this frame got to the other player.
+        self.acknowledged = -1
+        self.remote_frame = 0
+        self.remote_advantage = 0
+        # Inputs each simulated frame used and checkpoints from before it, for
+        # the frames that may still be simulated again.
+        self.used = {}
+        self.checkpoints = {}
+        self.rollback_from = None
+        # Next frame to simulate again, while catching up after a rollback.
+        self.replay = None
+        self.local_digests = {}
+        self.remote_digests = {}
+        self.last_digest = -1
+        self.last_wait = 0
+
+        self.rollbacks = 0
+        self.replayed = 0
+        self.longest = 0
+        self.slowest = 0.0
+        self.over_budget = 0
+        self.behind = 0
+        self.stalls = 0
+        self.waits = 0
+        self.compared = 0
+        self.desyncs = 0
+
+    @property
+    def remote(self) -> int:
+        return 1 - self.player
+
+    def connect(self) -> bool:
+        """
+        Says hello until the other side answers, call it every frame until it
+        returns True. The guest has the host's seed and size by then.
+        """
+        if not self.connected:
+            self._send_hello()
+        self._receive()
+        return self.connected
+
+    def advance(self, local_input: int) -> bool:
+        """
+        Sends local_input and simulates the next frame, after going back and
+        simulating again the frames the other player's inputs changed. Returns
+        False when waiting for the other player instead.
+        """
+        self._receive()
+        if self.closed:
+            return False
+        if self._roll_back():
+            self._send_inputs()
+            return False
+        self._settle()
+        if self._must_wait():
+            self._send_inputs()
+            return False
+        self.local_inputs[self.frame + self.input_delay] = local_input
+        self._send_inputs()
+        self._simulate(self.frame)
+        self.frame += 1
+        return True
+
+    def close(self):
+        if not self.closed:
+            # Some may not make it.
+            for _ in range(3):
+                self.transport.send(BYE.pack(KIND_BYE))
+            self.closed = True
+        self.transport.close()
+
+    def _inputs(self, frame: int) -> Tuple[int, ...]:
+        local = self.local_inputs[frame]
+        remote = self.remote_inputs.get(frame)
+        if remote is None:
+            remote = self.remote_inputs.get(self.confirmed, NEUTRAL_INPUT)
+        return (local, remote) if self.player == 0 else (remote, local)
+
+    def _simulate(self, frame: int):
+        self.checkpoints[frame] = self.simulation.checkpoint()
+        inputs = self.used[frame] = self._inputs(frame)
+        self.simulation.step(inputs)
+
+    def _roll_back(self) -> bool:
+        """
+        Simulates again the frames a wrong guess changed, or some of them.
+        Returns True when there are frames left for the next time.
+        """
+        start, self.rollback_from = self.rollback_from, None
+        # Frames still to simulate again use the inputs that came meanwhile.
+        if start is not None and (self.replay is None or start < self.replay):
+            self.simulation.rewind(self.checkpoints[start])
+            self.replay = start
+            self.rollbacks += 1
+            self.longest = max(self.longest, self.frame - start)
+        if self.replay is None:
+            return False
+        started = time.perf_counter()
+        clock = get_game_clock()
+        clock.replaying = True
+        try:
+            while self.replay < self.frame:
+                self._simulate(self.replay)
+                self.replay += 1
+                self.replayed += 1
+                if time.perf_counter() - started > self.replay_budget:
+                    break
+        finally:
+            clock.replaying = False
+        seconds = time.perf_counter() - started
+        self.slowest = max(self.slowest, seconds)
+        if seconds > 1 / clock.framerate:
+            self.over_budget += 1
+            logger.debug(f"Simulating frames again took {seconds:.4f}s.")
+        if self.replay < self.frame:
+            self.behind += 1
+            return True
+        self.replay = None
+        return False
+
+    def _settle(self):
+        # The state before a frame won't change once the other player's inputs
+        # before it are all here: it's compared, and what came before dropped.
+        settled = min(self.confirmed + 1, self.frame - 1)
+        every = self.digest_frames
+        frame = (self.last_digest // every + 1) * every if every else settled + 1
+        while frame <= settled:
+            if frame in self.checkpoints:
+                self.local_digests[frame] = digest(self.checkpoints[frame])
+                self.transport.send(
+                    DIGEST.pack(KIND_DIGEST, frame, self.local_digests[frame])
+                )
+                self._compare(frame)
+            self.last_digest = frame
+            frame += every
+        for frame in [frame for frame in self.checkpoints if frame < settled]:
+            del self.checkpoints[frame]
+            del self.used[frame]
+        # The last confirmed input is the guess for the ones to come, and local
+        # inputs are kept until the other side has them.
+        for frame in [frame for frame in self.remote_inputs if frame < settled - 1]:
+            del self.remote_inputs[frame]
+        for frame in [
+            frame
+            for frame in self.local_inputs
+            if frame < settled and frame <= self.acknowledged
+        ]:
+            del self.local_inputs[frame]
+
+    def _compare(self, frame: int):
+        if frame not in self.local_digests or frame not in self.remote_digests:
+            return
+        self.compared += 1
+        if self.local_digests.pop(frame) != self.remote_digests.pop(frame):
+            self.desyncs += 1
+            logger.error(f"The simulations went apart before frame {frame}.")
+
+    def _must_wait(self) -> bool:
+        if self.frame - self.confirmed > self.max_rollback:
+            self.stalls += 1
+            return True
+        # Frames ahead of the other player, half what one sees and the other
+        # doesn't, as latency hides the same frames to both. The one that's
+        # ahead skips a frame now and then so the other catches up, or it
+        # would be the one rolling back all the time.
+        drift = ((self.frame - self.remote_frame) - self.remote_advantage) / 2
+        if drift >= 2 and self.frame - self.last_wait >= settings.FRAMERATE // 4:
+            self.last_wait = self.frame
+            self.waits += 1
+            return True
+        return False
+
+    def _send_hello(self):
+        width, height = self.size or (0, 0)
+        self.transport.send(
+            HELLO.pack(KIND_HELLO, self.player, self.seed or 0, width, height)
+        )
+
+    def _send_inputs(self):
+        latest = max(self.local_inputs)
+        first = max(self.acknowledged + 1, latest - MAX_INPUTS + 1)
+        inputs = bytes(self.local_inputs[frame] for frame in range(first, latest + 1))
+        advantage = max(min(self.frame - self.remote_frame, 127), -128)
+        self.transport.send(
+            INPUTS.pack(
+                KIND_INPUTS,
+                first,
+                self.confirmed & 0xFFFFFFFF,
+                self.frame,
+                advantage,
+                len(inputs),
+            )
+            + inputs
+        )
+
+    def _receive(self):
+        for packet in self.transport.receive():
+            try:
+                self._handle(packet)
+            except (struct.error, IndexError):
+                logger.debug(f"Dropped a malformed packet: {packet!r}")
+        if self.connected and self.now() - self.last_heard > self.timeout:
+            logger.warning("The other player stopped answering.")
+            self.closed = True
+
+    def _handle(self, packet: bytes):
+        kind = packet[0]
+        self.last_heard = self.now()
+        if kind == KIND_HELLO:
+            _, player, seed, width, height = HELLO.unpack(packet)
+            if player == self.player:
+                logger.warning(f"Both sides are player {player}.")
+                return
+            if self.player != 0:
+                self.seed, self.size = seed, (width, height)
+            # Answered until the guest stops asking, it may not have the seed.
+            if not self.connected or self.player == 0:
+                self._send_hello()
+            self.connected = True
+        elif kind == KIND_INPUTS:
+            _, first, ack, frame, advantage, length = INPUTS.unpack_from(packet)
+            inputs = packet[INPUTS.size : INPUTS.size + length]
+            if ack != 0xFFFFFFFF:
+                self.acknowledged = max(self.acknowledged, ack)
+            if frame >= self.remote_frame:
+                self.remote_frame, self.remote_advantage = frame, advantage
+            self._take_inputs(first, inputs)
+        elif kind == KIND_DIGEST:
+            _, frame, checksum = DIGEST.unpack(packet)
+            if self.digest_frames:
+                self.remote_digests[frame] = checksum
+                self._compare(frame)
+        elif kind == KIND_BYE:
+            logger.info("The other player left.")
+            self.closed = True
+
+    def _take_inputs(self, first: int, inputs: bytes):
+        for offset, value in enumerate(inputs):
+            frame = first + offset
+            if frame <= self.confirmed or frame in self.remote_inputs:
+                continue
+            self.remote_inputs[frame] = value
+            used = self.used.get(frame)
+            if used is not None and used[self.remote] != value:
+                # Simulated with a wrong guess.
+                if self.rollback_from is None or frame < self.rollback_from:
+                    self.rollback_from = frame
+        while self.confirmed + 1 in self.remote_inputs:
+            self.confirmed += 1
+
+    def report(self) -> str:
+        return (
+            f"Netplay: {self.frame} frames, {self.rollbacks} rollbacks "
+            f"({self.replayed} frames simulated again, {self.longest} at once, "
+            f"{self.slowest * 1000:.2f} ms at worst, {self.over_budget} over a "
+            f"frame, {self.behind} frames catching up), waited {self.stalls} frames for the other player and "
+            f"{self.waits} to let it catch up. {self.compared} digests compared, "
+            f"{self.desyncs} differed. Sent {self.transport.sent} packets, "
+            f"{self.transport.lost} lost."
+        )
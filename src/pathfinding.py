@@ -0,0 +1,135 @@
+from collections import OrderedDict
+from typing import Tuple
+
+import numpy as np
+import pygame
+
+import settings
+
+# Neighbour offsets a cell can point to, diagonals included.
+OFFSETS = np.array(
+    [(-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)],
+    dtype=np.int32,
+)
+DIRECTIONS = OFFSETS / np.linalg.norm(OFFSETS, axis=1)[:, np.newaxis]
+
+
+class FlowField:
+    """
+    Grid over the play area where every cell points to the neighbour that is
+    one step closer to the nearest target, the players. It's shared by every
+    enemy, so following them costs each of them a lookup instead of its own
+    search.
+
+    A field is searched again in full when a target moves to another cell,
+    not repaired: one cell further from a target is one step further for
+    every cell it can reach, so a repair would visit them all anyway, one at
+    a time, where the wavefront visits them a whole ring at once. Fields are
+    kept for the last cached_fields sets of targets: going back to where they
+    were, as rollbacks do (see netplay.py), doesn't search again.
+    """
+
+    def __init__(
+        self,
+        size: Tuple[int, int],
+        cell_size=settings.FLOW_FIELD_CELL_SIZE,
+        cached_fields=settings.FLOW_FIELD_CACHED,
+    ):
+        self.cell_size = cell_size
+        self.shape = (-(-size[0] // cell_size), -(-size[1] // cell_size))
+        self.blocked = np.zeros(self.shape, dtype=bool)
+        self.distance = np.full(self.shape, np.inf, dtype=np.float32)
+        self.direction = np.zeros((*self.shape, 2), dtype=np.float32)
+        self.target = None
+        self.cached_fields = cached_fields
+        self.fields = OrderedDict()
+        # Lookups happen for every enemy on every frame, lists are quicker to
+        # index one cell at a time than arrays.
+        self.blocked_cells = self.blocked.tolist()
+        self.directions = self.direction.tolist()
+
+    def cell(self, position) -> Tuple[int, int]:
+        x = int(position[0] // self.cell_size)
+        y = int(position[1] // self.cell_size)
+        width, height = self.shape
+        # Positions off the grid are in the cells on its edge.
+        if not 0 <= x < width:
+            x = 0 if x < 0 else width - 1
+        if not 0 <= y < height:
+            y = 0 if y < 0 else height - 1
+        return x, y
+
+    def block(self, rect: pygame.Rect):
+        left, top = self.cell(rect.topleft)
+        right, bottom = self.cell((rect.right - 1, rect.bottom - 1))
+        self.blocked[left : right + 1, top : bottom + 1] = True
+        self.blocked_cells = self.blocked.tolist()
+        self.target = None
+        self.fields.clear()
+
+    def blocked_at(self, position) -> bool:
+        x, y = self.cell(position)
+        return self.blocked_cells[x][y]
+
+    def direction_at(self, position) -> Tuple[float, float]:
+        x, y = self.cell(position)
+        return tuple(self.directions[x][y])
+
+    def update(self, *target_positions):
+        # Nothing changes until a target moves to another cell.
+        target = tuple(sorted({self.cell(position) for position in target_positions}))
+        if target == self.target:
+            return
+        self.target = target
+        field = self.fields.get(target)
+        if field is None:
+            field = self.fields[target] = self._compute()
+            while len(self.fields) > self.cached_fields:
+                self.fields.popitem(last=False)
+        else:
+            self.fields.move_to_end(target)
+        self.distance, self.direction, self.directions = field
+
+    def _compute(self):
+        # Breadth first wavefront over the whole grid at once.
+        free = ~self.blocked
+        distance = np.full(self.shape, np.inf, dtype=np.float32)
+        frontier = np.zeros(self.shape, dtype=bool)
+        for cell in self.target:
+            frontier[cell] = True
+        visited = frontier.copy()
+        steps = 0
+        while frontier.any():
+            distance[frontier] = steps
+            steps += 1
+            grown = np.zeros(self.shape, dtype=bool)
+            grown[1:, :] |= frontier[:-1, :]
+            grown[:-1, :] |= frontier[1:, :]
+            grown[:, 1:] |= frontier[:, :-1]
+            grown[:, :-1] |= frontier[:, 1:]
+            frontier = grown & free & ~visited
+            visited |= frontier
+
+        padded = np.pad(distance, 1, constant_values=np.inf)
+        walled = np.pad(self.blocked, 1, constant_values=True)
+        width, height = self.shape
+        neighbours = np.stack(
+            [
+                padded[1 + dx : 1 + dx + width, 1 + dy : 1 + dy + height]
+                for dx, dy in OFFSETS
+            ]
+        )
+        # Diagonals only between free cells, they don't cut blocked corners.
+        for index, (dx, dy) in enumerate(OFFSETS):
+            if dx and dy:
+                corner = (
+                    walled[1 + dx : 1 + dx + width, 1 : 1 + height]
+                    | walled[1 : 1 + width, 1 + dy : 1 + dy + height]
+                )
+                neighbours[index][corner] = np.inf
+        closest = neighbours.argmin(axis=0)
+        downhill = neighbours.min(axis=0) < distance
+        direction = np.where(downhill[..., np.newaxis], DIRECTIONS[closest], 0).astype(
+            np.float32
+        )
+        return distance, direction, direction.tolist()
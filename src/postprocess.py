@@ -0,0 +1,336 @@
+import logging
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pygame
+
+from clock import get_game_clock
+from memory import track, ORIGIN_TRANSITION
+
+logger = logging.getLogger(__name__)
+
+EVENT_PAUSE = "pause"
+EVENT_RESUME = "resume"
+EVENT_LEVEL_WON = "level_won"
+EVENT_PLAYER_KILLED = "player_killed"
+
+STAGE_GREYSCALE = "greyscale"
+STAGE_BLUR = "blur"
+STAGE_TINT = "tint"
+STAGE_VIGNETTE = "vignette"
+STAGE_FADE = "fade"
+
+# The amount of a stage goes to amount in seconds, once the keyframe before it
+# is done. Seconds are real, effects play while the game is paused.
+Keyframe = namedtuple("Keyframe", ["amount", "seconds"])
+# A frame to post-process: the chain and the amount of each of its stages,
+# those at 0 are skipped.
+PostFrame = namedtuple("PostFrame", ["chain", "amounts"])
+
+WHITE = (255, 255, 255)
+
+
+def mix(front: pygame.Surface, back: pygame.Surface, amount: float):
+    """
+    Blends amount of back, the stage at full, over front.
+    """
+    back.set_alpha(round(amount * 255))
+    front.blit(back, (0, 0))
+    back.set_alpha(None)
+    return front
+
+
+class Stage(ABC):
+    """
+    A full screen operation. It gets the frame in front and back to work in,
+    both the size of the display, and either changes front or leaves the
+    result in back and returns it. Anything else it needs is allocated once.
+    """
+
+    def allocate(self, size: Tuple[int, int]):
+        pass
+
+    @abstractmethod
+    def apply(
+        self, front: pygame.Surface, back: pygame.Surface, amount: float
+    ) -> pygame.Surface:
+        pass
+
+    def apply_still(
+        self, front: pygame.Surface, back: pygame.Surface, amount: float, same: bool
+    ) -> pygame.Surface:
+        """
+        Applies the stage to a held frame, same tells whether front is what it
+        was the last time, so the stage at full can be kept instead of redone.
+        """
+        return self.apply(front, back, amount)
+
+
+class Greyscale(Stage):
+    # The weights of transformations.greyscale, in 256ths.
+    WEIGHTS = (55, 150, 37)
+
+    def __init__(self):
+        self.luma = None
+        self.channel = None
+        # The held frame at full, the pause ramps up over it.
+        self.still = None
+
+    def allocate(self, size):
+        self.luma = np.empty(size, dtype=np.uint16)
+        self.channel = np.empty(size, dtype=np.uint16)
+        self.still = track(pygame.Surface(size), ORIGIN_TRANSITION)
+
+    def apply(self, front, back, amount):
+        self._greyscale(front, back)
+        return back if amount >= 1 else mix(front, back, amount)
+
+    def apply_still(self, front, back, amount, same):
+        if not same:
+            self._greyscale(front, self.still)
+        if amount < 1:
+            return mix(front, self.still, amount)
+        back.blit(self.still, (0, 0))
+        return back
+
+    def _greyscale(self, source: pygame.Surface, target: pygame.Surface):
+        luma, channel = self.luma, self.channel
+        # Surfaces are locked while their pixels are referenced.
+        pixels = pygame.surfarray.pixels3d(source)
+        np.multiply(pixels[..., 0], self.WEIGHTS[0], out=luma, dtype=np.uint16)
+        for index in (1, 2):
+            np.multiply(
+                pixels[..., index], self.WEIGHTS[index], out=channel, dtype=np.uint16
+            )
+            luma += channel
+        luma >>= 8
+        del pixels
+        pixels = pygame.surfarray.pixels3d(target)
+        pixels[...] = luma[..., None]
+        del pixels
+
+
+class Blur(Stage):
+    def __init__(self, level: int):
+        self.level = level
+        self.small = None
+
+    def allocate(self, size):
+        self.small = track(
+            pygame.Surface([max(side // self.level, 1) for side in size]),
+            ORIGIN_TRANSITION,
+        )
+
+    def apply(self, front, back, amount):
+        pygame.transform.smoothscale(front, self.small.get_size(), self.small)
+        pygame.transform.smoothscale(self.small, back.get_size(), back)
+        return back if amount >= 1 else mix(front, back, amount)
+
+
+class Tint(Stage):
+    def __init__(self, color):
+        self.color = color
+
+    def apply(self, front, back, amount):
+        tint = [round(255 - (255 - channel) * amount) for channel in self.color]
+        front.fill(tint, special_flags=pygame.BLEND_RGB_MULT)
+        return front
+
+
+class Vignette(Stage):
+    def __init__(self, strength: float):
+        self.strength = strength
+        self.mask = None
+
+    def allocate(self, size):
+        width, height = size
+        xs = np.linspace(-1, 1, width, dtype=np.float32)[:, None]
+        ys = np.linspace(-1, 1, height, dtype=np.float32)[None, :]
+        # Darker towards the corners, untouched around the center.
+        edge = np.clip((xs * xs + ys * ys) / 2, 0, 1)
+        light = 255 * (1 - self.strength * edge)
+        self.mask = track(
+            pygame.surfarray.make_surface(
+                np.repeat(light[..., None], 3, axis=2).astype(np.uint8)
+            ),
+            ORIGIN_TRANSITION,
+        )
+
+    def apply(self, front, back, amount):
+        if amount >= 1:
+            front.blit(self.mask, (0, 0), special_flags=pygame.BLEND_RGB_MULT)
+            return front
+        back.fill(WHITE)
+        mix(back, self.mask, amount)
+        front.blit(back, (0, 0), special_flags=pygame.BLEND_RGB_MULT)
+        return front
+
+
+class Fade(Stage):
+    def apply(self, front, back, amount):
+        light = round(255 * (1 - amount))
+        front.fill((light, light, light), special_flags=pygame.BLEND_RGB_MULT)
+        return front
+
+
+def default_stages() -> List[Tuple[str, Stage]]:
+    return [
+        (STAGE_GREYSCALE, Greyscale()),
+        (STAGE_BLUR, Blur(level=8)),
+        (STAGE_TINT, Tint((255, 70, 60))),
+        (STAGE_VIGNETTE, Vignette(strength=0.7)),
+        (STAGE_FADE, Fade()),
+    ]
+
+
+# What every event does to the stages.
+EFFECTS = {
+    EVENT_PAUSE: (
+        (STAGE_GREYSCALE, (Keyframe(1, 0.25),)),
+        (STAGE_VIGNETTE, (Keyframe(1, 0.25),)),
+    ),
+    EVENT_RESUME: (
+        (STAGE_GREYSCALE, (Keyframe(0, 0),)),
+        (STAGE_VIGNETTE, (Keyframe(0, 0),)),
+    ),
+    # Over the second a won level takes to go.
+    EVENT_LEVEL_WON: (
+        (STAGE_BLUR, (Keyframe(1, 1),)),
+        (STAGE_FADE, (Keyframe(0, 0.5), Keyframe(0.8, 0.5))),
+    ),
+    EVENT_PLAYER_KILLED: ((STAGE_TINT, (Keyframe(1, 0), Keyframe(0, 0.6))),),
+}
+
+
+class PostProcess:
+    """
+    Screen effects as a chain of stages, declared once and always run in the
+    same order. A frame is copied into the front of two buffers the size of
+    the display and every stage works on those, swapping them when it leaves
+    its result in the back one. Buffers are allocated once, ahead of the first
+    effect if allocate() is called, and reused after that: nothing is
+    allocated per frame.
+
+    Game events start effects, which move the amounts of the stages through
+    keyframes. Frames that stay still, like the one shown while paused, are
+    held in a third buffer, and once their effects are done they aren't
+    processed again.
+    """
+
+    def __init__(
+        self,
+        size,
+        stages: Sequence[Tuple[str, Stage]] = None,
+        effects: Dict[str, tuple] = EFFECTS,
+    ):
+        self.size = tuple(size)
+        self.stages = stages if stages is not None else default_stages()
+        self.effects = effects
+        self.front = self.back = self.still = None
+        # Stage name to the time its effect started, the amount it started
+        # from and its keyframes.
+        self.tracks = {}
+        self.last_event = None
+        # Drawn over the held frame once processed, as a blit.
+        self.overlay = None
+        # Amounts the held frame in front was processed with.
+        self.done = None
+        # And those it was processed with last, whatever is in front now.
+        self.last_held = None
+
+    def allocate(self):
+        if self.front is not None:
+            return
+        self.front, self.back, self.still = (
+            track(pygame.Surface(self.size), ORIGIN_TRANSITION) for _ in range(3)
+        )
+        for _, stage in self.stages:
+            stage.allocate(self.size)
+
+    def trigger(self, event: str):
+        now = get_game_clock().real_time()
+        self.last_event = event
+        for name, keyframes in self.effects.get(event, ()):
+            self.tracks[name] = (now, self.amount(name, now), keyframes)
+
+    def trigger_once(self, event: str) -> bool:
+        """
+        Triggers an event that goes on for several frames, on the first.
+        """
+        if event == self.last_event:
+            return False
+        self.trigger(event)
+        return True
+
+    def reset(self):
+        self.tracks.clear()
+        self.last_event = None
+
+    def amount(self, name: str, now: float) -> float:
+        timeline = self.tracks.get(name)
+        if timeline is None:
+            return 0
+        started, amount, keyframes = timeline
+        elapsed = now - started
+        for target, seconds in keyframes:
+            if elapsed < seconds:
+                return amount + (target - amount) * elapsed / seconds
+            elapsed -= seconds
+            amount = target
+        return amount
+
+    def frame(self) -> Optional[PostFrame]:
+        now = get_game_clock().real_time()
+        amounts = tuple(self.amount(name, now) for name, _ in self.stages)
+        if not any(amounts):
+            return None
+        return PostFrame(self, amounts)
+
+    def hold(self, surface: pygame.Surface, overlay=None):
+        self.allocate()
+        self.still.blit(surface, (0, 0))
+        self.overlay = overlay
+        self.done = self.last_held = None
+
+    def held(self) -> pygame.Surface:
+        """
+        The held frame with the effects as they are now.
+        """
+        post = self.frame()
+        amounts = post.amounts if post else (0,) * len(self.stages)
+        if self.done == amounts:
+            return self.front
+        result = self.apply(self.still, amounts, held=True)
+        if self.overlay:
+            result.blit(*self.overlay)
+        self.done = amounts
+        return result
+
+    def apply(
+        self, source: pygame.Surface, amounts, held: bool = False
+    ) -> pygame.Surface:
+        self.allocate()
+        self.done = None
+        last, self.last_held = self.last_held, amounts if held else None
+        front, back = self.front, self.back
+        front.blit(source, (0, 0))
+        for index, ((_, stage), amount) in enumerate(zip(self.stages, amounts)):
+            if amount <= 0:
+                continue
+            if held:
+                # What a stage gets is the same if those before it didn't
+                # change, and it kept it if it ran last time too.
+                same = (
+                    last is not None
+                    and last[:index] == amounts[:index]
+                    and last[index] > 0
+                )
+                result = stage.apply_still(front, back, min(amount, 1), same)
+            else:
+                result = stage.apply(front, back, min(amount, 1))
+            if result is back:
+                front, back = back, front
+        self.front, self.back = front, back
+        return front
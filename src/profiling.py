@@ -0,0 +1,267 @@
+import os
+import sys
+import time
+import marshal
+import cProfile
+import pstats
+import logging
+import threading
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+MODE_CPROFILE = "cprofile"
+MODE_SAMPLING = "sampling"
+
+# What gets profiled: the whole Game.play, only one level of it, or the frames
+# between two presses of the profiling hotkey.
+TARGET_PLAY = "play"
+TARGET_LEVEL = "level"
+TARGET_HOTKEY = "hotkey"
+
+# pstats identifies functions by (filename, first line, name).
+Function = Tuple[str, int, str]
+
+
+def describe(function: Function) -> str:
+    filename, line, name = function
+    if filename == "~":
+        # Built-ins, like "<method 'blit' of 'pygame.surface.Surface' objects>".
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+class Sampler:
+    """
+    Statistical profiler: a thread looks at the stack of the profiled thread
+    every interval and counts how often each stack shows up. The profiled code
+    runs untouched, so the overhead doesn't depend on how many calls it makes.
+    """
+
+    def __init__(self, interval=settings.PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.thread_id = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def enable(self):
+        self.thread_id = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampler", daemon=True)
+        self._thread.start()
+
+    def disable(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+
+    def stats(self) -> Dict[Function, tuple]:
+        """
+        Samples turned into the marshalled format pstats reads, with the number
+        of samples a function was on the stack standing in for its calls.
+        """
+        timings = defaultdict(
+            lambda: [0, 0, 0.0, 0.0, defaultdict(lambda: [0, 0, 0.0, 0.0])]
+        )
+        for stack, count in self.stacks.items():
+            seconds = count * self.interval
+            for function in set(stack):
+                timings[function][0] += count
+                timings[function][1] += count
+                timings[function][3] += seconds
+            for caller, callee in set(zip(stack, stack[1:])):
+                edge = timings[callee][4][caller]
+                edge[0] += count
+                edge[1] += count
+                edge[3] += seconds
+                if callee == stack[-1]:
+                    edge[2] += seconds
+            timings[stack[-1]][2] += seconds
+        return {
+            function: (
+                calls,
+                primitive,
+                own,
+                cumulative,
+                {caller: tuple(edge) for caller, edge in callers.items()},
+            )
+            for function, (
+                calls,
+                primitive,
+                own,
+                cumulative,
+                callers,
+            ) in timings.items()
+        }
+
+    def collapsed(self) -> List[str]:
+        return [
+            f"{';'.join(describe(function) for function in stack)} {count}"
+            for stack, count in self.stacks.most_common()
+        ]
+
+
+def hot_path(
+    stats: Dict[Function, tuple], function: Function, depth=64
+) -> List[Function]:
+    """
+    Chain of heaviest callers leading to function, outermost first.
+    """
+    path = [function]
+    while len(path) < depth:
+        callers = stats.get(path[-1], (0, 0, 0, 0, {}))[4]
+        candidates = [caller for caller in callers if caller not in path]
+        if not candidates:
+            break
+        path.append(max(candidates, key=lambda caller: callers[caller][3]))
+    return list(reversed(path))
+
+
+def hot_path_table(stats: Dict[Function, tuple], limit=30) -> str:
+    total = sum(own for _, _, own, _, _ in stats.values()) or 1e-9
+    lines = [
+        f"{'self ms':>10}{'self %':>8}{'cum ms':>10}{'calls':>10}  function  <  callers"
+    ]
+    for function, (_, calls, own, cumulative, _) in sorted(
+        stats.items(), key=lambda item: item[1][2], reverse=True
+    )[:limit]:
+        callers = " < ".join(
+            describe(caller) for caller in reversed(hot_path(stats, function)[-5:-1])
+        )
+        lines.append(
+            f"{own * 1000:>10.1f}{own / total * 100:>7.1f}%{cumulative * 1000:>10.1f}"
+            f"{calls:>10}  {describe(function)}"
+            + (f"  <  {callers}" if callers else "")
+        )
+    return "\n".join(lines)
+
+
+def collapsed_from_stats(stats: Dict[Function, tuple]) -> List[str]:
+    """
+    cProfile only keeps caller edges, not whole stacks, so each function's
+    own time goes to its hot path. Good enough to spot the wide frames of a
+    flamegraph, not an exact one.
+    """
+    lines = []
+    for function, (_, _, own, _, _) in stats.items():
+        microseconds = round(own * 1e6)
+        if microseconds:
+            stack = ";".join(describe(caller) for caller in hot_path(stats, function))
+            lines.append(f"{stack} {microseconds}")
+    return lines
+
+
+class Profiler:
+    def __init__(
+        self,
+        mode=settings.PROFILE_MODE,
+        target=settings.PROFILE_TARGET,
+        level=settings.PROFILE_LEVEL,
+        output=settings.PROFILE_DIR,
+    ):
+        self.mode = mode
+        self.target = target
+        self.level = level
+        self.output = Path(output)
+        self.collector = None
+        self.running = False
+        self.started = 0.0
+        self.profiled_seconds = 0.0
+
+    def start(self):
+        if self.running:
+            return
+        if self.collector is None:
+            self.collector = (
+                cProfile.Profile() if self.mode == MODE_CPROFILE else Sampler()
+            )
+        self.collector.enable()
+        self.running = True
+        self.started = time.perf_counter()
+        logger.info(f"Profiling started ({self.mode}).")
+
+    def stop(self):
+        if not self.running:
+            return
+        self.collector.disable()
+        self.running = False
+        self.profiled_seconds += time.perf_counter() - self.started
+        logger.info("Profiling stopped.")
+
+    def enter_play(self):
+        if self.target == TARGET_PLAY:
+            self.start()
+
+    def frame(self, level_number: int, hotkey: bool):
+        if self.target == TARGET_LEVEL:
+            if level_number == self.level:
+                self.start()
+            else:
+                self.stop()
+        elif self.target == TARGET_HOTKEY and hotkey:
+            if self.running:
+                self.stop()
+            else:
+                self.start()
+
+    def exit_play(self):
+        self.stop()
+        if self.collector is not None:
+            self.save()
+            self.collector = None
+            self.profiled_seconds = 0.0
+
+    def save(self) -> Path:
+        """
+        Writes the session to its own directory, so sessions can be diffed.
+        """
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{self.mode}-{self.target}"
+        if self.target == TARGET_LEVEL:
+            name += f"{self.level}"
+        session = self.output / name
+        session.mkdir(parents=True, exist_ok=True)
+
+        if isinstance(self.collector, Sampler):
+            stats = self.collector.stats()
+            with (session / "profile.pstats").open(mode="wb") as stats_file:
+                marshal.dump(stats, stats_file)
+            collapsed = self.collector.collapsed()
+        else:
+            self.collector.dump_stats(session / "profile.pstats")
+            stats = pstats.Stats(self.collector).stats
+            collapsed = collapsed_from_stats(stats)
+
+        (session / "stacks.folded").write_text("\n".join(collapsed) + "\n")
+        table = hot_path_table(stats)
+        (session / "hot_paths.txt").write_text(
+            f"{self.profiled_seconds:.2f}s profiled with {self.mode}\n{table}\n"
+        )
+        logger.info(f"Profile saved to {session}:\n{table}")
+        return session
+
+
+_current = Profiler() if settings.PROFILE_MODE else None
+
+
+def get_profiler() -> Profiler:
+    return _current
+
+
+def set_profiler(profiler: Profiler) -> Profiler:
+    global _current
+    _current = profiler
+    return profiler
@@ -0,0 +1,281 @@
+import time
+import queue
+import ctypes
+import shutil
+import logging
+import subprocess
+import multiprocessing
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pygame
+
+import settings
+from clock import get_game_clock
+
+logger = logging.getLogger(__name__)
+
+# Run length encoded TGA images are lossless and quick to write, PNG images
+# are smaller and several times slower.
+ENCODER_TGA = "tga"
+ENCODER_PNG = "png"
+ENCODER_VIDEO = "video"
+# Past this many rects changed by dropped frames, the next one is copied whole.
+MAX_MISSED_RECTS = 256
+
+
+def channel_order(surface: pygame.Surface) -> List[int]:
+    """
+    Byte offsets of red, green and blue in the pixels of a 32 bits surface.
+    """
+    return [(mask.bit_length() - 1) // 8 for mask in surface.get_masks()[:3]]
+
+
+def _scroll(canvas: np.ndarray, offset: Tuple[int, int]):
+    # Moves the pixels of the canvas by offset, those left behind stay.
+    x, y = offset
+    height, width = canvas.shape[:2]
+    canvas[max(y, 0) : height + min(y, 0), max(x, 0) : width + min(x, 0)] = canvas[
+        max(-y, 0) : height + min(-y, 0), max(-x, 0) : width + min(-x, 0)
+    ]
+
+
+def _encode(buffers, shape, channels, free, frames, directory: str, encoder: str):
+    # Runs in the worker process. Frames only bring their dirty regions, they
+    # are patched onto a copy of the whole screen kept here, moved first when
+    # the view scrolled.
+    height, width = shape
+    slots = np.frombuffer(buffers, dtype=np.uint8).reshape(-1, height, width, 4)
+    canvas = np.zeros((height, width, 4), dtype=np.uint8)
+    directory = Path(directory)
+    video = None
+    if encoder == ENCODER_VIDEO:
+        video = subprocess.Popen(
+            [
+                "ffmpeg",
+                "-loglevel",
+                "error",
+                "-y",
+                "-f",
+                "rawvideo",
+                "-pix_fmt",
+                "rgb24",
+                "-s",
+                f"{width}x{height}",
+                "-r",
+                str(settings.FRAMERATE),
+                "-i",
+                "-",
+                "-c:v",
+                "ffv1",
+                str(directory / "frames.mkv"),
+            ],
+            stdin=subprocess.PIPE,
+        )
+    with (directory / "timestamps.csv").open(mode="w") as timestamps:
+        timestamps.write("index,frame,game_seconds,wall_seconds\n")
+        index = 0
+        while True:
+            frame = frames.get()
+            if frame is None:
+                break
+            slot, number, game_seconds, wall_seconds, rects, offset = frame
+            if rects is None:
+                canvas[:] = slots[slot]
+            else:
+                if offset is not None:
+                    _scroll(canvas, offset)
+                for x, y, w, h in rects:
+                    canvas[y : y + h, x : x + w] = slots[slot, y : y + h, x : x + w]
+            free.put(slot)
+
+            rgb = np.ascontiguousarray(canvas[:, :, channels])
+            if video is not None:
+                video.stdin.write(rgb.tobytes())
+            else:
+                image = pygame.image.frombuffer(rgb.tobytes(), (width, height), "RGB")
+                pygame.image.save(image, str(directory / f"{index:06d}.{encoder}"))
+            timestamps.write(
+                f"{index},{number},{game_seconds:.4f},{wall_seconds:.6f}\n"
+            )
+            index += 1
+    if video is not None:
+        video.stdin.close()
+        video.wait()
+
+
+class Recorder:
+    """
+    Records what the display shows while playing. After every update of the
+    display the updated regions are copied into one of a ring of buffers
+    shared with a worker process, which encodes them. The game never waits
+    for the worker: when every buffer is taken the frame is dropped, and the
+    timestamps show where. What a dropped frame updated would be missing from
+    the worker's copy of the screen, so the next frame taken brings it too.
+    When the view scrolled, the worker moves its copy and only what isn't the
+    last frame moved is copied, instead of the whole display.
+    """
+
+    def __init__(
+        self,
+        size: Tuple[int, int],
+        slots=settings.RECORD_SLOTS,
+        encoder=settings.RECORD_ENCODER,
+        output=settings.RECORD_DIR,
+    ):
+        self.width, self.height = size
+        self.slot_count = slots
+        self.encoder = encoder
+        if encoder == ENCODER_VIDEO and shutil.which("ffmpeg") is None:
+            logger.warning("ffmpeg isn't installed, recording tga images instead.")
+            self.encoder = ENCODER_TGA
+        self.output = Path(output)
+        # Spawned, a forked worker would inherit SDL's state.
+        self.context = multiprocessing.get_context("spawn")
+        self.buffers = self.context.RawArray(
+            ctypes.c_uint8, slots * self.height * self.width * 4
+        )
+        self.slots = np.frombuffer(self.buffers, dtype=np.uint8).reshape(
+            slots, self.height, self.width, 4
+        )
+        self.free = None
+        self.frames = None
+        self.worker = None
+        self.directory = None
+        self.recorded = 0
+        self.dropped = 0
+        # What the frames dropped since the last one taken changed and how far
+        # they moved the display, None for all of it.
+        self.missed = None
+        self.overhead = 0.0
+        self.worst_overhead = 0.0
+
+    @property
+    def recording(self) -> bool:
+        return self.worker is not None
+
+    def start(self):
+        if self.recording:
+            return
+        surface = pygame.display.get_surface()
+        if surface.get_bytesize() != 4:
+            logger.warning("Only 32 bits displays can be recorded.")
+            return
+        self.directory = self.output / time.strftime("%Y%m%d-%H%M%S")
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.free = self.context.Queue()
+        for slot in range(self.slot_count):
+            self.free.put(slot)
+        self.frames = self.context.Queue()
+        self.worker = self.context.Process(
+            target=_encode,
+            args=(
+                self.buffers,
+                (self.height, self.width),
+                channel_order(surface),
+                self.free,
+                self.frames,
+                str(self.directory),
+                self.encoder,
+            ),
+            name="recorder",
+            daemon=True,
+        )
+        self.worker.start()
+        self.recorded = self.dropped = 0
+        # The worker's copy starts black, the first frame has to be whole.
+        self.missed = (None, (0, 0))
+        self.overhead = self.worst_overhead = 0.0
+        logger.info(f"Recording to {self.directory} ({self.encoder}).")
+
+    def capture(
+        self,
+        rects: Optional[List[pygame.Rect]] = None,
+        offset: Optional[Tuple[int, int]] = None,
+    ):
+        """
+        Takes the regions of the display that were just updated, all of it
+        when rects is None. With an offset, the rest of the display is the
+        last frame moved by it.
+        """
+        if not self.recording:
+            return
+        started = time.perf_counter()
+        rects, offset = self._catch_up(rects, offset)
+        try:
+            slot = self.free.get_nowait()
+        except queue.Empty:
+            self.dropped += 1
+            self.missed = (rects, offset or (0, 0))
+            return
+        self.missed = None
+
+        surface = pygame.display.get_surface()
+        pixels = np.frombuffer(surface.get_buffer(), dtype=np.uint8)
+        pixels = pixels.reshape(self.height, surface.get_pitch())[:, : self.width * 4]
+        pixels = pixels.reshape(self.height, self.width, 4)
+        target = self.slots[slot]
+        if rects is None:
+            np.copyto(target, pixels)
+            regions = None
+        else:
+            regions = []
+            for rect in rects:
+                x, y, w, h = rect
+                target[y : y + h, x : x + w] = pixels[y : y + h, x : x + w]
+                regions.append((x, y, w, h))
+        # Unlocks the display.
+        del pixels
+
+        clock = get_game_clock()
+        self.frames.put((slot, clock.frames, clock.time(), started, regions, offset))
+        self.recorded += 1
+        overhead = time.perf_counter() - started
+        self.overhead += overhead
+        self.worst_overhead = max(self.worst_overhead, overhead)
+
+    def _catch_up(self, rects, offset):
+        # What changed since the last frame taken, with the frames dropped.
+        if self.missed is None:
+            return rects, offset
+        missed_rects, (missed_x, missed_y) = self.missed
+        if rects is None or missed_rects is None:
+            return None, None
+        x, y = offset or (0, 0)
+        screen = pygame.Rect(0, 0, self.width, self.height)
+        moved = [screen.clip(pygame.Rect(rect).move(x, y)) for rect in missed_rects]
+        rects = [rect for rect in moved if rect] + list(rects)
+        if len(rects) > MAX_MISSED_RECTS:
+            return None, None
+        x, y = missed_x + x, missed_y + y
+        return rects, (x, y) if x or y else None
+
+    def stop(self):
+        if not self.recording:
+            return
+        self.frames.put(None)
+        self.worker.join()
+        self.worker = None
+        logger.info(self.report())
+
+    def report(self) -> str:
+        average = self.overhead / self.recorded * 1000 if self.recorded else 0
+        return (
+            f"Recorded {self.recorded} frames to {self.directory}, "
+            f"dropped {self.dropped}. Capturing took {average:.2f} ms per frame, "
+            f"{self.worst_overhead * 1000:.2f} ms at worst."
+        )
+
+
+_current = None
+
+
+def get_recorder() -> Recorder:
+    """
+    Recorder for the display, created the first time recording is asked for.
+    """
+    global _current
+    if _current is None and settings.RECORD_FRAMES:
+        _current = Recorder(pygame.display.get_surface().get_size())
+    return _current
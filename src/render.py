@@ -0,0 +1,556 @@
+import time
+import weakref
+import logging
+import threading
+from collections import namedtuple
+
+import pygame
+
+import constants
+import settings
+from dirty import DirtyRegions
+from camera import Camera
+from latency import get_latency_tracker
+from lighting import LitFrame
+from memory import track, ORIGIN_CACHE, ORIGIN_TRANSITION
+from postprocess import PostFrame
+from sprites.groups import RenderGroup
+from sprites.images import load_sprites, load_sprites_ui, load_player_walking
+
+logger = logging.getLogger(__name__)
+
+BACKEND_SOFTWARE = "software"
+BACKEND_PIPELINED = "pipelined"
+BACKEND_TEXTURE = "texture"
+# SDL_BlendMode values, for the textures of the light map and its glows.
+BLENDMODE_ADD = 2
+BLENDMODE_MOD = 4
+
+# What a sprite hands to the texture backend instead of a pre-transformed image:
+# a region of an uploaded surface, the size it should cover on screen, and the
+# flip, clockwise rotation and color modulation the renderer applies on copy.
+TextureView = namedtuple("TextureView", ["image", "size", "angle", "flip_x", "tint"])
+
+# A frame as the simulation left it, so the sprites can move on while it's
+# being drawn: for every layer the surfaces to blit, their rects on screen and
+# whether they changed since the last frame, plus the rects on screen that
+# changed. When the camera scrolled the whole frame is drawn again instead.
+# Inputs are the key presses the frame shows, for the latency tracker. On dark
+# levels the light multiplies the first lit layers, those above are unlit.
+# Post is the screen effects the whole frame goes through, if any. Scroll is set
+# while recording frames that only scrolled: how far the last frame moved on
+# screen and the rects that aren't the last frame moved, see Recorder.
+DrawList = namedtuple(
+    "DrawList",
+    [
+        "background",
+        "layers",
+        "scrolled",
+        "changed",
+        "inputs",
+        "light",
+        "lit",
+        "post",
+        "scroll",
+    ],
+)
+
+_current = None
+
+
+def textured() -> bool:
+    return isinstance(_current, TextureBackend)
+
+
+def create_backend(screen: pygame.Surface, name: str = settings.RENDER_BACKEND):
+    global _current
+    _current = None
+    if name == BACKEND_TEXTURE:
+        try:
+            _current = TextureBackend(screen)
+        except Exception:
+            logger.exception("Texture backend unavailable, using software rendering.")
+    if _current is None and settings.PIPELINED_RENDERING:
+        _current = PipelinedBackend(screen)
+    if _current is None:
+        _current = SoftwareBackend(screen)
+    logger.info(f"Render backend: {_current.name}")
+    return _current
+
+
+class SoftwareBackend:
+    name = BACKEND_SOFTWARE
+    # Frames drawn and not presented yet, a light map needs as many buffers.
+    frames_in_flight = 1
+
+    def __init__(self, screen: pygame.Surface):
+        self.screen = screen
+        self.dirty = DirtyRegions(screen.get_size())
+        # What each sprite looked like on screen the last frame.
+        self.drawn = {}
+        self.redraw = True
+        self.lit = False
+        self.glowed = set()
+        self.posted = False
+        # Where the view was the last frame, while the screen shows it.
+        self.view = None
+
+    def draw_background(self, background: pygame.Surface):
+        self.screen.blit(background, (0, 0))
+        self.drawn = {}
+        self.view = None
+
+    def draw(
+        self,
+        group: RenderGroup,
+        background,
+        camera: Camera,
+        light: LitFrame = None,
+        post: PostFrame = None,
+    ):
+        # A sprite with the same image, alpha and rect as the last frame is
+        # already on screen. Sprites that draw into their image instead of
+        # replacing it aren't noticed.
+        previous, drawn = self.drawn, {}
+        shown = [look[1] for look in previous.values()]
+        changed = []
+        layers = []
+        unlit = []
+        for layer, sprites in zip(group.order, group.layers()):
+            blits = []
+            for sprite, rect in camera.project(sprites):
+                image = sprite.image
+                look = (image, rect, image.get_alpha())
+                before = previous.pop(sprite, None)
+                moved = before != look
+                if moved:
+                    changed.append(rect)
+                    if before is not None:
+                        changed.append(before[1])
+                drawn[sprite] = look
+                blits.append((self._handed(image), rect, moved))
+            if light and layer in constants.UNLIT_LAYERS:
+                unlit.append(blits)
+            else:
+                layers.append(blits)
+        lit = len(layers)
+        layers.extend(unlit)
+        # Sprites that are gone or out of the view.
+        changed.extend(look[1] for look in previous.values())
+        self.drawn = drawn
+        # Where the light changed, and glows that came, went or moved.
+        glowed = set()
+        if light:
+            changed.extend(light.changed)
+            glowed = {tuple(rect) for _, rect in light.glows}
+            changed.extend(pygame.Rect(rect) for rect in glowed ^ self.glowed)
+        self.glowed = glowed
+        # Effects change all of the frame, and the frame after they're gone
+        # too. So does the light coming or going.
+        scrolled = (
+            camera.moved
+            or self.redraw
+            or post is not None
+            or self.posted
+            or (light is not None) != self.lit
+        )
+        scroll = None
+        if self.dirty.recorder is not None:
+            scroll = self._scroll(camera, shown, drawn, light, post)
+        self.view = camera.view.topleft
+        self.redraw = False
+        self.lit = light is not None
+        self.posted = post is not None
+        tracker = get_latency_tracker()
+        inputs = tracker.drawn() if tracker else None
+        return DrawList(
+            background, layers, scrolled, changed, inputs, light, lit, post, scroll
+        )
+
+    def _scroll(self, camera: Camera, shown, drawn, light, post):
+        # Without light or effects, a frame where only the view moved is the
+        # last one moved the other way, but for the sprites and the sides the
+        # view moved to.
+        if self.view is None or self.redraw or light or self.lit:
+            return None
+        if post or self.posted:
+            return None
+        width, height = self.screen.get_size()
+        x, y = self.view[0] - camera.view.x, self.view[1] - camera.view.y
+        if not (x or y) or abs(x) >= width or abs(y) >= height:
+            return None
+        rects = [rect.move(x, y) for rect in shown]
+        rects.extend(look[1] for look in drawn.values())
+        if x:
+            rects.append(pygame.Rect(0 if x > 0 else width + x, 0, abs(x), height))
+        if y:
+            rects.append(pygame.Rect(0, 0 if y > 0 else height + y, width, abs(y)))
+        return (x, y), rects
+
+    def _handed(self, image: pygame.Surface) -> pygame.Surface:
+        # The surface a DrawList keeps for image.
+        return image
+
+    def present(self, draw_list: DrawList = None):
+        if draw_list is None:
+            self.dirty.present()
+            return
+        started = time.perf_counter()
+        regions = self._compose(draw_list)
+        self._show(regions, draw_list, time.perf_counter() - started)
+
+    def _compose(self, draw_list: DrawList):
+        """
+        Draws the frame on the screen surface, and returns the regions of it
+        that changed, None when all of it did.
+        """
+        background = draw_list.background
+        regions = None
+        if not draw_list.scrolled:
+            regions = self.dirty.coalesce(draw_list.changed)
+        if regions is None:
+            self.screen.blit(background, (0, 0))
+            lit = draw_list.lit
+            for layer in draw_list.layers[:lit]:
+                self._blits([(image, rect) for image, rect, _ in layer])
+            if draw_list.light:
+                self._light(draw_list.light)
+            for layer in draw_list.layers[lit:]:
+                self._blits([(image, rect) for image, rect, _ in layer])
+            if draw_list.post:
+                post = draw_list.post
+                self._blits([(post.chain.apply(self.screen, post.amounts), (0, 0))])
+            return None
+
+        # The background is restored over the regions, which don't overlap,
+        # and whatever is drawn over them is drawn again, but only inside them.
+        # Sprites that didn't change elsewhere are left alone, and so is the
+        # light.
+        self.screen.blits(
+            [(background, region, region) for region in regions], doreturn=False
+        )
+        lit = draw_list.lit
+        for layer in draw_list.layers[:lit]:
+            self._blits(self._clipped(layer, regions))
+        if draw_list.light:
+            self._light(draw_list.light, regions)
+        for layer in draw_list.layers[lit:]:
+            self._blits(self._clipped(layer, regions))
+        return regions
+
+    @staticmethod
+    def _clipped(layer, regions, special_flags=0):
+        blits = []
+        for image, rect, moved in layer:
+            if moved:
+                blits.append((image, rect, None, special_flags))
+                continue
+            for index in rect.collidelistall(regions):
+                clip = rect.clip(regions[index])
+                blits.append((image, clip, clip.move(-rect.x, -rect.y), special_flags))
+        return blits
+
+    def _show(self, regions, draw_list: DrawList, drawn: float):
+        self.dirty.update(
+            regions,
+            partial=not draw_list.scrolled,
+            drawn=drawn,
+            scroll=draw_list.scroll,
+        )
+        self._presented(draw_list.inputs)
+
+    def _light(self, light: LitFrame, regions=None):
+        if regions is None:
+            self._blits([(light.image, (0, 0), None, pygame.BLEND_MULT)])
+            self._blits(
+                [(image, rect, None, pygame.BLEND_ADD) for image, rect in light.glows]
+            )
+            return
+        self._blits(
+            [(light.image, region, region, pygame.BLEND_MULT) for region in regions]
+        )
+        # Glows that moved are inside the regions already.
+        glows = [(image, pygame.Rect(rect), False) for image, rect in light.glows]
+        self._blits(self._clipped(glows, regions, pygame.BLEND_ADD))
+
+    def _presented(self, inputs):
+        if inputs:
+            get_latency_tracker().presented(inputs)
+
+    def _blits(self, blits):
+        self.screen.blits(blits, doreturn=False)
+
+    def present_surface(self, surface: pygame.Surface):
+        self.screen.blit(surface, (0, 0))
+        self.redraw = True
+        self.view = None
+        self.dirty.present()
+
+    def capture(self) -> pygame.Surface:
+        return pygame.display.get_surface()
+
+    def sync(self):
+        pass
+
+
+class PipelinedBackend(SoftwareBackend):
+    """
+    Software rendering split in two stages: the game loop turns the sprites
+    into a DrawList and a worker thread blits it on the screen surface while
+    the next frame is simulated. pygame releases the GIL while blitting, so
+    both stages overlap on multi-core machines. The display is updated on
+    the main thread, as SDL wants video calls there, when the next frame is
+    handed over: what's on screen is one frame behind the simulation.
+
+    The worker never reads a surface the game loop may lock or change at the
+    same time. Sprite images are handed over as copies, made once per image:
+    sprites replace their image when it changes instead of drawing into it,
+    and the alpha is checked (see ScoreBoard). Backgrounds and light maps
+    are double buffered, and the screen effects only run on the worker.
+
+    Anything that touches the display directly waits for the worker first.
+    Errors on the worker are raised on the main thread.
+    """
+
+    name = BACKEND_PIPELINED
+    frames_in_flight = 2
+
+    def __init__(self, screen: pygame.Surface):
+        super().__init__(screen)
+        self.condition = threading.Condition()
+        self.pending = None
+        # The frame the worker drew last, the regions of it to update and how
+        # long it took, or what it raised.
+        self.composed = None
+        self.error = None
+        self.copies = weakref.WeakKeyDictionary()
+        self.worker = threading.Thread(
+            target=self._compose_loop, name="present", daemon=True
+        )
+        self.worker.start()
+
+    def _compose_loop(self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                draw_list = self.pending
+
+            composed = error = None
+            try:
+                started = time.perf_counter()
+                regions = self._compose(draw_list)
+                composed = (regions, draw_list, time.perf_counter() - started)
+            except Exception as exception:
+                # Never leave the game loop waiting on a frame that won't come.
+                error = exception
+            with self.condition:
+                self.composed, self.error = composed, error
+                self.pending = None
+                self.condition.notify_all()
+
+    def _handed(self, image: pygame.Surface) -> pygame.Surface:
+        alpha = image.get_alpha()
+        copy = self.copies.get(image)
+        if copy is None or copy.get_alpha() != alpha:
+            copy = self.copies[image] = track(image.copy(), ORIGIN_CACHE)
+        return copy
+
+    def draw(self, group, background, camera, light: LitFrame = None, post=None):
+        if light is not None:
+            light = light._replace(
+                glows=[(self._handed(image), rect) for image, rect in light.glows]
+            )
+        return super().draw(group, background, camera, light=light, post=post)
+
+    def sync(self):
+        """
+        Waits for the worker, and shows what it drew.
+        """
+        with self.condition:
+            while self.pending is not None:
+                self.condition.wait()
+            composed, self.composed = self.composed, None
+            error, self.error = self.error, None
+        if error is not None:
+            raise error
+        if composed is not None:
+            self._show(*composed)
+
+    def draw_background(self, background: pygame.Surface):
+        self.sync()
+        super().draw_background(background)
+
+    def present(self, draw_list: DrawList = None):
+        # Double buffered: show the previous frame once it's drawn, then hand
+        # over this one and go back to simulating.
+        self.sync()
+        if draw_list is None:
+            self.dirty.present()
+            return
+        with self.condition:
+            self.pending = draw_list
+            self.condition.notify_all()
+
+    def present_surface(self, surface: pygame.Surface):
+        self.sync()
+        super().present_surface(surface)
+
+    def capture(self) -> pygame.Surface:
+        self.sync()
+        return super().capture()
+
+
+class TextureBackend:
+    name = BACKEND_TEXTURE
+    # The whole frame is drawn and presented every time.
+    dirty = None
+    frames_in_flight = 1
+
+    def __init__(self, screen: pygame.Surface):
+        from pygame._sdl2.video import Window, Renderer, Texture
+
+        self.texture_class = Texture
+        self.screen = screen
+        # The SCALED display mode already owns a renderer, sharing it lets the
+        # menus keep presenting through pygame.display.flip().
+        self.renderer = Renderer.from_window(Window.from_display_module())
+        self.frame = Texture(self.renderer, screen.get_size(), target=True)
+        self.textures = weakref.WeakKeyDictionary()
+        # The light map as uploaded, its changes are uploaded every frame.
+        self.light = None
+        self.light_image = None
+        # Screen effects of the frame drawn last, they go through the CPU.
+        self.post = None
+        self.post_source = None
+        self.post_texture = None
+        # Key presses the frame drawn last shows.
+        self.inputs = None
+        for atlas in (load_sprites(), load_sprites_ui(), load_player_walking()):
+            self.texture(atlas)
+
+    def texture(self, surface: pygame.Surface):
+        """
+        Texture holding the pixels of surface, and where they are inside it.
+        Subsurfaces share the texture of their top level parent.
+        """
+        parent = surface.get_abs_parent()
+        texture = self.textures.get(parent)
+        if texture is None:
+            texture = self.texture_class.from_surface(self.renderer, parent)
+            self.textures[parent] = texture
+        return texture, pygame.Rect(surface.get_abs_offset(), surface.get_size())
+
+    def draw_background(self, background: pygame.Surface):
+        pass
+
+    def draw_sprite(self, sprite: pygame.sprite.Sprite, rect: pygame.Rect):
+        view = sprite.texture_view() if hasattr(sprite, "texture_view") else None
+        if view is None:
+            texture, source = self.texture(sprite.image)
+            alpha = sprite.image.get_alpha()
+            texture.alpha = 255 if alpha is None else alpha
+            texture.color = (255, 255, 255)
+            texture.draw(srcrect=source, dstrect=rect)
+            return
+
+        texture, source = self.texture(view.image)
+        destination = pygame.Rect((0, 0), view.size)
+        destination.center = rect.center
+        texture.alpha = 255
+        texture.color = view.tint or (255, 255, 255)
+        texture.draw(
+            srcrect=source, dstrect=destination, angle=view.angle, flip_x=view.flip_x
+        )
+
+    def draw(
+        self,
+        group: RenderGroup,
+        background,
+        camera: Camera,
+        light: LitFrame = None,
+        post: PostFrame = None,
+    ):
+        self.renderer.target = self.frame
+        texture = self.texture(background)[0]
+        if camera.moved:
+            # Scrolling draws the background surface again.
+            texture.update(background)
+        texture.draw()
+        if light is None:
+            for sprite, rect in camera.project(group):
+                self.draw_sprite(sprite, rect)
+        else:
+            unlit = []
+            for layer, sprites in zip(group.order, group.layers()):
+                if layer in constants.UNLIT_LAYERS:
+                    unlit.append(sprites)
+                    continue
+                for sprite, rect in camera.project(sprites):
+                    self.draw_sprite(sprite, rect)
+            self.draw_light(light)
+            for sprites in unlit:
+                for sprite, rect in camera.project(sprites):
+                    self.draw_sprite(sprite, rect)
+        self.renderer.target = None
+        self.post = post
+        tracker = get_latency_tracker()
+        self.inputs = tracker.drawn() if tracker else None
+
+    def draw_light(self, light: LitFrame):
+        image = light.image
+        if self.light_image is not image:
+            self.light = self.texture_class(
+                self.renderer, image.get_size(), streaming=True
+            )
+            self.light.blend_mode = BLENDMODE_MOD
+            self.light.update(image)
+            self.light_image = image
+        else:
+            for rect in light.updated:
+                if rect:
+                    self.light.update(image.subsurface(rect), rect)
+        self.light.draw()
+        for image, rect in light.glows:
+            texture, source = self.texture(image)
+            texture.blend_mode = BLENDMODE_ADD
+            texture.draw(srcrect=source, dstrect=rect)
+
+    def present(self, dirty=None):
+        self.renderer.clear()
+        post, self.post = self.post, None
+        if post:
+            self._post(post)
+        else:
+            self.frame.draw()
+        self.renderer.present()
+        if self.inputs:
+            get_latency_tracker().presented(self.inputs)
+            self.inputs = None
+
+    def _post(self, post: PostFrame):
+        # Read back, processed and uploaded again, slow but effects are short.
+        if self.post_texture is None:
+            size = self.frame.get_rect().size
+            self.post_source = track(pygame.Surface(size), ORIGIN_TRANSITION)
+            self.post_texture = self.texture_class(self.renderer, size, streaming=True)
+        self.renderer.target = self.frame
+        self.renderer.to_surface(self.post_source)
+        self.renderer.target = None
+        self.post_texture.update(post.chain.apply(self.post_source, post.amounts))
+        self.post_texture.draw()
+
+    def present_surface(self, surface: pygame.Surface):
+        self.renderer.target = self.frame
+        self.texture(surface)[0].draw()
+        self.renderer.target = None
+        self.present()
+
+    def capture(self) -> pygame.Surface:
+        self.renderer.target = self.frame
+        surface = self.renderer.to_surface()
+        self.renderer.target = None
+        return surface
+
+    def sync(self):
+        pass
@@ -1,6 +1,8 @@
-from time import time
+import random
+import asyncio
 from pathlib import Path
-from random import choice
+from typing import List, Optional, Tuple
+from random import choice, randint
 from logging import getLogger
 from collections import defaultdict
 
@@ -18,11 +20,53 @@ from sprites.models import (
 from sprites.ui import (
     PauseBanner,
     PlayerKilledBanner,
+    MainMenu,
     Banner,
+    EntityCounter,
 )
+from sprites.groups import RenderGroup
 from sprites.images import load_sprites
-from transformations import greyscale, blur, redscale
-from levels import load_levels
+from levels import load_levels, load_horde
+from capacity import CapacityTracker
+from pathfinding import FlowField
+from crowd import Crowd
+from lighting import LightMap, LitFrame
+from postprocess import (
+    PostProcess,
+    EVENT_LEVEL_WON,
+    EVENT_PAUSE,
+    EVENT_PLAYER_KILLED,
+    EVENT_RESUME,
+)
+from arena import Arena
+from camera import Camera, set_camera
+from memory import MemoryMonitor, track, ORIGIN_CACHE
+from render import create_backend
+from music import get_music_manager
+from collisions import spritecollide, sweep_collide
+from clock import get_game_clock
+from profiling import get_profiler
+from garbage import get_garbage_policy
+from latency import get_latency_tracker
+from recorder import get_recorder
+from scheduler import get_scheduler, PRIORITY_BACKGROUND
+from sounds import load_sound, play
+from stage import Stage
+from controls import (
+    FrameInput,
+    allow_events,
+    ACTION_ATTACK,
+    ACTION_BACK,
+    ACTION_MEMORY_REPORT,
+    ACTION_MOVE,
+    ACTION_PAUSE,
+    ACTION_PROFILE,
+    ACTION_QUICK_LOAD,
+    ACTION_QUICK_SAVE,
+    ACTION_RESTART,
+)
+import state
+from state import GameState
 import constants
 import settings
 
@@ -31,23 +75,32 @@ logger = getLogger(__name__)
 
 
 class Scene:
-    def play(self):
+    async def play(self, stage: Stage, *args, **kwargs):
+        pass
+
+    def resume(self):
+        """
+        Shows the scene again after the one pushed on top of it ended.
+        """
         pass
 
 
 class Game(Scene):
-    def __init__(self, screen, display_size, main_clock):
+    def __init__(self, screen, display_size):
         self.screen = screen
         self.display_size = display_size
-        self.main_clock = main_clock
+        self.clock = get_game_clock()
         self.run = True
+        self.backend = create_backend(screen)
         # Pause settings
         self.paused = False
-        self.last_paused = time()
-        self.paused_surface = None
+        self.last_paused = self.clock.real_time()
         self.paused_banner = PauseBanner(self.screen)
+        self.paused_banner_blit = None
         # Restart settings
-        self.last_restarted = time()
+        self.last_restarted = self.clock.real_time()
+        self.first_level = None
+        self.level_start = None
         # Killed State
         self.player_killed_banner = PlayerKilledBanner(self.screen)
         # Won State
@@ -58,16 +111,21 @@ class Game(Scene):
         )
         # Images
         self.sprites_image = load_sprites()
-        self.background = self._create_background()
+        # World, as big as the arena of the level. The camera shows part of it.
+        self.camera = set_camera(Camera(self.screen.get_size()))
+        self.arena = None
+        # Arenas are made of chunks this size, co-op games use the host's.
+        self.arena_chunk = self.screen.get_size()
+        self.background = None
+        self.obstacles = []
+        self.flow_field = None
+        self.crowd = Crowd()
         # Sounds
         self.bottle_picked = pygame.mixer.Sound(constants.SFX_BOTTLE_PICKED)
         self.bottle_picked.set_volume(settings.SFX_VOLUME)
         self.player_killed_sound = pygame.mixer.Sound(constants.SFX_PLAYER_KILLED)
         self.player_killed_sound.set_volume(settings.SFX_VOLUME)
-        self.background_sound = pygame.mixer.Sound(constants.BACKGROUND_SOUND)
-        self.background_sound.set_volume(settings.VOLUME)
-        self.ending_sound = pygame.mixer.Sound(constants.ENDING_SOUND)
-        self.ending_sound.set_volume(settings.VOLUME)
+        self.music = get_music_manager()
         self.player_won_sound = pygame.mixer.Sound(constants.SFX_PLAYER_WIN)
         self.player_won_sound.set_volume(settings.SFX_VOLUME)
         self.interlude_win_sound = pygame.mixer.Sound(constants.SFX_INTERLUDE_WIN)
@@ -77,208 +135,454 @@ class Game(Scene):
         self.potions_sprites = pygame.sprite.RenderUpdates()
         self.mobs_sprites = pygame.sprite.RenderUpdates()
         self.player_sprites = pygame.sprite.RenderUpdates()
-        self.all_sprites = pygame.sprite.LayeredUpdates()
+        self.all_sprites = RenderGroup()
+        # Player and weapon live through restarts and levels.
+        self.player = None
+        self.weapon = None
+        # Instrumentation
+        self.memory_monitor = MemoryMonitor()
+        self.capacity = None
+        # Stress tests keep the player alive to see how far the horde grows.
+        self.invulnerable = False
+        self.profiler = None
+        self.latency = None
+        # Darkness of dark levels, made on the first.
+        self.light_map = None
+        # Work that can be spread over frames.
+        self.scheduler = get_scheduler()
+        self.garbage = get_garbage_policy()
+        # Screen effects, started by what happens in the game.
+        self.post = PostProcess(screen.get_size())
 
     def _draw_background(self):
-        self.screen.blit(self.background, (0, 0, *self.display_size))
-
-    def _create_background(self) -> pygame.Surface:
-        floor_surface = pygame.transform.scale(
-            self.sprites_image.subsurface(pygame.rect.Rect(constants.FLOOR_BACKGROUND)),
-            (self.screen.get_rect().width, self.screen.get_rect().height),
-        )
-        steps = constants.SCALE_FACTOR
-        walls = []
-        original_wall_up_height = (
-            self.sprites_image.subsurface(constants.WALL_BACKGROUND).get_rect().height
-        )
-        new_wall_up_height = self.screen.get_rect().height // constants.SCALE_FACTOR
-        original_wall_down_height = (
-            self.sprites_image.subsurface(constants.WALL_FRONT_BACKGROUND)
-            .get_rect()
-            .height
-        )
-        new_wall_down_height = (
-            original_wall_down_height * new_wall_up_height
-        ) // original_wall_up_height
-        for i in range(steps):
-            wall_surface_up = pygame.transform.scale(
-                self.sprites_image.subsurface(constants.WALL_BACKGROUND),
-                (self.screen.get_rect().width // steps, new_wall_up_height),
-            )
-            rect = wall_surface_up.get_rect()
-            rect.x += i * rect.width
-            walls.append((wall_surface_up, rect))
-
-            wall_surface_down = pygame.transform.scale(
-                self.sprites_image.subsurface(constants.WALL_FRONT_BACKGROUND),
-                (self.screen.get_rect().width // steps, new_wall_down_height),
-            )
-            rect = wall_surface_up.get_rect()
-            rect.x += i * rect.width
-            rect.y = self.screen.get_rect().height - new_wall_down_height
-            walls.append((wall_surface_down, rect))
-
-        floor_surface.blits(walls)
-
-        # Draw columns
-        column_surface = self.sprites_image.subsurface(constants.BACKGROUND_COLUMN)
-        column_surface = pygame.transform.scale(
-            column_surface,
-            [x * constants.SCALE_FACTOR for x in column_surface.get_size()],
-        )
-        floor_surface.blits(
-            (
-                (column_surface, (0, 0)),
-                (
-                    column_surface,
-                    (
-                        self.screen.get_rect().centerx
-                        - column_surface.get_rect().centerx,
-                        0,
-                    ),
-                ),
-                (
-                    column_surface,
-                    (self.screen.get_rect().right - column_surface.get_width(), 0),
-                ),
+        self.backend.draw_background(self.background)
+
+    def _enter_arena(self):
+        screens = self.current_level.arena_screens
+        if (
+            self.arena is not None
+            and self.arena.screens == screens
+            and self.arena.chunk_size == self.arena_chunk
+        ):
+            return
+        self.arena = Arena(self.sprites_image, self.arena_chunk, screens)
+        self.obstacles = self.arena.obstacles
+        self.camera.resize_world(self.arena.size)
+        self.flow_field = FlowField(self.arena.size)
+        for obstacle in self.obstacles:
+            self.flow_field.block(obstacle)
+
+    def _follow_player(self):
+        if self.camera.follow(self.player.center_position):
+            self.background = self.arena.view(self.camera.view)
+
+    def _light_map(self) -> LightMap:
+        if self.light_map is None:
+            self.light_map = LightMap(
+                self.screen.get_size(), buffers=self.backend.frames_in_flight
             )
+        return self.light_map
+
+    def _light(self) -> Optional[LitFrame]:
+        lighting = self.current_level.lighting
+        if lighting is None:
+            return None
+        return self._light_map().render(
+            lighting, self.camera, self.player, self.potions_sprites, self.mobs_sprites
         )
 
-        return floor_surface
-
     def _update_display(self):
-        self.all_sprites.clear(self.screen, self.background)
-        self.all_sprites.update(player_position=self.player.center_position)
-        sprites_dirty = self.all_sprites.draw(self.screen)
-        pygame.display.update(sprites_dirty)
+        self.flow_field.update(self.player.center_position)
+        self.crowd.update(self.mobs_sprites)
+        self.all_sprites.update(
+            player_position=self.player.center_position, flow_field=self.flow_field
+        )
+        self._follow_player()
+        draw_list = self.backend.draw(
+            self.all_sprites,
+            self.background,
+            self.camera,
+            light=self._light(),
+            post=self.post.frame(),
+        )
+        self.backend.present(draw_list)
 
     def _spawn_score(self):
-        self.current_level.score.value = 0
+        self.current_level.score.reset()
         self.all_sprites.add(
             self.current_level.score,
         )
 
+    def _start_position(self) -> Tuple[int, int]:
+        # Bottom left, in whichever arena the level is played.
+        return 70, self.arena.rect.height - 70
+
     def _spawn_player(self):
-        player = Player(
-            self.screen, initial_position=(70, self.screen.get_rect().height - 70)
-        )
+        player = Player(self.screen, initial_position=self._start_position())
         self.player_sprites.add(player)
         self.all_sprites.add(player)
         return player
 
-    def _spawn_potion(self):
+    def _spawn_potion(self, color=None):
         potion = Item(
-            self.screen, self.sprites_image, self.current_level.random_potion()
+            self.screen,
+            self.sprites_image,
+            color or self.current_level.random_potion(),
         )
         self.potions_sprites.add(potion)
         self.all_sprites.add(potion)
         return potion
 
-    def _spawn_enemy(self, initial_position=None, enemy=None):
+    def _spawn_enemy(self, initial_position=None, skin=None):
         enemy = Enemy(
             self.screen,
             particles_group=self.all_sprites,
-            skin=self.current_level.random_enemy(),
+            skin=skin or self.current_level.random_enemy(),
             facing=constants.FACING_WEST,  # TODO: this doesn't looks quite right.
-            initial_position=initial_position or (self.screen.get_width(), 60),
+            initial_position=initial_position or (self.arena.rect.width, 60),
         )
         self.mobs_sprites.add(enemy)
         self.all_sprites.add(enemy)
         return enemy
 
+    def _collide(self, player: Player, weapon: Weapon, mobs: List[Enemy]):
+        """
+        Collisions of an alchemist and its sword with mobs, the ones that are
+        out of reach shouldn't be in mobs, and potions. Only sprites change
+        here, the sounds stay quiet on replayed frames (see netplay.py).
+        """
+        if spritecollide(player, mobs) and not self.invulnerable:
+            self._kill_player(player)
+        elif weapon.alive() and weapon.brandishing != Weapon.STATIC:
+            enemy: Enemy
+            for enemy in sweep_collide(weapon.swing, mobs):
+                enemy.hurt(player.center_position)
+
+        bottles_picked = spritecollide(player, self.potions_sprites)
+        if not bottles_picked:
+            return
+        play(self.bottle_picked)
+        self.current_level.score.increase()
+        if not self.current_level.score.won():
+            self._spawn_potion()
+        bottle: Item
+        for bottle in bottles_picked:
+            if bottle.color == Item.RED:
+                for _ in range(self.current_level.red_potion_spawns()):
+                    self._spawn_enemy(
+                        initial_position=(
+                            player.center_position + player.velocity * -70
+                        )
+                    )
+            elif bottle.color == Item.BLUE:
+                self.all_sprites.add(weapon)
+            bottle.kill()
+        if self.current_level.score.won():
+            enemy: Enemy
+            for enemy in self.mobs_sprites:
+                enemy.die(player.center_position)
+
+    def _kill_player(self, player: Player):
+        player.kill()
+        self.all_sprites.add(self.player_killed_banner)
+        self.player_killed_sound.play()
+        self.music.play(constants.ENDING_SOUND, crossfade_ms=0)
+        self.post.trigger(EVENT_PLAYER_KILLED)
+        enemy: Enemy
+        for enemy in self.mobs_sprites:
+            enemy.velocity.update(0, 0)
+            enemy.acceleration.update(0.01, 0.01)
+
+    def _random_edge(self):
+        width, height = self.arena.size
+        return choice(
+            (
+                (randint(0, width), 70),
+                (randint(0, width), height - 20),
+                (0, randint(70, height - 20)),
+                (width, randint(70, height - 20)),
+            )
+        )
+
     def _spawn_weapon(self, owner: Player):
         # Weapons
         weapon = Weapon(self.screen, self.sprites_image, owner)
         return weapon
 
     def _pause(self):
-        if time() - self.last_paused > 0.5:
+        if self.clock.real_time() - self.last_paused > 0.5:
             self.paused = not self.paused
-            self.last_paused = time()
+            self.clock.paused = self.paused
+            self.last_paused = self.clock.real_time()
             if self.paused:
                 self.player_killed_banner.kill()
                 self._update_display()
-                self.paused_surface = greyscale(pygame.display.get_surface())
-                self.paused_surface.blit(*self.paused_banner.render())
+                if self.paused_banner_blit is None:
+                    self.paused_banner_blit = self.paused_banner.render()
+                self.post.trigger(EVENT_PAUSE)
+                self.post.hold(self.backend.capture(), overlay=self.paused_banner_blit)
                 pygame.mixer.pause()
+                self.music.pause()
+                self.garbage.collect()
             else:
                 if not self.player.alive():
                     self.all_sprites.add(self.player_killed_banner)
+                self.post.trigger(EVENT_RESUME)
                 self._draw_background()
                 self._update_display()
-                pygame.display.flip()
+                self.backend.present()
                 pygame.mixer.unpause()
+                self.music.unpause()
 
     def _restart(self):
-        if time() - self.last_restarted > 0.5:
+        if self.clock.real_time() - self.last_restarted > 0.5:
             self._stop(instantly=True)
-            self._start()
-        self.last_restarted = time()
+            self._restore(self.level_start)
+            self._resume()
+            if settings.MEMORY_TRACKING:
+                self.memory_monitor.checkpoint("restart")
+        self.last_restarted = self.clock.real_time()
+
+    def _snapshot(self) -> GameState:
+        return GameState(
+            self.current_level.endless,
+            self.current_level.number,
+            self.current_level.score.value,
+            self.player.state() if self.player.alive() else None,
+            self.weapon.state(),
+            [enemy.state() for enemy in self.mobs_sprites],
+            [potion.state() for potion in self.potions_sprites],
+            random.getstate(),
+        )
 
-    def _start(self):
+    def _restore(self, snapshot: GameState) -> bool:
+        level = self.first_level
+        while level is not None and level.number != snapshot.level:
+            level = level.next_level
+        if level is None or level.endless != snapshot.endless:
+            logger.warning(f"Level {snapshot.level} can't be restored in this game.")
+            return False
+        self.current_level = level
+        self._enter_arena()
+
+        # Sprites are taken back from the groups instead of created again.
+        spare_enemies = defaultdict(list)
+        for enemy in self.mobs_sprites:
+            spare_enemies[enemy.skin].append(enemy)
+        spare_potions = defaultdict(list)
+        for potion in self.potions_sprites:
+            spare_potions[potion.color].append(potion)
+        self._clear_sprites()
+
+        self.current_level.score.reset(snapshot.score)
+        self.all_sprites.add(self.current_level.score)
+        if snapshot.player is not None:
+            self.player.restore(snapshot.player)
+            self.player_sprites.add(self.player)
+            self.all_sprites.add(self.player)
+        self.weapon.restore(snapshot.weapon)
+        if snapshot.weapon.alive:
+            self.all_sprites.add(self.weapon)
+        for enemy_state in snapshot.enemies:
+            spares = spare_enemies[enemy_state.skin]
+            if spares:
+                enemy = spares.pop()
+                self.mobs_sprites.add(enemy)
+                self.all_sprites.add(enemy)
+            else:
+                enemy = self._spawn_enemy(skin=enemy_state.skin)
+            enemy.restore(enemy_state)
+        for potion_state in snapshot.potions:
+            spares = spare_potions[potion_state.color]
+            if spares:
+                potion = spares.pop()
+                self.potions_sprites.add(potion)
+                self.all_sprites.add(potion)
+            else:
+                potion = self._spawn_potion(color=potion_state.color)
+            potion.restore(potion_state)
+        # Last, spawning above draws random numbers.
+        state.restore_random_state(snapshot.random_state)
+        return True
+
+    def _clear_sprites(self):
         self.player_sprites.empty()
         self.mobs_sprites.empty()
         self.potions_sprites.empty()
         self.all_sprites.empty()
+
+    def _start(self):
+        self._clear_sprites()
+        self._enter_arena()
         self._spawn_potion()
         self._spawn_enemy()
         self._spawn_score()
-        self.player = self._spawn_player()
-        self.weapon = self._spawn_weapon(owner=self.player)
-
+        if self.player is None:
+            self.player = self._spawn_player()
+            self.weapon = self._spawn_weapon(owner=self.player)
+            self.player_start = self.player.state()
+            self.weapon_start = self.weapon.state()
+        else:
+            # The campaign and the horde don't start in the same arena.
+            self.player.restore(
+                self.player_start._replace(position=self._start_position())
+            )
+            self.weapon.restore(self.weapon_start)
+            self.player_sprites.add(self.player)
+            self.all_sprites.add(self.player)
+        # Restarting goes back here.
+        self.level_start = self._snapshot()
+        # Its first lit frame would take ten times the rest.
+        if self.current_level.lighting:
+            self._light_map().prepare(self.current_level.lighting)
+        self._resume()
+
+    def _resume(self):
+        # Particles and banners still pending belong to what was left behind.
+        self.scheduler.clear()
+        # The level is loaded and its banner is coming, nobody minds a pause.
+        self.garbage.freeze()
+        self.post.reset()
         self.run = True
-        self.paused = False
+        self.paused = self.clock.paused = False
+        self._follow_player()
         self._draw_background()
-        pygame.display.flip()
-        self.background_sound.play(loops=-1)
+        self.backend.present()
+        self.music.play(constants.BACKGROUND_SOUND)
+        self.current_level.start()
         self.current_level.put_banner(self.all_sprites)
+        self.scheduler.add(self._warm_up(), PRIORITY_BACKGROUND)
+        if self.capacity:
+            self.all_sprites.add(
+                EntityCounter(
+                    self.screen,
+                    self.all_sprites,
+                    self.mobs_sprites,
+                    self.capacity,
+                    dirty=self.backend.dirty,
+                )
+            )
+
+    def _warm_up(self):
+        # Banners that show up all of a sudden are rendered ahead of time.
+        for banner in (self.player_killed_banner, self.player_won_banner):
+            if not banner.rendered:
+                yield from banner.render_steps()
+        # And so are the buffers of the effects, a kill has one right away.
+        yield
+        self.post.allocate()
 
     def _stop(self, instantly=False):
         self.run = False
+        self.backend.sync()
         fadeout = (
             self.current_level.score.transition_seconds * 1000 if not instantly else 0
         )
-        self.background_sound.fadeout(fadeout)
-        self.ending_sound.fadeout(fadeout)
-
-    def play(self):
+        self.music.fadeout(fadeout)
+        if self.capacity:
+            logger.info(f"Horde capacity:\n{self.capacity.report()}")
+        if self.backend.dirty:
+            logger.info(self.backend.dirty.report())
+        logger.info(self.garbage.report())
+        if self.latency:
+            logger.info(self.latency.report())
+
+    async def preload(self):
+        # Runs in the menu's spare time, so the first level has it all ready.
+        for path in (
+            constants.SFX_WALL_HIT,
+            constants.SFX_FOOTSTEPS,
+            constants.SFX_ENEMY_KILLED,
+            constants.SFX_SWORD_BRANDISHING,
+        ):
+            load_sound(path)
+            await asyncio.sleep(0)
+        await Stage.steps(self._warm_up())
+
+    async def _autosave(self):
+        while True:
+            await asyncio.sleep(settings.AUTOSAVE_SECONDS)
+            # Between frames, so the snapshot never sees half an update.
+            if self.run and not self.paused:
+                state.save(self._snapshot(), settings.AUTOSAVE_PATH)
+
+    async def play(self, stage: Stage, endless=False):
+        # Sprites find the world through the camera of the game being played.
+        set_camera(self.camera)
+        self.profiler = get_profiler()
+        if self.profiler:
+            self.profiler.enter_play()
+        self.latency = get_latency_tracker()
+        self.garbage.enter_play()
+        autosave = stage.spawn(self._autosave()) if settings.AUTOSAVE_SECONDS else None
+        # Frames are recorded as the dirty regions present them.
+        recorder = get_recorder() if self.backend.dirty else None
+        if recorder:
+            self.backend.dirty.recorder = recorder
+            recorder.start()
+        try:
+            return await self._play(endless)
+        finally:
+            if autosave:
+                autosave.cancel()
+            if recorder:
+                self.backend.sync()
+                recorder.stop()
+            if self.profiler:
+                self.profiler.exit_play()
+            self.garbage.exit_play()
+            self.post.reset()
+
+    async def _play(self, endless):
         # Level Configuration
-        self.current_level = load_levels(self.screen)
-        KEYS = defaultdict(
-            lambda: "Other Key",
-            {
-                pygame.K_UP: "UP",
-                pygame.K_DOWN: "DOWN",
-                pygame.K_LEFT: "LEFT",
-                pygame.K_RIGHT: "RIGHT",
-            },
-        )
+        if endless:
+            self.current_level = load_horde(self.screen)
+            self.capacity = CapacityTracker()
+        else:
+            self.current_level = load_levels(self.screen)
+            self.capacity = None
+        self.first_level = self.current_level
+        controls = FrameInput()
+        allow_events(pygame.QUIT, pygame.KEYDOWN)
 
         self._start()
 
         while self.run:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self._stop()
-                    return True
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_ESCAPE:
-                        self._stop()
-                    elif event.key == pygame.K_r:
-                        self._restart()
-                    elif event.key in (pygame.K_p, pygame.K_PAUSE):
-                        self._pause()
-                    elif not self.paused:
-                        logger.debug(f"Key pressed {KEYS[event.key]}")
-                        self.player.on_key_pressed(event.key, pygame.key.get_pressed())
-                        self.weapon.on_key_pressed(event.key, pygame.key.get_pressed())
-                elif event.type == pygame.KEYUP:
-                    self.player.on_key_released(event.key, pygame.key.get_pressed())
-                    logger.debug(f"Key released {KEYS[event.key]}")
+            controls.sample()
+            if controls.quit:
+                self._stop()
+                return True
+            if controls.active(ACTION_BACK):
+                self._stop()
+            elif controls.active(ACTION_RESTART):
+                self._restart()
+            elif controls.active(ACTION_PAUSE):
+                self._pause()
+            if controls.active(ACTION_MEMORY_REPORT):
+                self.memory_monitor.dump()
+            if self.profiler:
+                self.profiler.frame(
+                    self.current_level.number, controls.active(ACTION_PROFILE)
+                )
+            if not self.paused:
+                if controls.active(ACTION_QUICK_SAVE):
+                    state.save(self._snapshot())
+                elif controls.active(ACTION_QUICK_LOAD):
+                    snapshot = state.load()
+                    if snapshot is not None and self._restore(snapshot):
+                        self._resume()
+                steered = self.player.steer(controls.move)
+                attacked = controls.active(ACTION_ATTACK) and self.weapon.attack()
+                if self.latency:
+                    if steered:
+                        self.latency.applied(ACTION_MOVE)
+                    if attacked:
+                        self.latency.applied(ACTION_ATTACK)
 
             # I want this collision to always be computed.
-            if pygame.sprite.collide_rect(self.player, self.current_level.score):
+            # The score stays on screen, the player moves in the world.
+            player_on_screen = self.camera.to_screen(self.player.rect)
+            if player_on_screen.colliderect(self.current_level.score.rect):
                 self.current_level.score.hide()
             else:
                 self.current_level.score.show()
@@ -287,11 +591,10 @@ class Game(Scene):
                 logger.debug(f"Level {self.current_level.title} won.")
                 if self.current_level.score.quit_transition():
                     logger.debug(f"Quit transition.")
-                    self.screen.blit(
-                        blur(pygame.display.get_surface(), 1.1),
-                        (0, 0, *self.display_size),
-                    )
-                    pygame.display.flip()
+                    self.garbage.collect_once("transition")
+                    if self.post.trigger_once(EVENT_LEVEL_WON):
+                        self.post.hold(self.backend.capture())
+                    self.backend.present_surface(self.post.held())
                 else:
                     logger.debug(f"Update on WON")
                     self._update_display()
@@ -299,7 +602,7 @@ class Game(Scene):
                 if not self.current_level.next_level:
                     if self.current_level.announce_win():
                         # Things that needs to be done only once.
-                        self.background_sound.fadeout(2000)
+                        self.music.fadeout(2000)
                         self.player_won_sound.play(0, 0, 500)
                         self.all_sprites.add(self.player_won_banner)
                     elif self.current_level.score.is_time_to_leave():
@@ -308,94 +611,55 @@ class Game(Scene):
                 elif self.current_level.score.is_time_to_leave():
                     logger.debug(f"is time to leave (Next level is coming)")
                     self.current_level = self.current_level.next_level
-                    self._restart()
+                    self._stop(instantly=True)
+                    self._start()
                 elif self.current_level.announce_win():
                     # Things that needs to be done only once.
-                    self.background_sound.fadeout(2000)
+                    self.music.fadeout(2000)
                     self.interlude_win_sound.play()
 
             elif self.paused:
-                self.screen.blit(self.paused_surface, (0, 0, *self.display_size))
-                pygame.display.update()
+                self.backend.present_surface(self.post.held())
             else:
-                # COLLISIONS ++++++++
                 if self.player.alive():
-                    player_mobs_collide = pygame.sprite.spritecollide(
-                        self.player, self.mobs_sprites, dokill=False
-                    )
-                    if player_mobs_collide:
-                        self.player.kill()
-                        self.all_sprites.add(self.player_killed_banner)
-                        self.player_killed_sound.play()
-                        self.background_sound.stop()
-                        self.ending_sound.play(loops=-1)
-                        enemy: Enemy
-                        for enemy in self.mobs_sprites:
-                            enemy.velocity.update(0, 0)
-                            enemy.acceleration.update(0.01, 0.01)
-                    elif (
-                        self.weapon.alive() and self.weapon.brandishing != Weapon.STATIC
-                    ):
-                        weapon_mobs_collide = pygame.sprite.spritecollide(
-                            self.weapon, self.mobs_sprites, dokill=False
-                        )
-                        enemy: Enemy
-                        for enemy in weapon_mobs_collide:
-                            particles = enemy.hurt(self.player.center_position)
-                            if particles:
-                                self.all_sprites.add(particles)
-                        # self.weapon.kill()
-
-                    bottles_picked = pygame.sprite.spritecollide(
-                        self.player,
-                        self.potions_sprites,
-                        dokill=False,
-                        collided=pygame.sprite.collide_rect_ratio(0.7),
+                    # Mobs off the view can't touch the player nor the sword.
+                    self._collide(
+                        self.player, self.weapon, self.camera.cull(self.mobs_sprites)
                     )
-
-                    if bottles_picked:
-                        self.bottle_picked.play()
-                        self.current_level.score.increase()
-                        if not self.current_level.score.won():
-                            self._spawn_potion()
-                        bottle: Item
-                        for bottle in bottles_picked:
-                            if bottle.color == Item.RED:
-                                self._spawn_enemy(
-                                    initial_position=(
-                                        self.player.center_position
-                                        + self.player.velocity * -70
-                                    )
-                                )
-                            elif bottle.color == Item.BLUE:
-                                self.all_sprites.add(self.weapon)
-                            bottle.kill()
-                        if self.current_level.score.won():
-                            enemy: Enemy
-                            for enemy in self.mobs_sprites:
-                                enemy.die(self.player.center_position)
-                    # +++++++++++++++++++
+                for _ in range(self.current_level.due_wave()):
+                    self._spawn_enemy(initial_position=self._random_edge())
                 self._update_display()
-            self.main_clock.tick(60)
+                if self.capacity:
+                    self.capacity.record(
+                        self.clock.work_time,
+                        len(self.all_sprites),
+                        self.all_sprites.count(constants.LAYER_PARTICLE),
+                        self.clock.time(),
+                    )
+            if not self.paused:
+                self.scheduler.run()
+            self.music.update()
+            self.garbage.use_slack(self.clock.slack())
+            await self.clock.next_frame()
 
 
 class TextScene(Scene):
-    def __init__(self, screen, display_size, main_clock, background, path):
+    def __init__(self, screen, display_size, background, path):
         self.screen = screen
         self.display_size = display_size
-        self.main_clock = main_clock
         self.fnt = pygame.freetype.Font(constants.FONT_PATH_MAIN, 20)
         self.fnt.pad = True
         self.credits_text = Path(path)
         self.background = background
+        self.page = None
 
     def align(self, line_rect, last_y):
         line_rect.y += last_y
         line_rect.centerx = self.screen.get_width() / 2
         return line_rect
 
-    def play(self):
-        self.screen.blit(self.background, (0, 0, *self.display_size))
+    def render(self) -> pygame.Surface:
+        page = self.background.copy()
         last_y = 50
         with self.credits_text.open(mode="r") as credits_file:
             lines = credits_file.readlines()
@@ -406,18 +670,27 @@ class TextScene(Scene):
                 )
                 line_rect = self.align(line_surface.get_rect(), last_y)
                 last_y += line_rect.height
-                self.screen.blit(line_surface, line_rect)
+                page.blit(line_surface, line_rect)
+        return track(page, ORIGIN_CACHE)
+
+    def resume(self):
+        allow_events(pygame.QUIT, pygame.KEYDOWN)
+        # The text doesn't change, it's rendered the first time only.
+        if self.page is None:
+            self.page = self.render()
+        self.screen.blit(self.page, (0, 0))
         pygame.display.flip()
 
-        run = True
-        while run:
+    async def play(self, stage: Stage):
+        self.resume()
+        while True:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     return True
                 elif event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_ESCAPE:
-                        run = False
-            self.main_clock.tick(10)
+                        return False
+            await stage.frame(10)
 
 
 class CreditsScene(TextScene):
@@ -433,3 +706,61 @@ class ControlsScene(TextScene):
         line_rect.y += last_y
         line_rect.x = self.screen.get_width() / 4
         return line_rect
+
+
+class MenuScene(Scene):
+    def __init__(
+        self, screen, background, game, coop_game, credits_scene, controls_scene
+    ):
+        self.screen = screen
+        self.background = background
+        self.game = game
+        self.coop_game = coop_game
+        self.credits_scene = credits_scene
+        self.controls_scene = controls_scene
+        self.music = get_music_manager()
+        self.main_menu = MainMenu(screen)
+        self.sprites = pygame.sprite.RenderUpdates(self.main_menu)
+
+    def resume(self):
+        allow_events(pygame.QUIT, pygame.KEYDOWN)
+        self.screen.blit(self.background, (0, 0, *self.screen.get_size()))
+        pygame.display.flip()
+        current = self.music.current
+        if current is None or current.path != Path(constants.MAIN_MENU_SOUND):
+            self.music.play(constants.MAIN_MENU_SOUND)
+
+    async def play(self, stage: Stage):
+        self.resume()
+        stage.spawn(self.game.preload())
+        scenes = {
+            MainMenu.options.START: (self.game, {}),
+            MainMenu.options.ENDLESS: (self.game, {"endless": True}),
+            MainMenu.options.COOP: (self.coop_game, {}),
+            MainMenu.options.CREDITS: (self.credits_scene, {}),
+            MainMenu.options.CONTROLS: (self.controls_scene, {}),
+        }
+        while True:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    return True
+                if event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_q:
+                        return True
+                    elif event.key == pygame.K_RETURN:
+                        option = self.main_menu.selected_option
+                        if option == MainMenu.options.QUIT:
+                            return True
+                        scene, kwargs = scenes[option]
+                        if await stage.push(scene, **kwargs):
+                            return True
+                    elif event.key in settings.KEY_UP:
+                        self.main_menu.prev_option()
+                    elif event.key in settings.KEY_DOWN:
+                        self.main_menu.next_option()
+
+            self.sprites.clear(self.screen, self.background)
+            self.sprites.update()
+            pygame.display.update(self.sprites.draw(self.screen))
+            self.music.update()
+            await stage.frame(15)
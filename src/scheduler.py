@@ -0,0 +1,90 @@
+import time
+import heapq
+import inspect
+from itertools import count
+from typing import Callable, Iterable
+
+import settings
+from clock import get_game_clock
+
+PRIORITY_URGENT = 0
+PRIORITY_EFFECTS = 1
+PRIORITY_BACKGROUND = 2
+
+
+def _call(function: Callable):
+    # Callables are tasks of a single step.
+    function()
+    yield
+
+
+def in_batches(items: Iterable, size: int, action: Callable):
+    """
+    Task calling action with size items at a time, e.g. group.add.
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            action(*batch)
+            batch = []
+            yield
+    if batch:
+        action(*batch)
+
+
+class Scheduler:
+    """
+    Cooperative tasks that run in what's left of a per-frame budget. A task is
+    a generator, every step between two yields runs without interruption, or
+    a callable that runs in one go. Lower priorities run first, and a task
+    whose deadline (game seconds from when it was added) passed is finished
+    right away, budget or not.
+    """
+
+    def __init__(self, budget_ms=settings.TASK_BUDGET_MS):
+        self.budget = budget_ms / 1000
+        self.tasks = []
+        self._order = count()
+        self.last_run = 0.0
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def add(self, task, priority=PRIORITY_EFFECTS, within: float = None):
+        if not inspect.isgenerator(task):
+            task = _call(task)
+        deadline = float("inf") if within is None else get_game_clock().time() + within
+        heapq.heappush(self.tasks, (priority, deadline, next(self._order), task))
+
+    def clear(self):
+        self.tasks.clear()
+
+    def run(self):
+        started = time.perf_counter()
+        now = get_game_clock().time()
+        overdue = [entry for entry in self.tasks if entry[1] <= now]
+        if overdue:
+            for *_, task in overdue:
+                for _ in task:
+                    pass
+            finished = {order for _, _, order, _ in overdue}
+            self.tasks = [entry for entry in self.tasks if entry[2] not in finished]
+            heapq.heapify(self.tasks)
+
+        while self.tasks and time.perf_counter() - started < self.budget:
+            entry = self.tasks[0]
+            try:
+                next(entry[3])
+            except StopIteration:
+                # The task may have added others that now go before it.
+                self.tasks.remove(entry)
+                heapq.heapify(self.tasks)
+        self.last_run = time.perf_counter() - started
+
+
+_current = Scheduler()
+
+
+def get_scheduler() -> Scheduler:
+    return _current
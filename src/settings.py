@@ -8,6 +8,7 @@ LOG_LEVEL = os.getenv("LOG_LEVEL", default="WARNING")
 GENERAL_VOLUME = 1
 VOLUME = 1 * GENERAL_VOLUME
 SFX_VOLUME = 0.3 * GENERAL_VOLUME
+MUSIC_CROSSFADE_MS = 1000
 
 # NOTE: at some point I should be able to remove the SCALED flag, according to this
 #       github thread: https://github.com/pygame/pygame/issues/735
@@ -16,7 +17,124 @@ DISPLAY_MODE_WIND = RESIZABLE | SCALED
 
 AUDIO_EXTENSION = ".ogg" if os.name == "posix" else ".wav"
 
-KEY_UP = pg.K_UP
-KEY_DOWN = pg.K_DOWN
-KEY_LEFT = pg.K_LEFT
-KEY_RIGHT = pg.K_RIGHT
+# Key bindings, every action can be bound to several keys.
+KEY_UP = (pg.K_UP, pg.K_w)
+KEY_DOWN = (pg.K_DOWN, pg.K_s)
+KEY_LEFT = (pg.K_LEFT, pg.K_a)
+KEY_RIGHT = (pg.K_RIGHT, pg.K_d)
+KEY_ATTACK = (pg.K_SPACE,)
+KEY_PAUSE = (pg.K_p, pg.K_PAUSE)
+KEY_RESTART = (pg.K_r,)
+KEY_BACK = (pg.K_ESCAPE,)
+KEY_MEMORY_REPORT = (pg.K_F2,)
+KEY_QUICK_SAVE = (pg.K_F5,)
+KEY_QUICK_LOAD = (pg.K_F9,)
+KEY_PROFILE = (pg.K_F3,)
+
+QUICK_SAVE_PATH = os.getenv("QUICK_SAVE_PATH", default="./quicksave.json")
+# Seconds between saves of the game being played, 0 turns autosaving off.
+AUTOSAVE_SECONDS = float(os.getenv("AUTOSAVE_SECONDS", default="0"))
+AUTOSAVE_PATH = os.getenv("AUTOSAVE_PATH", default="./autosave.json")
+
+# Framed UI boxes are cached per size, rounded up to the bucket, within a budget.
+UI_FRAME_BUCKET = 16
+UI_FRAME_CACHE_BYTES = 1024 * 1024
+
+# Memory accounting: compare live surfaces between restarts and warn on growth.
+MEMORY_TRACKING = os.getenv("MEMORY_TRACKING", default="0") == "1"
+MEMORY_GROWTH_TOLERANCE = int(os.getenv("MEMORY_GROWTH_TOLERANCE", default="0"))
+
+# "software" blits onto the display surface, "texture" draws through the SDL
+# renderer (set SDL_RENDER_DRIVER=software to force it on machines without GPU).
+RENDER_BACKEND = os.getenv("RENDER_BACKEND", default="software")
+
+FRAMERATE = 60
+# Game speed multiplier, 0.5 is slow motion and 2 runs twice as fast.
+GAME_SPEED = float(os.getenv("GAME_SPEED", default="1"))
+
+# Endless horde mode
+HORDE_WAVE_SECONDS = 5
+HORDE_WAVE_GROWTH = 2
+# Screens wide and high, the camera follows the player around.
+HORDE_ARENA_SCREENS = (2, 2)
+CAPACITY_FPS_THRESHOLDS = (60, 30, 15)
+
+# Draw and present the previous frame on a worker thread while the next one is
+# simulated. Software backend only, adds one frame of latency.
+PIPELINED_RENDERING = os.getenv("PIPELINED_RENDERING", default="0") == "1"
+
+# Milliseconds per frame for work spread across frames (particles, loading).
+TASK_BUDGET_MS = 2
+
+# Dirty rects are merged on a grid of tiles this size, at most DIRTY_MAX_RECTS
+# are sent to the display. Above DIRTY_FULL_THRESHOLD of the screen the whole
+# display is flipped, until updates have been timed and a threshold measured.
+DIRTY_TILE_SIZE = 32
+DIRTY_MAX_RECTS = 32
+DIRTY_FULL_THRESHOLD = 0.5
+
+# Dark levels compute their lights on a grid of cells this many pixels wide,
+# scaled up to the screen (see lighting.py).
+LIGHT_MAP_CELL = 8
+
+# Background chunks of large arenas kept rendered, each is a screen big.
+ARENA_CACHED_CHUNKS = 9
+
+# Side in pixels of the cells enemies use to find their way around obstacles,
+# and how many fields, one per set of cells the players were in, are kept.
+FLOW_FIELD_CELL_SIZE = 32
+FLOW_FIELD_CACHED = 16
+
+# Enemies closer than this push away from and pull towards each other.
+CROWD_RADIUS = 96
+CROWD_MAX_FORCE = 0.2
+
+# Co-op over the network. Without NETPLAY_PEER ("host:port") the other
+# alchemist is played by the computer. Player 0 hosts. Local inputs are
+# delayed NETPLAY_INPUT_DELAY frames and the game goes back at most
+# NETPLAY_MAX_ROLLBACK frames to fix a wrong guess of the other's, simulating
+# them again for NETPLAY_REPLAY_MS a frame at most. Latency, jitter and loss
+# are added on purpose, to test.
+NETPLAY_PEER = os.getenv("NETPLAY_PEER", default="")
+NETPLAY_PORT = int(os.getenv("NETPLAY_PORT", default="7777"))
+NETPLAY_PLAYER = int(os.getenv("NETPLAY_PLAYER", default="0"))
+NETPLAY_INPUT_DELAY = int(os.getenv("NETPLAY_INPUT_DELAY", default="2"))
+NETPLAY_MAX_ROLLBACK = int(os.getenv("NETPLAY_MAX_ROLLBACK", default="8"))
+NETPLAY_REPLAY_MS = float(os.getenv("NETPLAY_REPLAY_MS", default="8"))
+NETPLAY_LATENCY_MS = float(os.getenv("NETPLAY_LATENCY_MS", default="0"))
+NETPLAY_JITTER_MS = float(os.getenv("NETPLAY_JITTER_MS", default="0"))
+NETPLAY_LOSS = float(os.getenv("NETPLAY_LOSS", default="0"))
+NETPLAY_TIMEOUT_SECONDS = 5
+NETPLAY_DIGEST_FRAMES = 60
+
+# Garbage collection while playing (see garbage.py): automatic collections
+# wait for GC_PLAY_THRESHOLD new objects, 0 turns them off, and young objects
+# are collected when there are GC_YOUNG_LIMIT and a frame has time to spare.
+# GC_MANAGED=0 leaves CPython's defaults, the pauses are timed either way.
+GC_MANAGED = os.getenv("GC_MANAGED", default="1") == "1"
+GC_PLAY_THRESHOLD = int(os.getenv("GC_PLAY_THRESHOLD", default="50000"))
+GC_YOUNG_LIMIT = 2000
+
+# Input latency, from key presses to the display showing them (see latency.py),
+# reported per action when the game stops. Presses that nothing shows within
+# LATENCY_IGNORE_FRAMES frames are counted apart.
+LATENCY_TRACKING = os.getenv("LATENCY_TRACKING", default="0") == "1"
+LATENCY_IGNORE_FRAMES = 30
+
+# Profiling, off unless PROFILE_MODE is "cprofile" or "sampling". PROFILE_TARGET
+# is "play", "level" (only PROFILE_LEVEL) or "hotkey" (KEY_PROFILE starts and
+# stops it). Every session is saved in its own directory under PROFILE_DIR.
+PROFILE_MODE = os.getenv("PROFILE_MODE")
+PROFILE_TARGET = os.getenv("PROFILE_TARGET", default="play")
+PROFILE_LEVEL = int(os.getenv("PROFILE_LEVEL", default="1"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", default="./profiles")
+PROFILE_SAMPLE_INTERVAL = 0.002
+
+# Gameplay recording, off unless RECORD_FRAMES is "1". Presented frames go
+# through RECORD_SLOTS shared buffers to a worker process that saves them under
+# RECORD_DIR as "tga" or "png" images or, with ffmpeg installed, a lossless
+# "video".
+RECORD_FRAMES = os.getenv("RECORD_FRAMES", default="0") == "1"
+RECORD_ENCODER = os.getenv("RECORD_ENCODER", default="tga")
+RECORD_DIR = os.getenv("RECORD_DIR", default="./recordings")
+RECORD_SLOTS = 8
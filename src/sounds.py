@@ -0,0 +1,28 @@
+from functools import lru_cache
+
+import pygame
+
+import settings
+from clock import get_game_clock
+
+
+@lru_cache()
+def load_sound(path: str, volume=settings.SFX_VOLUME) -> pygame.mixer.Sound:
+    """
+    Sounds are shared by every sprite that plays them, each play() still gets
+    its own channel.
+    """
+    sound = pygame.mixer.Sound(path)
+    sound.set_volume(volume)
+    return sound
+
+
+def play(sound: pygame.mixer.Sound, *args):
+    # Frames replayed after a rollback were already heard.
+    if not get_game_clock().replaying:
+        sound.play(*args)
+
+
+def stop(sound: pygame.mixer.Sound):
+    if not get_game_clock().replaying:
+        sound.stop()
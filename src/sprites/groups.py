@@ -0,0 +1,96 @@
+from itertools import chain
+from typing import Dict, Iterable, List
+
+from pygame.sprite import AbstractGroup, Sprite
+
+
+class RenderGroup(AbstractGroup):
+    """
+    Sprites drawn in layers, like LayeredUpdates, without its cost per sprite.
+    Every layer is a bucket that keeps its sprites in the order they were
+    added, so adding and removing one takes the same time whether the group
+    holds ten sprites or ten thousand. Sprites go to the layer in their layer
+    attribute, to default_layer when they don't have one.
+    """
+
+    def __init__(self, *sprites, default_layer=0):
+        super().__init__()
+        self.default_layer = default_layer
+        # Sprites of each layer, the values are unused.
+        self.buckets: Dict[int, Dict[Sprite, None]] = {}
+        # Layers from the bottom to the top.
+        self.order: List[int] = []
+        self.add(*sprites)
+
+    def _bucket(self, layer: int) -> Dict[Sprite, None]:
+        bucket = self.buckets.get(layer)
+        if bucket is None:
+            bucket = self.buckets[layer] = {}
+            self.order = sorted(self.buckets)
+        return bucket
+
+    def add_internal(self, sprite: Sprite, layer: int = None):
+        if layer is None:
+            layer = getattr(sprite, "_layer", self.default_layer)
+        # Here spritedict tells the layer of each sprite.
+        self.spritedict[sprite] = layer
+        self._bucket(layer)[sprite] = None
+
+    def remove_internal(self, sprite: Sprite):
+        layer = self.spritedict.pop(sprite)
+        del self.buckets[layer][sprite]
+
+    def add(self, *sprites):
+        """
+        Adds sprites, groups or iterables of sprites. Sprites that are already
+        in the group stay where they were.
+        """
+        spritedict = self.spritedict
+        for sprite in sprites:
+            if not isinstance(sprite, Sprite):
+                # Lists of particles are added in bulk.
+                self.add(*sprite)
+            elif sprite not in spritedict:
+                self.add_internal(sprite)
+                sprite.add_internal(self)
+
+    def sprites(self) -> List[Sprite]:
+        buckets = self.buckets
+        return list(chain.from_iterable(buckets[layer] for layer in self.order))
+
+    def layers(self) -> List[Iterable[Sprite]]:
+        """
+        Sprites of every layer, from the bottom to the top. Nothing may be added
+        or removed while going through them.
+        """
+        return [self.buckets[layer].keys() for layer in self.order]
+
+    def get_sprites_from_layer(self, layer: int) -> List[Sprite]:
+        return list(self.buckets.get(layer, ()))
+
+    def count(self, layer: int) -> int:
+        return len(self.buckets.get(layer, ()))
+
+    def remove_sprites_of_layer(self, layer: int) -> List[Sprite]:
+        """
+        Takes a whole layer out of the group at once.
+        """
+        bucket = self.buckets.pop(layer, {})
+        self.order = sorted(self.buckets)
+        spritedict = self.spritedict
+        for sprite in bucket:
+            del spritedict[sprite]
+            sprite.remove_internal(self)
+        return list(bucket)
+
+    def empty(self):
+        buckets, self.buckets, self.order = self.buckets, {}, []
+        self.spritedict = {}
+        for sprite in chain.from_iterable(buckets.values()):
+            sprite.remove_internal(self)
+
+    def __len__(self) -> int:
+        return len(self.spritedict)
+
+    def __bool__(self) -> bool:
+        return bool(self.spritedict)
@@ -1,4 +1,5 @@
 from pathlib import Path
+from collections import OrderedDict
 from functools import lru_cache
 from typing import Tuple
 
@@ -6,214 +7,166 @@ import pygame
 from pygame.math import Vector2
 
 import constants
+import settings
+from memory import track, surface_bytes, ORIGIN_CACHE
 
 
 @lru_cache(maxsize=1)
 def load_player_walking():
-    return pygame.image.load(Path(constants.SPRITES_PLAYER_WALKING)).convert_alpha()
+    return track(
+        pygame.image.load(Path(constants.SPRITES_PLAYER_WALKING)).convert_alpha(),
+        ORIGIN_CACHE,
+    )
 
 
 @lru_cache(maxsize=1)
 def load_sprites():
-    return pygame.image.load(Path(constants.SPRITES_PATH)).convert_alpha()
+    return track(
+        pygame.image.load(Path(constants.SPRITES_PATH)).convert_alpha(), ORIGIN_CACHE
+    )
 
 
 @lru_cache(maxsize=1)
 def load_sprites_ui():
-    return pygame.image.load(Path(constants.SPRITES_UI_PATH)).convert_alpha()
-
-
-def ui_corner_scale(
-    surface: pygame.Surface, scale_factor: int
-) -> Tuple[pygame.Surface, pygame.Rect]:
-    surface = pygame.transform.scale(
-        surface, [scale_factor * x for x in surface.get_size()]
-    )
-    return surface, surface.get_rect()
-
-
-@lru_cache()
-def ui_corner_top_left(scale_factor: int):
-    return ui_corner_scale(
-        load_sprites_ui().subsurface(constants.UI_BOX_CORNER_TOP_LEFT), scale_factor
-    )
-
-
-@lru_cache()
-def ui_corner_bottom_left(scale_factor):
-    return ui_corner_scale(
-        load_sprites_ui().subsurface(constants.UI_BOX_CORNER_BOTTOM_LEFT), scale_factor
-    )
-
-
-@lru_cache()
-def ui_corner_top_right(scale_factor):
-    return ui_corner_scale(
-        load_sprites_ui().subsurface(constants.UI_BOX_CORNER_TOP_RIGHT), scale_factor
+    return track(
+        pygame.image.load(Path(constants.SPRITES_UI_PATH)).convert_alpha(),
+        ORIGIN_CACHE,
     )
 
 
-@lru_cache()
-def ui_corner_bottom_right(scale_factor):
-    return ui_corner_scale(
-        load_sprites_ui().subsurface(constants.UI_BOX_CORNER_BOTTOM_RIGHT), scale_factor
-    )
-
-
-def ui_horizontal_bar_scale(surface, width, scale_factor):
-    surface = pygame.transform.scale(
-        surface, (width, surface.get_height() * scale_factor)
-    )
-    return surface, surface.get_rect()
-
-
-@lru_cache()
-def ui_bar_top(width, scale_factor):
-    return ui_horizontal_bar_scale(
-        load_sprites_ui().subsurface(constants.UI_BOX_TOP_HORIZONTAL_BAR),
-        width,
-        scale_factor,
-    )
-
-
-@lru_cache()
-def ui_bar_bottom(width, scale_factor):
-    return ui_horizontal_bar_scale(
-        load_sprites_ui().subsurface(constants.UI_BOX_BOTTOM_HORIZONTAL_BAR),
-        width,
-        scale_factor,
-    )
-
+class NineSlice:
+    """
+    Decorative box made of the UI_BOX_* atlas regions: corners are scaled once,
+    bars are stretched to the size of the box. Finished frames are cached per
+    size bucket, so drawing a box of a size seen before is a single blit.
+    """
 
-def ui_vertical_bar_scale(surface, height, scale_factor):
-    surface = pygame.transform.scale(
-        surface,
-        (
-            surface.get_width() * scale_factor,
-            height,
-        ),
-    )
-    return surface, surface.get_rect()
+    def __init__(
+        self,
+        scale_factor: int = constants.UI_SCALE_FACTOR,
+        padding: int = 10,
+        bucket: int = settings.UI_FRAME_BUCKET,
+        budget: int = settings.UI_FRAME_CACHE_BYTES,
+    ):
+        atlas = load_sprites_ui()
+        self.scale_factor = scale_factor
+        self.padding = padding
+        self.bucket = bucket
+        self.budget = budget
+        self.corners = [
+            track(self._scale(atlas.subsurface(region)), ORIGIN_CACHE)
+            for region in (
+                constants.UI_BOX_CORNER_TOP_LEFT,
+                constants.UI_BOX_CORNER_TOP_RIGHT,
+                constants.UI_BOX_CORNER_BOTTOM_LEFT,
+                constants.UI_BOX_CORNER_BOTTOM_RIGHT,
+            )
+        ]
+        self.bar_top = atlas.subsurface(constants.UI_BOX_TOP_HORIZONTAL_BAR)
+        self.bar_bottom = atlas.subsurface(constants.UI_BOX_BOTTOM_HORIZONTAL_BAR)
+        self.bar_left = atlas.subsurface(constants.UI_BOX_VERTICAL_BAR_LEFT)
+        self.bar_right = atlas.subsurface(constants.UI_BOX_VERTICAL_BAR_RIGHT)
+        self.frames = OrderedDict()
+        self.cached_bytes = 0
+
+    def _scale(self, surface, width=None, height=None):
+        # Sides not given are scaled by the scale factor.
+        return pygame.transform.scale(
+            surface,
+            (
+                width or surface.get_width() * self.scale_factor,
+                height or surface.get_height() * self.scale_factor,
+            ),
+        )
 
+    def size(self, content_size: Tuple[int, int]) -> Tuple[int, int]:
+        """
+        Size of the frame around content_size, rounded up to the bucket.
+        """
+        corner_width, corner_height = self.corners[0].get_size()
+        return tuple(
+            -(-(2 * (corner + self.padding) + side) // self.bucket) * self.bucket
+            for corner, side in zip((corner_width, corner_height), content_size)
+        )
 
-@lru_cache()
-def ui_vertical_bar_left(height, scale_factor):
-    return ui_vertical_bar_scale(
-        load_sprites_ui().subsurface(constants.UI_BOX_VERTICAL_BAR_LEFT),
-        height,
-        scale_factor,
-    )
+    def frame(self, size: Tuple[int, int]) -> pygame.Surface:
+        frame = self.frames.get(size)
+        if frame is not None:
+            self.frames.move_to_end(size)
+            return frame
+
+        frame = track(self._build(size), ORIGIN_CACHE)
+        self.frames[size] = frame
+        self.cached_bytes += surface_bytes(frame)
+        while self.cached_bytes > self.budget and len(self.frames) > 1:
+            _, evicted = self.frames.popitem(last=False)
+            self.cached_bytes -= surface_bytes(evicted)
+        return frame
+
+    def _build(self, size: Tuple[int, int]) -> pygame.Surface:
+        width, height = size
+        top_left, top_right, bottom_left, bottom_right = self.corners
+        bar_width = width - top_left.get_width() * 2
+        bar_height = height - top_left.get_height() - bottom_left.get_height()
+        bar_top = self._scale(self.bar_top, width=bar_width)
+        bar_bottom = self._scale(self.bar_bottom, width=bar_width)
+        bar_left = self._scale(self.bar_left, height=bar_height)
+        bar_right = self._scale(self.bar_right, height=bar_height)
+
+        frame = pygame.Surface(size, flags=pygame.SRCALPHA)
+        frame.fill(
+            constants.UI_BOX_BACKGROUND_COLOR_PAPYRUS,
+            (
+                bar_left.get_width(),
+                bar_top.get_height(),
+                width - bar_right.get_width() * 2,
+                height - bar_top.get_height() - bar_bottom.get_height(),
+            ),
+        )
+        frame.blits(
+            [
+                (top_left, (0, 0)),
+                (top_right, (width - top_right.get_width(), 0)),
+                (bottom_left, (0, height - bottom_left.get_height())),
+                (
+                    bottom_right,
+                    (
+                        width - bottom_right.get_width(),
+                        height - bottom_right.get_height(),
+                    ),
+                ),
+                (bar_top, (top_left.get_width(), 0)),
+                (bar_bottom, (top_left.get_width(), height - bar_bottom.get_height())),
+                (bar_left, (0, top_left.get_height())),
+                (bar_right, (width - bar_right.get_width(), top_left.get_height())),
+            ],
+            doreturn=False,
+        )
+        return frame
+
+    def render(
+        self, content: pygame.Surface, target: pygame.Surface = None
+    ) -> Tuple[pygame.Surface, pygame.Rect]:
+        """
+        Frame with content centered on it. When target has the size of the
+        frame it's drawn into it instead of a new surface.
+        """
+        frame = self.frame(self.size(content.get_size()))
+        if target is None or target.get_size() != frame.get_size():
+            target = frame.copy()
+        else:
+            target.fill((0, 0, 0, 0))
+            target.blit(frame, (0, 0))
+        rect = target.get_rect()
+        target.blit(content, Vector2(rect.center) - Vector2(content.get_size()) / 2)
+        return target, rect
 
 
 @lru_cache()
-def ui_vertical_bar_right(height, scale_factor):
-    return ui_vertical_bar_scale(
-        load_sprites_ui().subsurface(constants.UI_BOX_VERTICAL_BAR_RIGHT),
-        height,
-        scale_factor,
-    )
+def ui_box(scale_factor: int = constants.UI_SCALE_FACTOR) -> NineSlice:
+    return NineSlice(scale_factor)
 
 
 @lru_cache()
 def ui_box_background():
     return load_sprites_ui().subsurface(constants.UI_BOX_BACKGROUND)
-
-
-def build_frame(
-    content_surface: pygame.Surface,
-    rect: pygame.Rect,
-    scale_factor: int = constants.UI_SCALE_FACTOR,
-    padding: int = 10,
-) -> Tuple[pygame.Surface, pygame.Rect]:
-    """
-    Given a surface, rect, and a scale factor, build a decorative frame on it.
-    """
-    content_width, content_height = rect.size
-    # Pieces
-    corner_top_left_surface, corner_top_left_rect = ui_corner_top_left(scale_factor)
-    container_surface = pygame.Surface(
-        (
-            2 * (corner_top_left_rect.width + padding) + content_width,
-            2 * (corner_top_left_rect.height + padding) + content_height,
-        ),
-        flags=pygame.SRCALPHA,
-    )
-    container_rect = container_surface.get_rect()
-
-    corner_bottom_left_surface, corner_bottom_left_rect = ui_corner_bottom_left(
-        scale_factor
-    )
-    corner_bottom_right_surface, corner_bottom_right_rect = ui_corner_bottom_right(
-        scale_factor
-    )
-    corner_top_right_surface, corner_top_right_rect = ui_corner_top_right(scale_factor)
-
-    horizontal_bar_width = container_rect.width - corner_top_left_rect.width * 2
-    vertical_bar_height = (
-        container_rect.height
-        - corner_bottom_left_rect.height
-        - corner_top_left_rect.height
-    )
-
-    bar_top_surface, bar_top_rect = ui_bar_top(horizontal_bar_width, scale_factor)
-    bar_bottom_surface, bar_bottom_rect = ui_bar_bottom(
-        horizontal_bar_width, scale_factor
-    )
-    bar_left_surface, bar_left_rect = ui_vertical_bar_left(
-        vertical_bar_height, scale_factor
-    )
-    bar_right_surface, bar_right_rect = ui_vertical_bar_right(
-        vertical_bar_height, scale_factor
-    )
-
-    background = pygame.Surface(
-        (
-            container_rect.width - bar_right_rect.width * 2,
-            container_rect.height - bar_top_rect.height - bar_bottom_rect.height,
-        )
-    )
-    background.fill(constants.UI_BOX_BACKGROUND_COLOR_PAPYRUS)
-
-    container_surface.blits(
-        [
-            (background, (bar_left_rect.right, bar_top_rect.bottom)),
-            (corner_top_left_surface, (0, 0)),
-            (
-                corner_top_right_surface,
-                (container_rect.right - corner_top_right_rect.width, 0),
-            ),
-            (
-                corner_bottom_left_surface,
-                (0, container_rect.bottom - corner_bottom_left_rect.height),
-            ),
-            (
-                corner_bottom_right_surface,
-                (
-                    container_rect.right - corner_bottom_right_rect.width,
-                    container_rect.bottom - corner_bottom_right_rect.height,
-                ),
-            ),
-            (bar_top_surface, (corner_top_left_rect.right, corner_top_left_rect.top)),
-            (
-                bar_bottom_surface,
-                (
-                    corner_top_left_rect.right,
-                    container_rect.bottom - bar_bottom_rect.height,
-                ),
-            ),
-            (bar_left_surface, (0, corner_top_left_rect.bottom)),
-            (
-                bar_right_surface,
-                (
-                    container_rect.right - bar_right_rect.width,
-                    corner_top_left_rect.bottom,
-                ),
-            ),
-            (
-                content_surface,
-                Vector2(container_rect.center)
-                - Vector2(content_surface.get_size()) / 2,
-            ),
-        ]
-    )
-    return container_surface, container_surface.get_rect()
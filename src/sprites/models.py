@@ -1,7 +1,6 @@
-import time
+import math
 import random
 import logging
-from pathlib import Path
 from math import copysign
 from typing import Tuple
 
@@ -13,10 +12,21 @@ from pygame.math import Vector2
 import settings
 import constants
 from sprites.images import load_sprites, load_player_walking
-from transformations import greyscale, redscale, slice_into_particles
+from render import TextureView, textured
+from collisions import baked_mask, Sweep
+from clock import get_game_clock
+from camera import get_camera
+from transformations import greyscale, redscale, iter_particles
+from scheduler import get_scheduler, in_batches, PRIORITY_EFFECTS
+from sounds import load_sound, play, stop
+from state import WalkerState, EnemyState, PotionState, WeaponState
 
 logger = logging.getLogger(__name__)
 
+# Particles are spawned over several frames, they draw from their own random
+# numbers so gameplay doesn't depend on how fast that goes.
+effects_random = random.Random()
+
 
 class Item(Sprite):
     RED = constants.POTION_RED
@@ -31,18 +41,33 @@ class Item(Sprite):
 
         self.color = color
         skin_rect = pygame.Rect(constants.POTION_COLORS[color])
-        self.image = self.original_image.subsurface(skin_rect)
+        self.source_image = self.original_image.subsurface(skin_rect)
         self.image = pygame.transform.scale(
-            self.image, [side * constants.ITEMS_SCALE_FACTOR for side in skin_rect.size]
+            self.source_image,
+            [side * constants.ITEMS_SCALE_FACTOR for side in skin_rect.size],
         )
         self.rect = self.image.get_rect()
         self.spawn(initial_position)
 
+    def texture_view(self) -> TextureView:
+        return TextureView(self.source_image, self.rect.size, 0, False, None)
+
+    @property
+    def mask(self) -> pygame.mask.Mask:
+        return baked_mask(self.texture_view())
+
+    def state(self) -> PotionState:
+        return PotionState(self.color, tuple(self.rect.center))
+
+    def restore(self, state: PotionState):
+        self.rect.center = state.position
+
     def spawn(self, color=None, position=None):
         if not position:
+            world = get_camera().world
             self.rect.center = Vector2(
-                random.randint(100, self.surface.get_width() - 100),
-                random.randint(100, self.surface.get_height() - 100),
+                random.randint(100, world.width - 100),
+                random.randint(100, world.height - 100),
             )
         else:
             self.rect.center = position
@@ -63,8 +88,11 @@ class Particle(Sprite):
         self.image = image
 
         self.initial_position = Vector2(initial_position)
-        self.decay_distance = random.choice(
-            (*([random.randint(100, 200)] * 10), random.randint(250, 400))
+        self.decay_distance = effects_random.choice(
+            (
+                *([effects_random.randint(100, 200)] * 10),
+                effects_random.randint(250, 400),
+            )
         )
         self.rect = self.image.get_rect()
         self.rect.center = initial_position
@@ -73,9 +101,12 @@ class Particle(Sprite):
         self.velocity = Vector2(0, 0)
         self.acceleration = Vector2(0, 0)
 
-        angle = random.randint(-15000, 15000)
-        magnitude = random.choice(
-            (*([random.randint(10, 100)] * 5), random.randint(100, 2500))
+        angle = effects_random.randint(-15000, 15000)
+        magnitude = effects_random.choice(
+            (
+                *([effects_random.randint(10, 100)] * 5),
+                effects_random.randint(100, 2500),
+            )
         )
         magnitude /= 1000
         self.force_to_apply = reference_force_vector.rotate(angle / 1000) * magnitude
@@ -98,8 +129,9 @@ class Particle(Sprite):
         self.apply_force(self.force_to_apply)
         self.apply_friction()
         self.move()
+        # Particles only live while they're seen.
         if (
-            not self.surface.get_rect().contains(self.rect)
+            not get_camera().view.contains(self.rect)
             or self.initial_position.distance_to(self.center_position)
             > self.decay_distance
         ):
@@ -122,12 +154,13 @@ class Walker(Sprite):
 
         # Skin related stuff
         self.image_sequence = image_sequence or list(skin_source.values())
-        self.last_skin_change = 0
+        self.last_skin_change = float("-inf")
         self.current_image = 0
         self.skin_source = skin_source
         self.skin = skin
         self.original_image = loader()
         self.facing = facing
+        self.tint = None
         self.set_skin()
 
         self.initial_position = initial_position
@@ -140,10 +173,8 @@ class Walker(Sprite):
         self.acceleration = Vector2(0, 0)
 
         # Sound
-        self.knock = pygame.mixer.Sound(Path(constants.SFX_WALL_HIT))
-        self.knock.set_volume(settings.SFX_VOLUME)
-        self.footsteps = pygame.mixer.Sound(Path(constants.SFX_FOOTSTEPS))
-        self.footsteps.set_volume(settings.SFX_VOLUME)
+        self.knock = load_sound(constants.SFX_WALL_HIT)
+        self.footsteps = load_sound(constants.SFX_FOOTSTEPS)
 
     def next_image(self):
         self.current_image = (self.current_image + 1) % 2
@@ -155,17 +186,87 @@ class Walker(Sprite):
         self.center_position.update(self.initial_position)
         self.rect.center = self.center_position
 
+    def state(self) -> WalkerState:
+        return WalkerState(
+            self.skin,
+            self.facing,
+            tuple(self.center_position),
+            tuple(self.velocity),
+        )
+
+    def restore(self, state: WalkerState):
+        self.facing = state.facing
+        self.center_position.update(state.position)
+        self.rect.center = self.center_position
+        self.velocity.update(state.velocity)
+        self.acceleration = Vector2(0, 0)
+        self.tint = None
+        # Draw the image again for the facing of the snapshot.
+        self.last_skin_change = float("-inf")
+        self.set_skin()
+
+    def checkpoint(self) -> tuple:
+        """
+        What rewind() needs to take the walker back a few frames, for rollbacks
+        (see netplay.py). Unlike state() it keeps the images, so going back
+        doesn't draw them again.
+        """
+        return (
+            tuple(self.center_position),
+            tuple(self.velocity),
+            self.facing,
+            self.current_image,
+            self.last_skin_change,
+            self.tint,
+            self.image,
+            self.source_image,
+        )
+
+    def rewind(self, checkpoint: tuple):
+        (
+            position,
+            velocity,
+            self.facing,
+            self.current_image,
+            self.last_skin_change,
+            self.tint,
+            self.image,
+            self.source_image,
+        ) = checkpoint
+        self.center_position.update(position)
+        self.rect.center = self.center_position
+        self.velocity.update(velocity)
+        self.acceleration = Vector2(0, 0)
+
     def set_skin(self):
-        if time.time() - self.last_skin_change > 0.2:
-            self.last_skin_change = time.time()
+        now = get_game_clock().time()
+        if now - self.last_skin_change > 0.2:
+            self.last_skin_change = now
             skin_rect = pygame.rect.Rect(self.skin_source.get(self.skin))
-            self.image = self.original_image.subsurface(self.next_image())
+            self.source_image = self.original_image.subsurface(self.next_image())
+            if textured() and hasattr(self, "image"):
+                # The renderer scales and flips the atlas region on its own.
+                return
             self.image = pygame.transform.scale(
-                self.image, [side * constants.SCALE_FACTOR for side in skin_rect.size]
+                self.source_image,
+                [side * constants.SCALE_FACTOR for side in skin_rect.size],
             )
             if self.facing == constants.FACING_WEST:
                 self.image = pygame.transform.flip(self.image, True, False)
 
+    def texture_view(self) -> TextureView:
+        return TextureView(
+            self.source_image,
+            self.rect.size,
+            0,
+            self.facing == constants.FACING_WEST,
+            self.tint,
+        )
+
+    @property
+    def mask(self) -> pygame.mask.Mask:
+        return baked_mask(self.texture_view())
+
     def apply_force(self, force: Vector2):
         self.acceleration += force
 
@@ -183,25 +284,49 @@ class Walker(Sprite):
         self.rect.center = self.center_position
         self.acceleration = Vector2(0, 0)
 
+    def avoid_obstacles(self, flow_field, previous_position: Vector2):
+        # Walkers that spawned inside an obstacle are let out.
+        if (
+            flow_field is None
+            or flow_field.blocked_at(previous_position)
+            or not flow_field.blocked_at(self.center_position)
+        ):
+            return
+        if not flow_field.blocked_at((self.center_position.x, previous_position.y)):
+            self.center_position.y = previous_position.y
+            self.velocity.y = 0
+        elif not flow_field.blocked_at((previous_position.x, self.center_position.y)):
+            self.center_position.x = previous_position.x
+            self.velocity.x = 0
+        else:
+            self.center_position.update(previous_position)
+            self.velocity.update(0, 0)
+        self.rect.center = self.center_position
+
     def bounce(self):
         FRICTION = 0.2
+        world = get_camera().world
         if not 0 < self.center_position.x:
             self.center_position.x = 0
             self.velocity.x *= -1 * FRICTION
-            self.knock.play()
-        elif not self.center_position.x < self.surface.get_width():
-            self.center_position.x = self.surface.get_width()
+            play(self.knock)
+        elif not self.center_position.x < world.width:
+            self.center_position.x = world.width
             self.velocity.x *= -1 * FRICTION
-            self.knock.play()
+            play(self.knock)
 
         if not 70 < self.center_position.y:
             self.center_position.y = 70
             self.velocity.y *= -1 * FRICTION
-            self.knock.play()
-        elif not self.center_position.y < self.surface.get_height() - 20:
-            self.center_position.y = self.surface.get_height() - 20
+            play(self.knock)
+        elif not self.center_position.y < world.height - 20:
+            self.center_position.y = world.height - 20
             self.velocity.y *= -1 * FRICTION
-            self.knock.play()
+            play(self.knock)
+
+
+# Particles added to the sprites in one step of a scheduled task.
+PARTICLES_PER_STEP = 100
 
 
 class Enemy(Walker):
@@ -213,10 +338,9 @@ class Enemy(Walker):
     def __init__(self, *args, particles_group, **kwargs):
         super().__init__(*args, skin_source=constants.MOBS_DICT, **kwargs)
         self.layer = constants.LAYER_ENEMY
-        self.banishing_sound = pygame.mixer.Sound(Path(constants.SFX_ENEMY_KILLED))
-        self.banishing_sound.set_volume(settings.SFX_VOLUME)
+        self.banishing_sound = load_sound(constants.SFX_ENEMY_KILLED)
         self.hearts = 3
-        self.last_hit = time.time()
+        self.last_hit = float("-inf")
         self._back_to_normal = False
         # Change style of image
         self.image_state = self.IMAGE_STATE_NORMAL
@@ -224,19 +348,54 @@ class Enemy(Walker):
         self.restore_image = False
         self.last_player_position = Vector2(1, 0)
         self.particles_group = particles_group
+        # Crowd behaviour, crowd_force is refreshed by Crowd.update every frame.
+        self.separation_weight, self.cohesion_weight = constants.MOB_CROWD_WEIGHTS.get(
+            self.skin, constants.MOB_CROWD_WEIGHTS_DEFAULT
+        )
+        self.crowd_force = Vector2(0, 0)
+
+    def state(self) -> EnemyState:
+        return EnemyState(*super().state(), self.hearts)
+
+    def restore(self, state: EnemyState):
+        super().restore(state)
+        self._image = self.image.copy()
+        self.hearts = state.hearts
+        self.last_hit = float("-inf")
+        self.image_state = self.IMAGE_STATE_NORMAL
+        self.crowd_force.update(0, 0)
+
+    def checkpoint(self) -> tuple:
+        return (
+            super().checkpoint(),
+            self.hearts,
+            self.last_hit,
+            self.image_state,
+            tuple(self.last_player_position),
+        )
+
+    def rewind(self, checkpoint: tuple):
+        walker, self.hearts, self.last_hit, self.image_state, last_position = checkpoint
+        super().rewind(walker)
+        self.last_player_position.update(last_position)
 
     def change_facing(self):
         if self.velocity.x > 0 and not self.facing == constants.FACING_EAST:
             self.facing = constants.FACING_EAST
-            self.image = pygame.transform.flip(self.image, True, False)
+            if not textured():
+                self.image = pygame.transform.flip(self.image, True, False)
         elif self.velocity.x < 0 and not self.facing == constants.FACING_WEST:
             self.facing = constants.FACING_WEST
-            self.image = pygame.transform.flip(self.image, True, False)
+            if not textured():
+                self.image = pygame.transform.flip(self.image, True, False)
 
     def limit_vector(self, vector, bottom, top):
         mag = vector.magnitude()
         if mag > top:
             force = vector.normalize() * top
+        elif not mag:
+            # Right on top of the player, there's nowhere to go.
+            force = Vector2(0, 0)
         elif mag < bottom:
             force = vector.normalize() * bottom
         else:
@@ -248,24 +407,23 @@ class Enemy(Walker):
         return v.x != copysign(v.x, w.x) or v.y != copysign(v.y, w.y)
 
     def being_repeled(self):
-        return (time.time_ns() - self.last_hit) <= 150_000_000
+        return (get_game_clock().time() - self.last_hit) <= 0.15
 
     def hurt(self, player_position: Vector2, hearts: int = 1):
         if not self.being_repeled():
             self.hearts -= 1
             self.apply_force(-self.velocity)
             self.apply_force((self.center_position - player_position).normalize() * 15)
-            self.last_hit = time.time_ns()
-            self.image = redscale(self.image)
+            self.last_hit = get_game_clock().time()
+            if textured():
+                self.tint = constants.HURT_TINT
+            else:
+                self.image = redscale(self.image)
             self.image_state = self.IMAGE_STATE_HURT
             self.last_player_position.update(player_position)
-            print(
-                "Before entering slice_into_particles",
-                self._image,
-                self.rect,
-                self.center_position - player_position,
-            )
-            particles = slice_into_particles(
+            if get_game_clock().replaying or not get_camera().visible(self.rect):
+                return
+            particles = iter_particles(
                 self._image,
                 rect=self.rect,
                 size=3,
@@ -275,7 +433,10 @@ class Enemy(Walker):
                 surface=self.surface,
                 reference_force_vector=self.center_position - player_position,
             )
-            self.particles_group.add(particles)
+            get_scheduler().add(
+                in_batches(particles, PARTICLES_PER_STEP, self.particles_group.add),
+                PRIORITY_EFFECTS,
+            )
 
     def update_image_state(self):
         if self.image_state == self.IMAGE_STATE_HURT and not self.being_repeled():
@@ -284,45 +445,37 @@ class Enemy(Walker):
             return self.die(self.last_player_position)
 
     def die(self, player_position: Vector2):
-        PIECE_SIZE = 3
-
-        SKIP = 1
         self.kill()
-        self.banishing_sound.play()
-        # Slice squares the image apart.
-        x_slices = self.rect.width // PIECE_SIZE
-        y_slices = self.rect.height // PIECE_SIZE
-        height = PIECE_SIZE
-        width = PIECE_SIZE
-
-        image = self._image.copy()
-        particles = []
-        for slice_x_position in range(0, x_slices, SKIP):
-            vertical_offset = 0
-            for slice in range(0, y_slices, SKIP):
-                subsurf = image.subsurface(
-                    slice_x_position * width, vertical_offset, width, height
-                )
-                x, y = subsurf.get_offset()
-                particles.append(
-                    Particle(
-                        surface=self.surface,
-                        image=subsurf,
-                        initial_position=(self.rect.x + x, self.rect.y + y),
-                        reference_force_vector=self.center_position - player_position,
-                    )
-                )
-                vertical_offset += height * SKIP
-
-        if self.particles_group is not None:
-            self.particles_group.add(particles)
+        play(self.banishing_sound)
+        if (
+            self.particles_group is not None
+            and not get_game_clock().replaying
+            and get_camera().visible(self.rect)
+        ):
+            particles = iter_particles(
+                self._image,
+                rect=self.rect,
+                size=3,
+                skip=1,
+                particle_class=Particle,
+                surface=self.surface,
+                reference_force_vector=self.center_position - player_position,
+            )
+            get_scheduler().add(
+                in_batches(particles, PARTICLES_PER_STEP, self.particles_group.add),
+                PRIORITY_EFFECTS,
+            )
 
     def update(self, *args, **kwargs) -> None:
         player_position = Vector2(kwargs.get("player_position"))
+        flow_field = kwargs.get("flow_field")
         # Follow the player
-        distance_vector = Vector2(player_position - self.center_position)
-        distance_vector.scale_to_length(distance_vector.magnitude())
-        force = self.limit_vector(distance_vector, 0.005, 0.1)
+        force = self.limit_vector(player_position - self.center_position, 0.005, 0.1)
+        if flow_field is not None:
+            # Around obstacles, the shared flow field knows the way.
+            direction = flow_field.direction_at(self.center_position)
+            if any(direction):
+                force = Vector2(direction) * force.magnitude()
 
         # Extra force if going in "opposite" directions
         if Enemy.different_quadrants(self.velocity, player_position):
@@ -330,12 +483,18 @@ class Enemy(Walker):
 
         self.update_image_state()
         if self.image_state == self.IMAGE_STATE_BACK_TO_NORMAL:
-            self.image = self._image.copy()
+            if textured():
+                self.tint = None
+            else:
+                self.image = self._image.copy()
             self.image_state = self.IMAGE_STATE_NORMAL
 
+        previous_position = Vector2(self.center_position)
         self.apply_force(force)
+        self.apply_force(self.crowd_force)
         self.move()
         self.bounce()
+        self.avoid_obstacles(flow_field, previous_position)
         self.change_facing()
 
 
@@ -361,37 +520,44 @@ class Player(Walker):
             logger.debug("Should flip facing WEST")
             self.facing = constants.FACING_WEST
 
-    def on_key_pressed(self, event_key, keys):
-        if not self.walking:
-            self.walking = True
-            self.footsteps.play()
-        if event_key == settings.KEY_RIGHT:
-            self.direction += (1, 0)
-            self.change_facing(self.direction.x)
-        if event_key == settings.KEY_LEFT:
-            self.direction += (-1, 0)
+    def restore(self, state: WalkerState):
+        super().restore(state)
+        self.direction.update(0, 0)
+        self.walking = False
+        self.footsteps.stop()
+
+    def checkpoint(self) -> tuple:
+        return super().checkpoint(), tuple(self.direction), self.walking
+
+    def rewind(self, checkpoint: tuple):
+        walker, direction, self.walking = checkpoint
+        super().rewind(walker)
+        self.direction.update(direction)
+
+    def steer(self, direction: Vector2) -> bool:
+        """
+        Returns whether the direction changed.
+        """
+        changed = self.direction != direction
+        self.direction.update(direction)
+        if self.direction.x:
             self.change_facing(self.direction.x)
-        if event_key == settings.KEY_UP:
-            self.direction += (0, -1)
-        if event_key == settings.KEY_DOWN:
-            self.direction += (0, 1)
-
-    def on_key_released(self, event_key, keys):
-        if event_key in [settings.KEY_RIGHT, settings.KEY_LEFT]:
-            self.direction.update(0, self.direction.y)
-
-        if event_key in [settings.KEY_UP, settings.KEY_DOWN]:
-            self.direction.update(self.direction.x, 0)
 
-        if self.walking and self.direction == (0, 0):
+        if not self.walking and self.direction != (0, 0):
+            self.walking = True
+            play(self.footsteps)
+        elif self.walking and self.direction == (0, 0):
             self.walking = False
-            self.footsteps.stop()
+            stop(self.footsteps)
             self.velocity.update(0, 0)
             self.acceleration.update(0, 0)
+        return changed
 
     def update(self, *args, **kwargs) -> None:
+        previous_position = Vector2(self.center_position)
         self.move()
         self.bounce()
+        self.avoid_obstacles(kwargs.get("flow_field"), previous_position)
 
     def move(self):
         magnitude = 1.5
@@ -413,13 +579,12 @@ class Weapon(Sprite):
         self.surface = surface
         self.original_image = image
         self.owner = owner
-        self.sound = pygame.mixer.Sound(constants.SFX_SWORD_BRANDISHING)
-        self.sound.set_volume(settings.SFX_VOLUME)
+        self.sound = load_sound(constants.SFX_SWORD_BRANDISHING)
 
         weapon_rect = pygame.Rect(constants.BASIC_SWORD)
-        self.image = self.original_image.subsurface(weapon_rect)
+        self.source_image = self.original_image.subsurface(weapon_rect)
         self.image = pygame.transform.scale(
-            self.image,
+            self.source_image,
             [side * constants.ITEMS_SCALE_FACTOR for side in weapon_rect.size],
         )
         self._image = self.image.copy()
@@ -434,9 +599,21 @@ class Weapon(Sprite):
         self.rotation_vector = self.rect.center - self.pivot
         self.sword_angle = 0
         self.angle_diff = 0.5
+        # The blade goes from the pivot to twice the rotation vector.
+        self.blade_angle = self.rotation_vector.as_polar()[1]
+        self.swing = Sweep(
+            tuple(self.pivot),
+            self.blade_angle,
+            self.blade_angle,
+            self.rotation_vector.length() * 2,
+            self.rect.width / 2,
+        )
+        # Swings go through the same few angles, rotated images are kept.
+        self.rotated_images = {}
 
     def update(self, *args, **kwargs):
         FACING = 1 if self.owner.facing == constants.FACING_EAST else -1
+        previous_angle = self.sword_angle
         if self.brandishing == Weapon.DOWN:
             self.sword_angle += self.angle_diff
             if self.sword_angle >= 170:
@@ -449,18 +626,86 @@ class Weapon(Sprite):
             self.brandishing = Weapon.STATIC
 
         self.angle_diff += 9
-        self.image = pygame.transform.rotate(self._image, -FACING * self.sword_angle)
+        if textured():
+            # Same bounding box transform.rotate would give, without rotating.
+            width, height = self._image.get_size()
+            radians = math.radians(self.sword_angle)
+            self.rect = pygame.Rect(
+                0,
+                0,
+                abs(width * math.cos(radians)) + abs(height * math.sin(radians)),
+                abs(width * math.sin(radians)) + abs(height * math.cos(radians)),
+            )
+        else:
+            angle = -FACING * self.sword_angle
+            self.image = self.rotated_images.get(angle)
+            if self.image is None:
+                self.image = self.rotated_images[angle] = pygame.transform.rotate(
+                    self._image, angle
+                )
+            self.rect = self.image.get_rect()
         rotated_vector = self.rotation_vector.rotate(FACING * self.sword_angle)
         relocation_vector = rotated_vector - self.rotation_vector
-        self.rect = self.image.get_rect()
         self.rect.center = self.owner.rect.center
         self.rect.centerx += FACING * (self.owner.rect.width / 1.5)
         self.rect.centery -= self.owner.rect.height / 4
         self.rect.center += relocation_vector
+        pivot = Vector2(self.rect.center) - rotated_vector
+        self.swing = self.swing._replace(
+            pivot=tuple(pivot),
+            start=self.blade_angle + FACING * previous_angle,
+            end=self.blade_angle + FACING * self.sword_angle,
+        )
         if not self.owner.alive():
             self.kill()
 
-    def on_key_pressed(self, event_key, keys):
-        if keys[pygame.K_SPACE] and self.alive() and self.brandishing == Weapon.STATIC:
+    def texture_view(self) -> TextureView:
+        facing = 1 if self.owner.facing == constants.FACING_EAST else -1
+        return TextureView(
+            self.source_image,
+            self._image.get_size(),
+            facing * self.sword_angle,
+            False,
+            None,
+        )
+
+    def state(self) -> WeaponState:
+        return WeaponState(
+            self.alive(), self.brandishing, self.sword_angle, self.angle_diff
+        )
+
+    def restore(self, state: WeaponState):
+        self.brandishing = state.brandishing
+        self.sword_angle = state.sword_angle
+        self.angle_diff = state.angle_diff
+
+    def checkpoint(self) -> tuple:
+        return (
+            self.brandishing,
+            self.sword_angle,
+            self.angle_diff,
+            tuple(self.rect),
+            self.swing,
+            self.image,
+        )
+
+    def rewind(self, checkpoint: tuple):
+        (
+            self.brandishing,
+            self.sword_angle,
+            self.angle_diff,
+            rect,
+            self.swing,
+            self.image,
+        ) = checkpoint
+        self.rect = pygame.Rect(rect)
+
+    def attack(self) -> bool:
+        """
+        Returns whether a swing started.
+        """
+        if self.alive() and self.brandishing == Weapon.STATIC:
             self.brandishing = Weapon.DOWN
-            self.sound.play()
+            play(self.sound)
+            return True
+        return False
@@ -1,4 +1,3 @@
-import time
 from enum import IntEnum
 from pathlib import Path
 import logging
@@ -6,25 +5,30 @@ import logging
 import pygame
 import pygame.freetype
 from pygame.sprite import Sprite
-from pygame.transform import scale
 
 import settings
+from clock import get_game_clock
 from constants import (
     FONT_PATH_HELPER,
     FONT_PATH_MAIN,
     FONT_PATH_PAUSED,
     FONT_PATH_SECONDARY,
+    LAYER_PARTICLE,
+    LAYER_SCORE,
     SFX_MENU_ITEM_CHANGED,
     UI_BOX_TEXT_COLOR_PAPYRUS,
     UI_BOX_BACKGROUND_COLOR_PAPYRUS,
 )
-from .images import build_frame
+from .images import ui_box
 
 logger = logging.getLogger()
 
 
 class Score(Sprite):
     # TODO: This class might evolve into a GameState class
+    # Stays in place when the camera moves.
+    screen_space = True
+
     def __init__(self, surface, max_score, seconds_to_leave=3):
         super().__init__()
         self.surface = surface
@@ -38,26 +42,29 @@ class Score(Sprite):
         self.seconds_to_leave = seconds_to_leave
         self.transition_seconds = 1
         self.hidden = False
-        self.image, self.rect = self.render_surface()
+        self.text = None
+        self.update()
 
     def quit_transition(self):
-        if self.win_timestamp:
+        if self.win_timestamp is not None:
             return (
                 self.seconds_to_leave - self.transition_seconds
-                <= (time.time() - self.win_timestamp)
+                <= (get_game_clock().time() - self.win_timestamp)
                 <= self.seconds_to_leave
             )
         else:
             return False
 
     def is_time_to_leave(self):
-        if self.win_timestamp:
-            return (time.time() - self.win_timestamp) >= self.seconds_to_leave
+        if self.win_timestamp is not None:
+            return (
+                get_game_clock().time() - self.win_timestamp
+            ) >= self.seconds_to_leave
         else:
             return False
 
     def won(self):
-        return self.value == self.max_score
+        return self.max_score is not None and self.value == self.max_score
 
     def hide(self):
         self.hidden = True
@@ -68,20 +75,74 @@ class Score(Sprite):
     def increase(self, amount=1):
         self.value += 1
         if self.value == self.max_score:
-            self.win_timestamp = time.time()
+            self.win_timestamp = get_game_clock().time()
 
-    def render_surface(self):
-        score_surface, score_rect = self.fnt.render(
-            f"Potions left: {self.max_score - self.value}",
+    def reset(self, value=0):
+        self.value = value
+        self.win_timestamp = get_game_clock().time() if self.won() else None
+
+    def render_text(self) -> str:
+        if self.max_score is None:
+            return f"Potions: {self.value}"
+        return f"Potions left: {self.max_score - self.value}"
+
+    def render_surface(self, text):
+        score_surface, _ = self.fnt.render(
+            text,
             pygame.color.Color(UI_BOX_TEXT_COLOR_PAPYRUS),
         )
-        score_rect.center = [(score_rect.width / 2) + 5, (score_rect.height / 2) + 5]
-        return build_frame(score_surface, score_rect)
+        return ui_box().render(score_surface)
 
     def update(self, *args, **kwargs) -> None:
+        # The box is only rendered again when the text changes.
+        text = self.render_text()
+        if text != self.text:
+            self.text = text
+            self.image, self.rect = self.render_surface(text)
+        self.image.set_alpha(50 if self.hidden else None)
+
+
+class EntityCounter(Sprite):
+    screen_space = True
+
+    def __init__(
+        self, surface, all_sprites, mobs_sprites, capacity, every_frames=15, dirty=None
+    ):
+        super().__init__()
+        self.layer = LAYER_SCORE
+        self.surface = surface
+        self.all_sprites = all_sprites
+        self.mobs_sprites = mobs_sprites
+        self.capacity = capacity
+        self.dirty = dirty
+        self.every_frames = every_frames
+        self.frames = 0
+        self.fnt = pygame.freetype.Font(FONT_PATH_MAIN, 12)
+        self.fnt.pad = True
         self.image, self.rect = self.render_surface()
-        if self.hidden:
-            self.image.set_alpha(50)
+
+    def render_surface(self):
+        text = (
+            f"Entities: {len(self.all_sprites)}  Mobs: {len(self.mobs_sprites)}  "
+            f"Particles: {self.particles()}  FPS: {self.capacity.fps():.0f}"
+        )
+        if self.dirty:
+            text += f"  Update: {self.dirty.describe()}"
+        counter_surface, _ = self.fnt.render(
+            text, pygame.color.Color(UI_BOX_TEXT_COLOR_PAPYRUS)
+        )
+        image, rect = ui_box().render(counter_surface)
+        rect.topright = (self.surface.get_width() - 5, 5)
+        return image, rect
+
+    def particles(self) -> int:
+        return self.all_sprites.count(LAYER_PARTICLE)
+
+    def update(self, *args, **kwargs) -> None:
+        # Rendering text every frame would skew the numbers it shows.
+        self.frames += 1
+        if self.frames % self.every_frames == 0:
+            self.image, self.rect = self.render_surface()
 
 
 class Option(Sprite):
@@ -115,6 +176,8 @@ class MainMenu(Sprite):
         "options",
         (
             "START",
+            "ENDLESS",
+            "COOP",
             "CONTROLS",
             "CREDITS",
             "QUIT",
@@ -131,6 +194,8 @@ class MainMenu(Sprite):
         self.selected_option = MainMenu.options.START
         self.options = [
             Option(surface, text="NEW GAME"),
+            Option(surface, text="ENDLESS"),
+            Option(surface, text="CO-OP"),
             Option(surface, text="CONTROLS"),
             Option(surface, text="CREDITS"),
             Option(surface, text="QUIT"),
@@ -172,6 +237,8 @@ class MainMenu(Sprite):
 
 
 class Banner(Sprite):
+    screen_space = True
+
     def __init__(self, screen: pygame.Surface, main_text, secondary_text):
         super().__init__()
         self.main_text = main_text
@@ -180,18 +247,25 @@ class Banner(Sprite):
         self.main_fnt = pygame.freetype.Font(FONT_PATH_MAIN, 52)
         self.main_fnt.pad = True
         self.secondary_fnt = pygame.freetype.Font(FONT_PATH_SECONDARY, 22)
+        self.rendered = False
 
-    def update(self, *args, **kwargs):
+    def render_steps(self):
+        """
+        Renders the banner one text at a time, yielding in between, so it can
+        run as a scheduled task. The texts don't change, so it's done once.
+        """
         main_surface, _ = self.main_fnt.render(
             text=self.main_text,
             fgcolor=pygame.color.Color(UI_BOX_BACKGROUND_COLOR_PAPYRUS),
         )
         main_rect = main_surface.get_rect()
+        yield
 
         secondary_surface, _ = self.secondary_fnt.render(
             text=self.secondary_text,
             fgcolor=pygame.color.Color(UI_BOX_BACKGROUND_COLOR_PAPYRUS),
         )
+        yield
         secondary_rect = main_rect.copy()
         secondary_rect.y += secondary_rect.height
 
@@ -210,76 +284,36 @@ class Banner(Sprite):
         )
         self.rect = self.image.get_rect()
 
-        # self.image, self.rect = build_frame(self.image, self.rect)
+        # self.image, self.rect = ui_box().render(self.image)
         self.rect.center = self.screen.get_rect().center
+        self.rendered = True
+
+    def update(self, *args, **kwargs):
+        if not self.rendered:
+            for _ in self.render_steps():
+                pass
 
 
 class EphemeralBanner(Banner):
     def __init__(self, expiration, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.creation = time.time()
-        self.expiration = expiration
-
-    def update(self, *args, **kwargs):
-        super().update()
-        if time.time() - self.creation >= self.expiration:
-            self.kill()
-
-
-class EphemeralVisualEffect(Sprite):
-    def __init__(self, screen, image, expiration, *args, **kwargs):
-        super().__init__(*args)
-        self.screen = screen
-        self.image = scale(image, screen.get_size())
-        self.rect = image.get_rect()
-        self.creation = time.time()
+        self.creation = get_game_clock().time()
         self.expiration = expiration
 
     def update(self, *args, **kwargs):
         super().update()
-        if time.time() - self.creation >= self.expiration:
+        if get_game_clock().time() - self.creation >= self.expiration:
             self.kill()
 
 
-class PlayerKilledBanner(Sprite):
+class PlayerKilledBanner(Banner):
     def __init__(self, screen: pygame.Surface):
-        super().__init__()
-        self.main_text = "Mastering alchemy is not that easy!"
-        self.secondary_text = "Press R to restart, or ESC to exit"
-        self.screen = screen
-        self.main_fnt = pygame.freetype.Font(FONT_PATH_MAIN, 52)
-        self.secondary_fnt = pygame.freetype.Font(FONT_PATH_SECONDARY, 22)
-        self.main_fnt.pad = self.secondary_fnt.pad = True
-
-    def update(self, *args, **kwargs):
-        main_surface, _ = self.main_fnt.render(
-            text=self.main_text,
-            fgcolor=pygame.color.Color(UI_BOX_BACKGROUND_COLOR_PAPYRUS),
-        )
-        main_rect = main_surface.get_rect()
-
-        secondary_surface, _ = self.secondary_fnt.render(
-            text=self.secondary_text,
-            fgcolor=pygame.color.Color(UI_BOX_BACKGROUND_COLOR_PAPYRUS),
+        super().__init__(
+            screen,
+            main_text="Mastering alchemy is not that easy!",
+            secondary_text="Press R to restart, or ESC to exit",
         )
-        secondary_rect = main_surface.get_rect()
-        secondary_rect.y += main_rect.height
-
-        self.image = pygame.surface.Surface(
-            main_rect.union(secondary_rect).size, flags=pygame.SRCALPHA
-        )
-
-        main_rect.centerx = self.image.get_rect().centerx
-        secondary_rect.centerx = main_rect.centerx
-
-        self.image.blits(
-            [
-                (main_surface, main_rect),
-                (secondary_surface, secondary_rect),
-            ]
-        )
-        self.rect = self.image.get_rect()
-        self.rect.center = self.screen.get_rect().center
+        self.secondary_fnt.pad = True
 
 
 class PauseBanner(Sprite):
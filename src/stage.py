@@ -0,0 +1,70 @@
+import time
+import asyncio
+import logging
+from typing import Coroutine, Generator
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """
+    Scene stack on one asyncio loop. Scenes are coroutines that await frame()
+    at the end of every frame, the time left until the next one goes to the
+    background tasks given to spawn(). Those run between frames, never during
+    one, and should await often, a long step delays the next frame.
+
+    push() runs a scene on top of the current one, which stays suspended,
+    surfaces and all, until the pushed scene ends and it's resumed.
+    """
+
+    def __init__(self):
+        self.scenes = []
+        self.tasks = set()
+        self.last_frame = time.perf_counter()
+
+    def run(self, scene, *args, **kwargs):
+        return asyncio.run(self._main(scene, *args, **kwargs))
+
+    async def _main(self, scene, *args, **kwargs):
+        try:
+            return await self.push(scene, *args, **kwargs)
+        finally:
+            for task in self.tasks:
+                task.cancel()
+
+    async def push(self, scene, *args, **kwargs):
+        self.scenes.append(scene)
+        try:
+            return await scene.play(self, *args, **kwargs)
+        finally:
+            self.scenes.pop()
+            if self.scenes:
+                self.scenes[-1].resume()
+
+    async def frame(self, framerate: float = None):
+        """
+        Ends a frame. Without a framerate the next one starts right after the
+        background tasks that are ready had their turn.
+        """
+        delay = 0.0
+        if framerate:
+            delay = self.last_frame + 1 / framerate - time.perf_counter()
+        await asyncio.sleep(max(delay, 0.0))
+        self.last_frame = time.perf_counter()
+
+    def spawn(self, coroutine: Coroutine) -> asyncio.Task:
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task: asyncio.Task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Background task failed.", exc_info=task.exception())
+
+    @staticmethod
+    async def steps(task: Generator):
+        # Scheduler tasks (see scheduler.py) taken one step per turn.
+        for _ in task:
+            await asyncio.sleep(0)
@@ -0,0 +1,66 @@
+import json
+import random
+import logging
+from collections import namedtuple
+from pathlib import Path
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+WalkerState = namedtuple("WalkerState", ["skin", "facing", "position", "velocity"])
+EnemyState = namedtuple("EnemyState", [*WalkerState._fields, "hearts"])
+PotionState = namedtuple("PotionState", ["color", "position"])
+WeaponState = namedtuple(
+    "WeaponState", ["alive", "brandishing", "sword_angle", "angle_diff"]
+)
+GameState = namedtuple(
+    "GameState",
+    [
+        "endless",
+        "level",
+        "score",
+        # None when the player is dead.
+        "player",
+        "weapon",
+        "enemies",
+        "potions",
+        "random_state",
+    ],
+)
+
+
+def restore_random_state(state):
+    version, internal, gauss = state
+    random.setstate((version, tuple(internal), gauss))
+
+
+def to_json(state: GameState) -> str:
+    return json.dumps(state)
+
+
+def from_json(text: str) -> GameState:
+    values = dict(zip(GameState._fields, json.loads(text)))
+    player = values["player"]
+    return GameState(
+        **{
+            **values,
+            "player": WalkerState(*player) if player is not None else None,
+            "weapon": WeaponState(*values["weapon"]),
+            "enemies": [EnemyState(*enemy) for enemy in values["enemies"]],
+            "potions": [PotionState(*potion) for potion in values["potions"]],
+        }
+    )
+
+
+def save(state: GameState, path=settings.QUICK_SAVE_PATH):
+    Path(path).write_text(to_json(state))
+    logger.info(f"Game saved to {path}.")
+
+
+def load(path=settings.QUICK_SAVE_PATH) -> GameState:
+    path = Path(path)
+    if not path.exists():
+        logger.warning(f"There's no saved game at {path}.")
+        return None
+    return from_json(path.read_text())
@@ -4,16 +4,6 @@ import pygame
 from pygame.math import Vector2
 
 
-def blur(surface: pygame.Surface, level: float) -> pygame.Surface:
-    size = surface.get_size()
-    scale_size = pygame.math.Vector2(size) / level
-    surface = pygame.transform.smoothscale(
-        surface, (int(scale_size.x), int(scale_size.y))
-    )
-    surface = pygame.transform.smoothscale(surface, size)
-    return surface
-
-
 def greyscale(surface: pygame.Surface):
     surface_copy = surface.copy()
     arr = pygame.surfarray.pixels3d(surface_copy)
@@ -39,7 +29,7 @@ def redscale(surface: pygame.Surface, intensity=2):
     return surface_copy
 
 
-def slice_into_particles(
+def iter_particles(
     image: pygame.Surface,
     rect: pygame.Rect,
     size: int,
@@ -54,24 +44,24 @@ def slice_into_particles(
     y_slices = rect.height // size
     height = size
     width = size
-
+    # Copied now, the particles may be created after the sprite moved on.
+    rect = rect.copy()
     image = coloring(image.copy())
-    particles = []
-    for slice_x_position in range(0, x_slices, skip):
-        vertical_offset = 0
-        for slice in range(0, y_slices, skip):
-            subsurf = image.subsurface(
-                slice_x_position * width, vertical_offset, width, height
-            )
-            x, y = subsurf.get_offset()
-            particles.append(
-                particle_class(
+
+    def particles():
+        for slice_x_position in range(0, x_slices, skip):
+            vertical_offset = 0
+            for slice in range(0, y_slices, skip):
+                subsurf = image.subsurface(
+                    slice_x_position * width, vertical_offset, width, height
+                )
+                x, y = subsurf.get_offset()
+                yield particle_class(
                     surface=surface,
                     image=subsurf,
                     initial_position=(rect.x + x, rect.y + y),
                     reference_force_vector=reference_force_vector,
                 )
-            )
-            vertical_offset += height * skip
+                vertical_offset += height * skip
 
-    return particles
+    return particles()